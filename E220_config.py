@@ -38,6 +38,7 @@ def get_args():
     parser.add_argument("-p", "--params", nargs="*")
     parser.add_argument("--list", action="store_true")
     parser.add_argument("--apply", action="store_true")
+    parser.add_argument("--radio", type=int, default=0, help="GATE_RADIOS index (GATE only)")
 
     args = parser.parse_args()
 
@@ -66,7 +67,10 @@ def setmode3() :
 def main():
     args = get_args()
 
-    ser = serial.Serial(PORT, BAUD, timeout=None)
+    ## GATEは複数モジュールのうち--radioで指定したモジュールを設定
+    radio = C.GATE_RADIOS[args.radio] if getNodeNO() == 0 else C.radioForNode(getNodeNO())
+    port = radio.get('port', PORT) if getNodeNO() == 0 else PORT
+    ser = serial.Serial(port, BAUD, timeout=None)
 
     if args.model == "E220-900JP":
         if args.write:  # レジスタ書き込み
@@ -318,10 +322,10 @@ def main():
             # --- change HOST ID
             node = getNodeNO()
             if node != 0: 
-                own_channel = C.NODE_CHANNEL
+                own_channel = radio['node_channel']
                 own_address += node
             else :
-                own_channel = C.GATE_CHANNEL
+                own_channel = radio['channel']
 
             ADDH = own_address >> 8
             ADDL = own_address & 0b1111_1111
@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+"""
+SAST パイプラインベンチマーク SAST_benchmark.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Summary:
+N ノード × M センサーの TH-1 計測値（合成データ）を、Nodeの送信からCloud送信データの作成まで
+実際のコードに通して、段階毎の処理時間を計測する（無線・BLE・ネットワークは使わない）。
+  pack    : data_pack() + makeSendDataStream()             （Node 送信フレーム作成）
+  recv    : GateRadio._recv_Data()                         （擬似端末(pty)からフレーム受信 ポーリング待ちを除く）
+  decode  : decode_frame()                                 （Gateway デコード）
+  ingest  : RecordDedupe + useSensor() + appendDataMany()  （Gateway 書込スレッド）
+  judge   : JudgeEngine.load() + judge() + updateNotifyMany()（observer 判定）
+  encode  : Discord通知文・Ambient/GASの送信データ作成      （observer 送信データ作成）
+段階毎に スループット（レコード/秒）と p50/p99 レイテンシ（1フレーム または 1サイクル）を表示する。
+--save で結果をJSONに保存し、--compare で保存した結果（ベースライン）と比較する。
+（ベースラインは計測する機器で --save して作成すること）
+--log-compare でログのレベル WARNING と DEBUG（SAST-debug.log に出力）のスループットを比較する。
+
+使い方:
+  ./SAST_benchmark.py --nodes 10 --sensors 30 --cycles 20
+  ./SAST_benchmark.py --save bench_pi.json
+  ./SAST_benchmark.py --compare bench_pi.json [--threshold 0.2]
+  ./SAST_benchmark.py --log-compare
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+## import ORIGINAL
+import config as C
+import libSQLite as SQL
+
+## import system
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+
+STAGES = ['pack', 'recv', 'decode', 'ingest', 'judge', 'encode']
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="SAST pipeline benchmark (node pack -> gateway -> observer)")
+    parser.add_argument("--nodes", type=int, default=10, help="number of nodes")
+    parser.add_argument("--sensors", type=int, default=30, help="sensors per node")
+    parser.add_argument("--cycles", type=int, default=20, help="number of send cycles")
+    parser.add_argument("--hot", type=float, default=0.1, help="rate of sensors over the warning temperature")
+    parser.add_argument("--no-pty", action="store_true", help="skip recv stage (no pseudo terminal)")
+    parser.add_argument("--save", default="", help="save result to JSON file (baseline)")
+    parser.add_argument("--compare", default="", help="compare with baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold for --compare (0.2 = 20%% slower)")
+    parser.add_argument("--log-level", default="WARNING", help="log level while running (DEBUG writes SAST-debug.log)")
+    parser.add_argument("--log-compare", action="store_true", help="compare throughput with log level WARNING and DEBUG")
+    return parser.parse_args()
+
+
+def _percentile( values:list, p:float ) -> float :
+    ''' 内部関数：パーセンタイル（最近傍 NumPy不要） '''
+    if len(values) == 0 : return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(p / 100 * len(s) + 0.5)) - 1))]
+
+
+class StageTimer :
+    """ 段階毎の計測
+    Summary: 1フレーム（1サイクル）毎の処理時間とレコード数を記録して集計する。
+    """
+    def __init__(self) -> None:
+        self.samples = { s:list() for s in STAGES }
+        self.records = { s:0 for s in STAGES }
+
+    def add(self, stage:str, elapsed:float, records:int) -> None :
+        self.samples[stage].append(elapsed)
+        self.records[stage] += records
+
+    def summary(self) -> dict :
+        """集計
+        Returns:
+            dict: { stage: {'n', 'records', 'total', 'throughput', 'p50', 'p99'} }  時間は秒、throughputはレコード/秒
+        """
+        res = dict()
+        for s in STAGES :
+            v = self.samples[s]
+            if len(v) == 0 : continue
+            total = sum(v)
+            res[s] = {'n':len(v), 'records':self.records[s], 'total':total,
+                      'throughput':self.records[s] / total if total > 0 else 0.0,
+                      'p50':_percentile(v, 50), 'p99':_percentile(v, 99)}
+        return res
+
+
+def _open_pty() :
+    """ 内部関数：擬似端末を開いて GateRadio（受信部分のみ）を作成
+    Returns:
+        tuple: ( master fd, GateRadio ) 作成できない場合は ( None, None )
+    """
+    import libLORA as L
+    import serial
+    import tty
+    import types
+    try :
+        master, slave = os.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        radio = L.GateRadio.__new__(L.GateRadio)
+        radio.name = "BENCH"
+        radio.gate = types.SimpleNamespace(capture=None)
+        radio._ser = serial.Serial(os.ttyname(slave), L.BAUD, timeout=10)
+        return master, radio
+    except (OSError, serial.SerialException) as e :
+        print(f"pty not available ({e}) ... skip recv stage")
+        return None, None
+
+
+def _readings( nodes:int, sensors:int, hot:float ) -> dict :
+    ''' 内部関数：ノード毎の TH-1 計測値（libSensor.getSensorsDATA_th1 と同じ形式） '''
+    now = C.getTimeSTR()
+    data = dict()
+    for no in range(1, nodes + 1) :
+        data[no] = [ {'mac':f"49:24:11:{no:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}", 'date':now,
+                      'templ':random.choice([36.5, 41.2]) if random.random() < hot else round(random.uniform(15, 30), 1),
+                      'humid':round(random.uniform(30, 90), 1), 'batt':round(random.uniform(20, 100), 0),
+                      'rssi':random.randint(-95, -50), 'ext':0} for i in range(sensors) ]
+    return data
+
+def _setup_db( readings:dict ) -> None :
+    ''' 内部関数：一時DATABASEにノード・センサーの設定とnotifyを作成 '''
+    S = SQL.SQL("SETUP")
+    conf, notify = list(), list()
+    now = C.getTimeSTR()
+    conf.append(("00:00:00:00:00:00", "GATEWAY", "LORA00", 1, "", "", "", ""))
+    for no, sens in readings.items() :
+        amb = json.dumps({'id':no, 'channelID':no, 'writeKey':"key", 'use':True})
+        conf.append((f"00:00:00:00:00:{no:02}", f"NODE{no}", f"LORA{no:02}", 1, "", amb, f"{no}/token", ""))
+        for i, s in enumerate(sens) :
+            conf.append((s['mac'], f"S{no}-{i}", str(no), 1, "NONE,NONE,35,40", f"d{i % 8 + 1}", "", ""))
+            notify.append((s['mac'], now, C.SENS_ST.NORMAL, 0, 0, str(no)))
+    c = S.connection.cursor()
+    c.executemany("INSERT INTO conf (mac, name, node, use, warn, ambient_conf, discord_token, memo) VALUES (?,?,?,?,?,?,?,?)", conf)
+    c.executemany("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?,?,?,?,?,?)", notify)
+    S.connection.commit()
+
+
+def run( nodes=10, sensors=30, cycles=20, hot=0.1, use_pty=True ) -> dict :
+    """ベンチマークを実行
+    Args:
+        nodes (int, optional): ノード数. 初期値 10.
+        sensors (int, optional): ノード毎のセンサー数. 初期値 30.
+        cycles (int, optional): 送信サイクル数. 初期値 20.
+        hot (float, optional): 警告温度のセンサーの割合. 初期値 0.1.
+        use_pty (bool, optional): 擬似端末で recv を計測する. 初期値 True.
+    Returns:
+        dict: { 'env':{}, 'params':{}, 'stages':StageTimer.summary() }
+    """
+    tmpdir = tempfile.mkdtemp(prefix="sast_bench_")
+    SQL.DB_PATH = os.path.join(tmpdir, "bench.sqlite")
+    random.seed(1)
+    readings = _readings(nodes, sensors, hot)
+    _setup_db(readings)
+
+    ## libLORA は読み込み時にSQL()を生成するので DB_PATH 設定後に読み込む
+    import libLORA as L
+    import libJudge as Judge
+    import libCloud as Cloud
+    import SAST_observer as O
+
+    T = StageTimer()
+    S = SQL.SQL()
+    link = L.LinkRegistry()
+    dedupe = L.RecordDedupe()
+    master, radio = _open_pty() if use_pty else (None, None)
+    per_frame = int((C.SUB_PACKET - 5) / L.DATA_STRUCT.size) - 1  # Node本体の1レコード分を除く
+    seq = 0
+
+    for cycle in range(cycles) :
+        now = int(time.time())
+        seq = (seq + 1) % L.LINK_SEQ_MOD
+        for no, sens in readings.items() :
+            for k in range(0, len(sens), per_frame) :
+                part = sens[k:k + per_frame]
+                ## --- pack（Node: 本体 + センサーのレコード → 送信ストリーム）
+                start = time.perf_counter()
+                datas = [ L.data_pack(no, seq, f"00:00:00:00:00:{no:02}", now, 45.0, 5.1, 90, 0, 0) ]
+                for s in part :
+                    datas.append( L.data_pack(no, seq, s['mac'], now, s['templ'], s['humid'], s['batt'], s['rssi'], 0) )
+                stream = L.makeSendDataStream(C.GATE_ADDR, C.GATE_CHANNEL, datas)
+                T.add('pack', time.perf_counter() - start, len(datas))
+
+                ## --- recv（E220はアドレス3byteを除いて出力し、末尾にRSSIを付ける）
+                payload = bytes(stream[3 + L.LEN_STRUCT.size:])
+                if radio != None :
+                    frame = bytes(stream[3:]) + bytes([256 - 70])
+                    os.write(master, frame)
+                    ## 擬似端末に届くまで待つ（_recv_Data のポーリング待ち 0.5秒は計測に含めない）
+                    while radio._ser.in_waiting < len(frame) : time.sleep(0.0005)
+                    start = time.perf_counter()
+                    payload, rssi = radio._recv_Data()
+                    T.add('recv', time.perf_counter() - start, len(datas))
+
+                ## --- decode
+                start = time.perf_counter()
+                nodeNO, ch, sq, records = L.decode_frame(payload, -70, link)
+                link.frame(nodeNO, sq, -70)
+                T.add('decode', time.perf_counter() - start, len(records))
+
+                ## --- ingest（書込スレッドと同じ処理を1フレーム毎に実行）
+                start = time.perf_counter()
+                sdatas = [ r for r in records if not dedupe.seen(r) and S.useSensor(r['node'], r['mac']) ]
+                if len(sdatas) != 0 : S.appendDataMany(sdatas)
+                T.add('ingest', time.perf_counter() - start, len(records))
+            ## 同じ時刻のデータは重複として除かれるので次のサイクルは1秒進める
+            for s in sens : s['templ'] = random.choice([36.5, 41.2]) if random.random() < hot else round(random.uniform(15, 30), 1)
+        time.sleep(max(0.0, now + 1 - time.time()))
+
+        ## --- judge（observer: 全センサーを1パスで判定）
+        start = time.perf_counter()
+        latest = S.getLatestAll(delete=False)
+        J = Judge.JudgeEngine.load(S)
+        transitions = J.judge(latest, S.getNotifyList(0))
+        S.updateNotifyMany(transitions)
+        T.add('judge', time.perf_counter() - start, len(latest))
+
+        ## --- encode（observer: Discord通知文・Ambient/GASの送信データ）
+        start = time.perf_counter()
+        mess = ""
+        for t in transitions :
+            if t['status'] in (C.SENS_ST.NORMAL, C.SENS_ST.NONE) : continue
+            ( sens_name, node_name, nodeNo, warn ) = J.sensorInfo(t['mac'])
+            if sens_name == None : continue
+            mess += O.makeNotifyMessage( sens_name, node_name, t['status'], J.templ(t['mac']), warn['hC'], warn['hW'], J.trend(t['mac']).get('slope') )
+        chunks = Cloud.split_message(mess)
+        amb = dict()
+        for d in latest :
+            if d['mac'].startswith("00:00:00:00:00:") or d['ambient_conf'] == "" : continue
+            amb.setdefault(d['node'], {'created':d['date']})[d['ambient_conf']] = d['templ']
+        gas = [ {k:v for k, v in d.items() if k not in ('ambient_conf', 'node')} for d in latest ]
+        for g in gas : g['date'] = C.toTimespan(g['date'])
+        body = [ json.dumps(c) for c in Cloud.chunk_records(gas) ] + [ json.dumps(a) for a in amb.values() ] + chunks
+        S.getLatestAll(delete=True)
+        T.add('encode', time.perf_counter() - start, len(latest))
+
+    if radio != None :
+        radio._ser.close()
+        os.close(master)
+
+    return {'env':{'python':platform.python_version(), 'machine':platform.machine(), 'node':platform.node(),
+                   'date':C.getTimeSTR()},
+            'params':{'nodes':nodes, 'sensors':sensors, 'cycles':cycles, 'hot':hot},
+            'stages':T.summary()}
+
+
+def compare( result:dict, baseline:dict, threshold=0.2 ) -> list :
+    """ベースラインと比較（p50・スループットが threshold 以上悪化した段階を返す）
+    Args:
+        result (dict): run() の結果
+        baseline (dict): 保存した run() の結果
+        threshold (float, optional): 悪化と判断する割合. 初期値 0.2.
+    Returns:
+        list: 悪化した段階の ( stage, 項目, baseline, result ) のlist
+    """
+    worse = list()
+    for stage, st in result['stages'].items() :
+        base = baseline['stages'].get(stage)
+        if base == None : continue
+        if base['p50'] > 0 and st['p50'] > base['p50'] * (1 + threshold) :
+            worse.append((stage, 'p50', base['p50'], st['p50']))
+        if base['throughput'] > 0 and st['throughput'] < base['throughput'] / (1 + threshold) :
+            worse.append((stage, 'throughput', base['throughput'], st['throughput']))
+    return worse
+
+
+if __name__ == '__main__' :
+    args = get_args()
+    if args.log_compare :
+        ## ログのレベル毎に実行して段階毎のスループットを比較
+        res = dict()
+        for level in ("WARNING", "DEBUG") :
+            C.logger.setLevel(level)
+            res[level] = run(args.nodes, args.sensors, args.cycles, args.hot, not args.no_pty)
+        C.logger.setLevel(logging.WARNING)
+        print(f"log level benchmark : {args.nodes} nodes x {args.sensors} sensors x {args.cycles} cycles  (rec/sec)")
+        print(f"{'stage':8} {'WARNING':>12} {'DEBUG':>12} {'ratio':>7}")
+        for stage, st in res['WARNING']['stages'].items() :
+            dbg = res['DEBUG']['stages'][stage]['throughput']
+            print(f"{stage:8} {st['throughput']:12.0f} {dbg:12.0f} {dbg / st['throughput']:7.2f}")
+        sys.exit(0)
+
+    C.logger.setLevel(args.log_level.upper())  # 初期値 WARNING（ログ出力の時間は含めない）
+    res = run(args.nodes, args.sensors, args.cycles, args.hot, not args.no_pty)
+    p = res['params']
+    print(f"SAST pipeline benchmark : {p['nodes']} nodes x {p['sensors']} sensors x {p['cycles']} cycles  ({res['env']['machine']} python {res['env']['python']})")
+    print(f"{'stage':8} {'n':>6} {'records':>8} {'rec/sec':>12} {'p50 msec':>10} {'p99 msec':>10}")
+    for stage, st in res['stages'].items() :
+        print(f"{stage:8} {st['n']:6} {st['records']:8} {st['throughput']:12.0f} {st['p50']*1000:10.3f} {st['p99']*1000:10.3f}")
+
+    if args.save != "" :
+        with open(args.save, 'w') as f : json.dump(res, f, indent=1)
+        print(f"saved -> {args.save}")
+
+    if args.compare != "" :
+        with open(args.compare) as f : baseline = json.load(f)
+        if baseline['params'] != res['params'] :
+            print(f"WARNING: parameters differ from baseline {baseline['params']}")
+        worse = compare(res, baseline, args.threshold)
+        for stage, key, b, r in worse :
+            print(f"REGRESSION {stage:8} {key:10} {b:.6g} -> {r:.6g}")
+        if len(worse) != 0 : sys.exit(1)
+        print(f"no regression (threshold {args.threshold*100:.0f}%) against {args.compare} ({baseline['env']['date']})")
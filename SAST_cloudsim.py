@@ -0,0 +1,312 @@
+#!/usr/bin/python3
+"""
+SAST Cloud代替サーバー＆負荷試験 SAST_cloudsim.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Summary:
+SAST_observer が利用する Ambient / Discord / Google Apps Script(GAS) のAPIのうち、
+利用している部分だけをローカルのHTTPサーバーで代替する。ネットワーク無しで observer を動かせる。
+・Ambient   POST /api/v2/channels/{ch}/data, /dataarray   最短送信間隔内は 403
+・Discord   POST /api/webhooks/{id}/{token}               Webhook毎の上限を超えたら 429(Retry-After)
+・GAS       GET  /macros/exec?sens=sensor|version|ack     設定データ・版・ACK
+            POST /macros/exec                             センサーデータ（--gzip で gzip を受け付ける）
+・応答遅延（--latency/--jitter 秒）、エラー率（--error 5xxの割合）を指定可能
+・GET /stats で受信数を返す
+
+BENCH では一時DATABASEに任意の数のノード・センサー・latest・notify を作成し、
+代替サーバーに向けて _send_cloud() を繰り返し実行してサイクル時間を表示する。
+
+使い方:
+  ./SAST_cloudsim.py server [--port 18080] [--latency 0.2] [--error 0.05]
+      SAST_CLOUD_URL=http://127.0.0.1:18080 ./SAST_observer.py   # observer を代替サーバーに向ける
+  ./SAST_cloudsim.py bench --sensors 1000 --nodes 10 --cycles 5 [--latency 0.2] [--error 0.05]
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+## import ORIGINAL
+import config as C
+
+## import system
+import argparse
+import datetime
+import gzip
+import http.server
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="local stand-in for Ambient / Discord / GAS")
+    parser.add_argument("mode", choices=["server", "bench"], help="server: run stand-in / bench: run _send_cloud() against it")
+    parser.add_argument("--port", type=int, default=18080, help="listen port (bench: 0 is any free port)")
+    parser.add_argument("--latency", type=float, default=0.0, help="response latency (sec)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency 0..jitter (sec)")
+    parser.add_argument("--error", type=float, default=0.0, help="rate of 500 responses for POST (0.0-1.0)")
+    parser.add_argument("--discord-limit", type=int, default=5, help="discord posts per webhook in --discord-per sec")
+    parser.add_argument("--discord-per", type=float, default=2.0, help="discord rate limit window (sec)")
+    parser.add_argument("--amb-interval", type=float, default=C.AMB['INTERVAL'], help="ambient minimum interval per channel (sec)")
+    parser.add_argument("--gzip", action="store_true", help="accept gzip request body for GAS")
+    parser.add_argument("--sensors", type=int, default=100, help="bench: number of sensors")
+    parser.add_argument("--nodes", type=int, default=4, help="bench: number of nodes")
+    parser.add_argument("--cycles", type=int, default=3, help="bench: number of _send_cloud() cycles")
+    parser.add_argument("--hot", type=float, default=0.1, help="bench: rate of sensors over the warning temperature")
+    return parser.parse_args()
+
+
+class CloudSim :
+    """ Cloud代替サーバー
+    Summary: ThreadingHTTPServer をバックグラウンドのスレッドで動かす。設定は属性で変更できる。
+    """
+    def __init__(self, port=18080, latency=0.0, jitter=0.0, error=0.0,
+                 discord_limit=5, discord_per=2.0, amb_interval=C.AMB['INTERVAL'], gzip=False) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error = error
+        self.discord_limit = discord_limit
+        self.discord_per = discord_per
+        self.amb_interval = amb_interval
+        self.gzip = gzip
+        self.conf = [ {'date':datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")} ]  # GASの設定データ
+        self.lock = threading.Lock()
+        self.counts = dict()
+        self.amb_last = dict()      # channel -> 最後に受け付けた時刻
+        self.discord_win = dict()   # webhook -> ( 期間の開始時刻, 回数 )
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self) -> None :
+        ''' バックグラウンドで起動 '''
+        self.thread = threading.Thread(target=self.server.serve_forever, name="CloudSim", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None :
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key:str, num=1) -> None :
+        with self.lock : self.counts[key] = self.counts.get(key, 0) + num
+
+    def stats(self, reset=False) -> dict :
+        ''' 受信数 { 'ambient_200':n, 'discord_429':n, 'gas_records':n, ... } '''
+        with self.lock :
+            st = dict(self.counts)
+            if reset : self.counts = dict()
+        return st
+
+    def _handler(self) :
+        ''' 内部関数：このサーバーのリクエストハンドラクラス '''
+        sim = self
+
+        class Handler(http.server.BaseHTTPRequestHandler) :
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) :
+                pass
+
+            def _reply(self, code:int, body=b"", headers={}) :
+                if isinstance(body, (dict, list)) :
+                    body = json.dumps(body).encode()
+                    headers = dict(headers, **{'Content-Type':'application/json'})
+                self.send_response(code)
+                for k, v in headers.items() : self.send_header(k, str(v))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _wait(self) :
+                if sim.latency > 0 or sim.jitter > 0 :
+                    time.sleep(sim.latency + random.uniform(0, sim.jitter))
+
+            def do_GET(self) :
+                self._wait()
+                u = urllib.parse.urlsplit(self.path)
+                if u.path == '/stats' :
+                    return self._reply(200, sim.stats())
+                if u.path != '/macros/exec' :
+                    return self._reply(404)
+                sens = urllib.parse.parse_qs(u.query).get('sens', [""])[0]
+                sim.count(f"gas_{sens or 'get'}")
+                if sens == 'sensor' :
+                    return self._reply(200, sim.conf)
+                if sens == 'version' :
+                    return self._reply(200, {'date':sim.conf[0]['date']})
+                return self._reply(200, b"OK")
+
+            def do_POST(self) :
+                self._wait()
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                path = urllib.parse.urlsplit(self.path).path
+                if random.random() < sim.error :
+                    sim.count('error_500')
+                    return self._reply(500)
+                m = re.match(r'^/api/v2/channels/([^/]+)/(data|dataarray)$', path)
+                if m :
+                    return self._ambient(m.group(1), m.group(2), body)
+                if path.startswith('/api/webhooks/') :
+                    return self._discord(path[len('/api/webhooks/'):], body)
+                if path == '/macros/exec' :
+                    return self._gas(body)
+                return self._reply(404)
+
+            def _ambient(self, channel, kind, body) :
+                ''' Ambient: writeKeyが無ければ400、最短送信間隔内は403 '''
+                data = json.loads(body)
+                if 'writeKey' not in data :
+                    sim.count('ambient_400')
+                    return self._reply(400)
+                now = time.time()
+                with sim.lock :
+                    last = sim.amb_last.get(channel, 0)
+                    if now - last < sim.amb_interval :
+                        ok = False
+                    else :
+                        ok = True
+                        sim.amb_last[channel] = now
+                if not ok :
+                    sim.count('ambient_403')
+                    return self._reply(403)
+                sim.count('ambient_200')
+                sim.count('ambient_samples', len(data['data']) if kind == 'dataarray' else 1)
+                return self._reply(200)
+
+            def _discord(self, hook, body) :
+                ''' Discord: Webhook毎に discord_per 秒で discord_limit 回まで（超えたら429） '''
+                now = time.time()
+                with sim.lock :
+                    start, num = sim.discord_win.get(hook, (now, 0))
+                    if now - start >= sim.discord_per : start, num = now, 0
+                    num += 1
+                    sim.discord_win[hook] = (start, num)
+                reset = max(0.0, start + sim.discord_per - now)
+                headers = {'X-RateLimit-Limit':sim.discord_limit,
+                           'X-RateLimit-Remaining':max(0, sim.discord_limit - num),
+                           'X-RateLimit-Reset-After':f"{reset:.3f}"}
+                if num > sim.discord_limit :
+                    sim.count('discord_429')
+                    return self._reply(429, {'message':'You are being rate limited.', 'retry_after':round(reset, 3), 'global':False},
+                                       dict(headers, **{'Retry-After':f"{reset:.3f}"}))
+                content = json.loads(body).get('content', "")
+                if len(content) > C.DISCORD['LIMIT'] :
+                    sim.count('discord_400')
+                    return self._reply(400, {'message':'Must be 2000 or fewer in length.'}, headers)
+                sim.count('discord_204')
+                return self._reply(204, b"", headers)
+
+            def _gas(self, body) :
+                ''' GAS: センサーデータ（JSON配列）。gzipは --gzip の時のみ受け付ける '''
+                if self.headers.get('Content-Encoding') == 'gzip' :
+                    if not sim.gzip :
+                        sim.count('gas_415')
+                        return self._reply(415)
+                    body = gzip.decompress(body)
+                data = json.loads(body)
+                sim.count('gas_200')
+                sim.count('gas_records', len(data) if isinstance(data, list) else 1)
+                return self._reply(200, {'result':'ok'})
+
+        return Handler
+
+
+def _populate( S, sensors:int, nodes:int ) -> list :
+    """ 内部関数：一時DATABASEにノード・センサーの設定とnotify・node_linkを作成
+    Returns:
+        list: ( mac, node ) のlist
+    """
+    now = C.getTimeSTR()
+    conf, notify, links, macs = list(), list(), list(), list()
+    conf.append(("00:00:00:00:00:00", "GATEWAY", "LORA00", 1, "", "", "", ""))
+    for no in range(1, nodes+1) :
+        amb = json.dumps({'id':1000+no, 'channelID':1000+no, 'writeKey':f"key{no}", 'use':True})
+        conf.append((f"00:00:00:00:00:{no:02}", f"NODE{no}", f"LORA{no:02}", 1, "", amb, f"{no}/token{no % 3}", ""))
+        links.append((no, 0, 0, 0, 0.0, -80.0, now, 0, 0))
+    for i in range(sensors) :
+        mac = f"49:22:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}:00"
+        node = i % nodes + 1
+        conf.append((mac, f"S{i}", str(node), 1, "NONE,NONE,35,40", f"d{i // nodes % 8 + 1}", "", ""))
+        notify.append((mac, now, C.SENS_ST.NORMAL, 0, 0, str(node)))
+        macs.append((mac, node))
+    c = S.connection.cursor()
+    c.executemany("INSERT INTO conf (mac, name, node, use, warn, ambient_conf, discord_token, memo) VALUES (?,?,?,?,?,?,?,?)", conf)
+    c.executemany("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?,?,?,?,?,?)", notify)
+    c.executemany("REPLACE INTO node_link (node, last_seq, frames, gaps, loss, rssi, last_seen, acks, rejected) VALUES (?,?,?,?,?,?,?,?,?)", links)
+    S.connection.commit()
+    return macs
+
+def _fill_latest( S, macs:list, hot:float ) -> None :
+    ''' 内部関数：latestに全センサーの計測データを作成（hotの割合で警告温度） '''
+    now = C.getTimeSTR()
+    rows = [ (mac, now, node, random.choice([41.0, 36.0]) if random.random() < hot else 25.0, 50.0, 90.0, -80, 0)
+             for mac, node in macs ]
+    c = S.connection.cursor()
+    c.executemany("REPLACE INTO latest (mac, date, node, templ, humid, batt, rssi, status) VALUES (?,?,?,?,?,?,?,?)", rows)
+    S.connection.commit()
+
+def bench( sim:CloudSim, sensors=100, nodes=4, cycles=3, hot=0.1 ) -> dict :
+    """代替サーバーに向けて _send_cloud() を繰り返し実行してサイクル時間を計測
+    Args:
+        sim (CloudSim): 起動済みの代替サーバー
+        sensors (int, optional): センサー数. 初期値 100.
+        nodes (int, optional): ノード数. 初期値 4.
+        cycles (int, optional): _send_cloud() の実行回数. 初期値 3.
+        hot (float, optional): 警告温度のセンサーの割合. 初期値 0.1.
+    Returns:
+        dict: { 'cycles':[秒], 'discord':秒（送信待ちの完了まで）, 'outbox':{}, 'server':{} }
+    """
+    import libSQLite
+    tmpdir = tempfile.mkdtemp(prefix="sast_cloudsim_")
+    libSQLite.DB_PATH = os.path.join(tmpdir, "cloudsim.sqlite")
+    C.setCloudURL(sim.url)
+    C.AMB['INTERVAL'] = sim.amb_interval
+    import SAST_observer as O
+    import libCloud as Cloud
+
+    S = libSQLite.SQL("SETUP")
+    macs = _populate(S, sensors, nodes)
+    result = {'cycles':[]}
+    for i in range(cycles) :
+        _fill_latest(S, macs, hot)
+        start = time.time()
+        O._send_cloud()
+        result['cycles'].append(time.time() - start)
+        print(f"cycle {i+1:3} : {result['cycles'][-1]:7.3f}sec")
+    start = time.time()
+    Cloud.discord().flush()
+    result['discord'] = time.time() - start
+    result['outbox'] = S.getOutboxStats()
+    result['server'] = sim.stats()
+    return result
+
+
+if __name__ == '__main__' :
+    import logging
+    import sys
+    args = get_args()
+    sim = CloudSim(args.port if args.mode == 'server' or args.port != 18080 else 0,
+                   args.latency, args.jitter, args.error, args.discord_limit, args.discord_per, args.amb_interval, args.gzip)
+    if args.mode == 'server' :
+        print(f"Cloud stand-in {sim.url}  (SAST_CLOUD_URL={sim.url})")
+        try :
+            sim.server.serve_forever()
+        except KeyboardInterrupt :
+            pass
+        print(json.dumps(sim.stats(), indent=1))
+        sys.exit(0)
+
+    sim.start()
+    C.logger.setLevel(logging.WARNING)  # ログ出力の時間は含めない
+    print(f"bench : {args.sensors} sensors / {args.nodes} nodes / {args.cycles} cycles  latency {args.latency}+{args.jitter}sec error {args.error}")
+    res = bench(sim, args.sensors, args.nodes, args.cycles, args.hot)
+    cyc = res['cycles']
+    print(f"cycle avg {sum(cyc)/len(cyc):.3f}sec  max {max(cyc):.3f}sec  discord flush {res['discord']:.3f}sec")
+    for sink, st in res['outbox'].items() :
+        print(f"outbox {sink:8} pending:{st['pending']} dead:{st['dead']}")
+    for k in sorted(res['server']) :
+        print(f"server {k:16} {res['server'][k]}")
+    sim.stop()
@@ -0,0 +1,319 @@
+#!/usr/bin/python3
+"""
+ローカルダッシュボード SAST_dashboard.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Summary:
+GATEWAY のDATABASEを参照して、ダッシュボード画面とJSONのAPIを返すHTTPサーバー。
+キオスク（monitor/launch.sh）はこの画面を表示するので、インターネット接続が無くても表示できる。
+・GET /              ダッシュボード画面（外部ファイル無しのHTML/JavaScript）
+・GET /api/latest    センサー毎の最新値・状態・上昇率（sensor_state + conf + notify + sensor_trend）
+・GET /api/nodes     ノード毎のリンク統計・CPU温度・電池（node_link + sensor_state）
+・GET /api/series    センサー毎の時間幅毎の 平均・最小・最大（aggregate）
+                     ?hours=6&bucket=600&column=templ&mac=xx:xx:..
+応答はパス毎にキャッシュし、DATABASEが更新された時（PRAGMA data_version の変化）に破棄する。
+更新が無い間のリクエストはSQLを実行しない。ETag が一致すれば 304 を返す。
+
+使い方:
+  ./SAST_dashboard.py [--bind 127.0.0.1] [--port 8080]
+      chromium-browser --kiosk http://127.0.0.1:8080/
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+## import ORIGINAL
+import config as C
+import libSQLite as SQL
+import libMetrics as Metrics
+
+## import system
+import argparse
+import datetime
+import hashlib
+import http.server
+import json
+import sys
+import threading
+import time
+import urllib.parse
+
+NODE_MAC = "00:00:00:00:00:"
+
+M_REQUESTS = Metrics.counter("sast_dashboard_requests_total", "dashboard requests", ("path", "cache"))
+M_BUILD_SEC = Metrics.histogram("sast_dashboard_build_seconds", "time to build a response on cache miss", ("path",))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="local dashboard and JSON API for the gateway database")
+    parser.add_argument("--bind", default=C.DASHBOARD['BIND'], help="listen address")
+    parser.add_argument("--port", type=int, default=C.DASHBOARD['PORT'], help="listen port")
+    parser.add_argument("--max-age", type=float, default=C.DASHBOARD['MAX_AGE'], help="max seconds to keep a cached response")
+    return parser.parse_args()
+
+
+def _latest( S:SQL.SQL, query:dict ) -> list :
+    """ /api/latest センサー毎の最新値・状態
+    Returns:
+        list: {'mac','name','node','node_name','date','templ','humid','batt','rssi','status','state','slope','warn'} のlist（ノード・名前順）
+    """
+    sensors, nodes = S.getSensorConfAll()
+    state = S.getSensorStateAll()
+    trends = S.getSensorTrendAll()
+    notify = { n['mac']:n for n in S.getNotifyList() }
+    ret = list()
+    for mac in set(sensors) | set(state) :
+        if mac.startswith(NODE_MAC) : continue
+        conf = sensors.get(mac, {})
+        st = state.get(mac, {})
+        node = conf.get('node', st.get('node'))
+        status = notify[mac]['status'] if mac in notify else st.get('status')
+        ret.append({'mac':mac, 'name':conf.get('name', mac), 'node':node, 'node_name':nodes.get(node, f"NODE{node}"),
+                    'date':st.get('date'), 'templ':st.get('templ'), 'humid':st.get('humid'), 'batt':st.get('batt'),
+                    'rssi':st.get('rssi'), 'status':status,
+                    'state':C.SENS_ST(status).name if status in list(C.SENS_ST) else None,
+                    'slope':trends.get(mac, {}).get('slope'),
+                    'warn':conf.get('warn')})
+    ret.sort(key=lambda d: (d['node'] if d['node'] != None else 999, d['name']))
+    return ret
+
+
+def _nodes( S:SQL.SQL, query:dict ) -> list :
+    """ /api/nodes ノード毎のリンク統計・CPU温度・電池
+    Returns:
+        list: {'node','name','alive','date','cpu_temp','volt','batt', node_link の項目} のlist（GATEWAYを除くノード順）
+    """
+    _, nodes = S.getSensorConfAll()
+    state = S.getSensorStateAll()
+    links = { l['node']:l for l in S.getNodeLink() }
+    ret = list()
+    for no in sorted(set(nodes) | set(links)) :
+        if no == 0 : continue   # GATEWAY
+        st = state.get(f"{NODE_MAC}{no:02}", {})
+        d = {'node':no, 'name':nodes.get(no, f"NODE{no}"), 'alive':bool(S.isArriveNode(no)),
+             'date':st.get('date'), 'cpu_temp':st.get('templ'), 'volt':st.get('humid'), 'batt':st.get('batt')}
+        d.update({ k:v for k, v in links.get(no, {}).items() if k != 'node' })
+        ret.append(d)
+    return ret
+
+
+def _series( S:SQL.SQL, query:dict ) -> dict :
+    """ /api/series センサー毎の時間幅毎の 平均・最小・最大
+    Args:
+        query (dict): hours(時間) / bucket(秒) / column(templ|humid) / mac（複数可 無指定は全センサー）
+    Returns:
+        dict: {'column','bucket','start','end','series':{ mac:[[start, mean, min, max], ...] }}
+    """
+    hours = float(query.get('hours', [C.DASHBOARD['HOURS']])[0])
+    bucket = int(query.get('bucket', [C.DASHBOARD['BUCKET']])[0])
+    column = query.get('column', ["templ"])[0]
+    if not 0 < hours <= 24 * 31 or bucket < 60 : raise ValueError(f"hours {hours} bucket {bucket}")
+    macs = query.get('mac')
+    now = datetime.datetime.now()
+    ## 開始は正時に揃える（集計済の rollup_hour を使えるように）
+    start = (now - datetime.timedelta(hours=hours)).replace(minute=0, second=0, microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+    end = (now + datetime.timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+    series = dict()
+    for a in S.aggregate(start, end, bucket, column, macs) :
+        if a['mac'].startswith(NODE_MAC) : continue
+        series.setdefault(a['mac'], []).append([a['start'], round(a['mean'], 2), a['min'], a['max']])
+    return {'column':column, 'bucket':bucket, 'start':start, 'end':end, 'series':series}
+
+
+API = {'/api/latest':_latest, '/api/nodes':_nodes, '/api/series':_series}
+
+
+class Dashboard :
+    """ ダッシュボードのHTTPサーバー
+    Summary: ThreadingHTTPServer で応答する。応答はパス（クエリー含む）毎にキャッシュし、
+             監視スレッドが PRAGMA data_version の変化を見つけたら全て破棄する。
+    """
+    def __init__(self, bind=C.DASHBOARD['BIND'], port=C.DASHBOARD['PORT'],
+                 max_age=C.DASHBOARD['MAX_AGE'], poll=C.DASHBOARD['POLL']) -> None:
+        self.max_age = max_age
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.cache = dict()         # path -> ( 期限(単調時計), ETag, body )
+        self.version = 0            # DATABASEの更新を見つけた回数
+        self.local = threading.local()
+        self.stopped = threading.Event()
+        self.server = http.server.ThreadingHTTPServer((bind, port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://{bind}:{self.server.server_address[1]}/"
+        self.watcher = None
+
+    def start(self) -> None :
+        ''' DATABASEの監視を開始してバックグラウンドで起動 '''
+        self.watch()
+        threading.Thread(target=self.server.serve_forever, name="Dashboard", daemon=True).start()
+
+    def watch(self) -> None :
+        ''' DATABASEの監視スレッドを起動 '''
+        self.watcher = threading.Thread(target=self._watch, name="DashboardWatch", daemon=True)
+        self.watcher.start()
+
+    def stop(self) -> None :
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _watch(self) -> None :
+        ''' 内部関数：監視スレッド data_version が変わったらキャッシュを破棄 '''
+        S = SQL.SQL()
+        last = S.dataVersion()
+        while not self.stopped.wait(self.poll) :
+            v = S.dataVersion()
+            if v == last : continue
+            last = v
+            with self.lock :
+                self.version += 1
+                self.cache.clear()
+            C.logger.debug("[dashboard] database updated ... clear cache")
+
+    def _sql(self) -> SQL.SQL :
+        ''' 内部関数：リクエスト処理スレッド毎のSQL '''
+        if getattr(self.local, 'S', None) == None : self.local.S = SQL.SQL()
+        return self.local.S
+
+    def get(self, path:str, func, query:dict) -> tuple :
+        """キャッシュから応答を返す（無いか期限切れなら作成してキャッシュ）
+        Args:
+            path (str): キャッシュのキー（クエリー含むパス）
+            func (callable): 応答を作る関数 func(S, query)
+            query (dict): parse_qs したクエリー
+        Returns:
+            tuple: ( ETag, body, キャッシュから返したか )
+        """
+        now = time.monotonic()
+        with self.lock :
+            hit = self.cache.get(path)
+            version = self.version
+        if hit != None and hit[0] > now : return hit[1], hit[2], True
+
+        name = urllib.parse.urlsplit(path).path
+        with M_BUILD_SEC.labels(path=name).time() :
+            body = json.dumps(func(self._sql(), query), ensure_ascii=False, separators=(',', ':')).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+        with self.lock :
+            ## 作成中にDATABASEが更新された応答はキャッシュしない
+            if self.version == version :
+                if len(self.cache) >= 256 : self.cache.clear()
+                self.cache[path] = ( now + self.max_age, etag, body )
+        return etag, body, False
+
+    def _handler(self) :
+        ''' 内部関数：このサーバーのリクエストハンドラクラス '''
+        dash = self
+
+        class Handler(http.server.BaseHTTPRequestHandler) :
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args) :
+                pass
+
+            def _reply(self, code:int, body=b"", headers={}) :
+                if isinstance(body, (dict, list)) :
+                    body = json.dumps(body).encode()
+                    headers = dict(headers, **{'Content-Type':'application/json'})
+                self.send_response(code)
+                for k, v in headers.items() : self.send_header(k, str(v))
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) :
+                u = urllib.parse.urlsplit(self.path)
+                if u.path in ('/', '/index.html') :
+                    M_REQUESTS.labels(path="/", cache="static").inc()
+                    return self._reply(200, PAGE, {'Content-Type':'text/html; charset=utf-8', 'Cache-Control':'no-cache'})
+                if u.path not in API :
+                    return self._reply(404, {'error':"not found"})
+                try :
+                    etag, body, hit = dash.get(self.path, API[u.path], urllib.parse.parse_qs(u.query))
+                except ValueError as e :
+                    return self._reply(400, {'error':str(e)})
+                except Exception as e :
+                    C.logger.error(f"[dashboard] {self.path} Exception:{e}")
+                    return self._reply(500, {'error':str(e)})
+                headers = {'ETag':etag, 'Cache-Control':'no-cache'}
+                if self.headers.get('If-None-Match') == etag :
+                    M_REQUESTS.labels(path=u.path, cache="304").inc()
+                    return self._reply(304, b"", headers)
+                M_REQUESTS.labels(path=u.path, cache="hit" if hit else "miss").inc()
+                headers['Content-Type'] = 'application/json; charset=utf-8'
+                return self._reply(200, body, headers)
+
+        return Handler
+
+
+PAGE = """<!DOCTYPE html>
+<html lang="ja"><head><meta charset="utf-8"><title>SAST Dashboard</title>
+<style>
+body{font-family:sans-serif;margin:0;background:#111;color:#eee}
+header{display:flex;justify-content:space-between;padding:6px 12px;background:#234}
+main{display:grid;grid-template-columns:repeat(auto-fill,minmax(260px,1fr));gap:8px;padding:8px}
+.card{background:#222;border-radius:6px;padding:8px;border-left:8px solid #4a4}
+.card.LOW_WARN,.card.HIGH_WARN{border-color:#cc3}.card.LOW_CAUTION,.card.HIGH_CAUTION{border-color:#d33}
+.card.RISE_WARN{border-color:#e80}.card.STUCK{border-color:#96c}
+.card.LOST,.card.old{border-color:#666;color:#999}
+.name{font-size:1.1em}.val{font-size:2em}.sub{font-size:.8em;color:#aaa}
+svg{width:100%;height:48px}polyline{fill:none;stroke:#6cf;stroke-width:1.5}
+table{margin:0 8px 8px;border-collapse:collapse;font-size:.9em}td,th{padding:2px 10px;border-bottom:1px solid #333}
+.dead{color:#d33}
+</style></head><body>
+<header><span>SAST ダッシュボード</span><span id="clock"></span></header>
+<main id="sensors"></main>
+<table id="nodes"></table>
+<script>
+const etags={}, data={};
+async function api(path){
+  const h=etags[path]?{'If-None-Match':etags[path]}:{};
+  const r=await fetch(path,{headers:h});
+  if(r.status==304) return data[path];
+  if(!r.ok) throw new Error(path+' '+r.status);
+  etags[path]=r.headers.get('ETag'); data[path]=await r.json(); return data[path];
+}
+function fmt(v,d){return v==null?'-':Number(v).toFixed(d)}
+function esc(v){return v==null||v===''?'-':String(v).replace(/[&<>"']/g,c=>'&#'+c.charCodeAt(0)+';')}
+function spark(pts){
+  if(!pts||pts.length<2) return '';
+  const v=pts.map(p=>p[1]), lo=Math.min(...v), hi=Math.max(...v), w=(hi-lo)||1;
+  const xy=v.map((y,i)=>(i*100/(v.length-1)).toFixed(1)+','+(46-(y-lo)*44/w).toFixed(1)).join(' ');
+  return '<svg viewBox="0 0 100 48" preserveAspectRatio="none"><polyline points="'+xy+'"/></svg>';
+}
+function age(date){return date?(Date.now()-new Date(date.replace(' ','T')))/60000:1e9}
+async function update(){
+  try{
+    const [latest,nodes,series]=await Promise.all([api('/api/latest'),api('/api/nodes'),api('/api/series')]);
+    document.getElementById('sensors').innerHTML=latest.map(s=>{
+      const old=age(s.date)>30?' old':'';
+      return '<div class="card '+(s.state||'')+old+'"><div class="name">'+esc(s.name)+' <span class="sub">'+esc(s.node_name)+'</span></div>'
+        +'<div class="val">'+fmt(s.templ,1)+'℃ <span class="sub">'+fmt(s.humid,0)+'%'
+        +(s.slope!=null&&Math.abs(s.slope)>=0.1?' '+(s.slope>0?'↑':'↓')+Math.abs(s.slope).toFixed(1)+'℃/分':'')+'</span></div>'
+        +spark(series.series[s.mac])
+        +'<div class="sub">'+esc(s.date)+' 電池 '+fmt(s.batt,0)+'% RSSI '+fmt(s.rssi,0)+'</div></div>';
+    }).join('');
+    document.getElementById('nodes').innerHTML='<tr><th>ノード</th><th>状態</th><th>最終受信</th><th>CPU</th><th>電池</th><th>RSSI</th><th>欠損率</th></tr>'
+      +nodes.map(n=>'<tr><td>'+esc(n.name)+'</td><td class="'+(n.alive?'':'dead')+'">'+(n.alive?'受信中':'応答なし')+'</td><td>'
+        +esc(n.last_seen||n.date)+'</td><td>'+fmt(n.cpu_temp,1)+'℃</td><td>'+fmt(n.batt,0)+'%</td><td>'+fmt(n.rssi,0)
+        +'</td><td>'+(n.loss==null?'-':(n.loss*100).toFixed(1)+'%')+'</td></tr>').join('');
+  }catch(e){console.log(e)}
+  document.getElementById('clock').textContent=new Date().toLocaleString('ja-JP');
+}
+update(); setInterval(update,15000);
+</script></body></html>
+""".encode()
+
+
+## MAIN
+if __name__ == '__main__' :
+    args = get_args()
+    try :
+        dash = Dashboard(args.bind, args.port, args.max_age)
+    except OSError as e :
+        C.logger.error(f"[dashboard] {args.bind}:{args.port} Error:{e}")
+        sys.exit(1)
+    Metrics.start("dashboard")
+    dash.watch()
+    C.logger.info(f"[dashboard] {dash.url}")
+    try :
+        dash.server.serve_forever()
+    except KeyboardInterrupt :
+        pass
@@ -27,26 +27,23 @@ Auther F.Takahashi
 import config as C
 import libMachineInfo as M
 import libSQLite as SQL
+import libHTTP as HTTP
+import libJudge as Judge
+import libCloud as Cloud
+import libRuntime as RT
+import libMetrics as Metrics
 
 ## import system
 import datetime
+import hashlib
 import requests
-import ambient
 import json
 import time
 import sys
 import signal
-import schedule
+import concurrent.futures
 
 
-###### Change IPv4,IPv6
-import socket
-import requests.packages.urllib3.util.connection as urllib3_cn
-def allowed_gai_family(): return socket.AF_UNSPEC  
-def allowed_gai_family4(): return socket.AF_INET  
-def allowed_gai_family6(): return socket.AF_INET6
-urllib3_cn.allowed_gai_family = allowed_gai_family
-
 ###### SIGTERM 
 def intr_signal_term(num,frame):
     C.logging.info("[SAST_observer] catch SIGTERM")
@@ -54,42 +51,16 @@ def intr_signal_term(num,frame):
 
 signal.signal(signal.SIGTERM, intr_signal_term)
 
-def OverCautionTemp( templ:float , thr ) -> bool:
-    """警告温度を超えている？
-    Args:
-        temp (float): 温度
-    Returns:
-        bool: True:超えている
-    """
-    return True if thr <= templ else False 
-
-def OverWanringTemp( templ:float , thr ) -> bool : 
-    """注意温度を超えている？
-    Args:
-        temp (float): 温度
-    Returns:
-        bool: True:超えている
-    """
-    return True if thr <= templ else False
+###### Cloud送信用スレッドプール（期限切れの送信がサイクルを止めないよう共有する）
+_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=C.CLOUD_WORKERS, thread_name_prefix="cloud")
 
-def PassedMinute( dateSTR:str, minute:int ) -> bool:
-    """指定された時間からX分経過したかどうか？
-    Args:
-        dateSTR (str): 日付文字列（SQLite）
-        minute (int): 経過確認分
-    Returns:
-        bool: True:経過した / False:経過していない
-    """
-    try :
-        last = dt = datetime.datetime.strptime(dateSTR, "%Y-%m-%d %H:%M:%S")
-        span = datetime.datetime.now() - last
-        #C.logger.debug(f"[PassedMinute] src[{dateSTR}] int:{minute*60}sec span={span.seconds}sec")
-        return True if( span.total_seconds() >= minute*60 ) else False
-    except Exception as e :
-        C.logger.warning(f"PassedMinute ERROR {e}")
-        return False
+###### Metrics（libMetrics.py）
+M_SINK_SEC = Metrics.histogram("sast_cloud_send_seconds", "cloud send time by sink", ("sink",))
+M_SINK = Metrics.counter("sast_cloud_send_total", "cloud send result by sink", ("sink", "result"))
+M_CYCLE_SEC = Metrics.histogram("sast_cloud_cycle_seconds", "_send_cloud fan-out time")
+M_OUTBOX = Metrics.gauge("sast_outbox_pending", "outbox records waiting for resend", ("sink",))
 
-def makeNotifyMessage( sens:str, node:str, state:C.SENS_ST, val:float , high_caut:float, high_warn:float ) -> str:
+def makeNotifyMessage( sens:str, node:str, state:C.SENS_ST, val:float , high_caut:float, high_warn:float, rate=None ) -> str:
     """通知用のメッセージを作成
     Args:
         sens (str): センサー名
@@ -98,6 +69,7 @@ def makeNotifyMessage( sens:str, node:str, state:C.SENS_ST, val:float , high_cau
         val (float): 温度
         high_caut(float): 警告温度
         high_warn(float): 注意温度
+        rate(float, optional): 上昇率（℃/分 RISE_WARN）. 初期値 None.
     Returns:
         str: メッセージ文字列
     """
@@ -108,158 +80,19 @@ def makeNotifyMessage( sens:str, node:str, state:C.SENS_ST, val:float , high_cau
     elif state == C.SENS_ST.HIGH_WARN :
         mess = f"🟠注意!【{node} {sens}】が{high_warn}℃を超えました(現在{val}℃)\n"
         C.logger.debug(mess)
+    elif state == C.SENS_ST.RISE_WARN :
+        rate = f"毎分{rate:+.1f}℃で" if rate != None else ""
+        mess = f"📈注意!【{node} {sens}】の温度が{rate}上昇しています(現在{val}℃)\n"
+        C.logger.debug(mess)
+    elif state == C.SENS_ST.STUCK :
+        mess = f"⏸センサー【{node} {sens}】の値が{C.TREND['STUCK']:.0f}分以上変化していません\nセンサーを確認してください\n"
+        C.logger.debug(mess)
     elif state == C.SENS_ST.LOST :
         mess = f"🏠センサー【{node} {sens}】と接続できません\n電池や設置場所を確認してください\n"
         C.logger.debug(mess)
     return mess
 
 
-def POST_discord(  mess, token, linkURL ):
-    """discordにPOST
-       URL https://discord.com/api/webhooks/
-    Args:
-        mess (str): 通知メッセージ
-        token (str): discord URL & TOKEN
-        url (str): グラフURL
-    Returns:
-        int: status_code  200:OK
-    """
-    try:
-        if linkURL != "" :
-            m = f"{mess}\n📊グラフ\n{linkURL}"
-        else :
-            m = mess
-        url = "https://discord.com/api/webhooks/"+token
-        #C.logger.warning(f"discord : {url}")
-        headers = { 'Content-Type': 'application/json' }
-        data = {'content': f'{m}'}
-        r_post = requests.post(url, headers=headers, data=json.dumps(data) )
-        C.logger.debug(f"POST Discord->Result({r_post.status_code})")
-        return r_post.status_code
-    
-    except Exception as e:
-        C.logger.error(f"[POST_discord] Excption: {e}")
-        return None
- 
-
-def sent_Ambient( amb_conf, sendDATA ):
-    """Ambientにデータ送信
-    Args:
-        amb_conf (dict): 送信先のAmbient情報（DICT形式）
-        sendDATA (list): 送信データ( { 'd1': data, 'd2':data ..... })
-    Returns:
-        bool : True 成功 / False 失敗
-    """
-    sendDATA['created'] = C.getTimeSTR()
-    channel = amb_conf['channelID']
-    writeKey = amb_conf['writeKey']
-    use = amb_conf['use']
-
-    # 利用しない場合は何もしない
-    if not use :
-        C.logger.warning(f"[sent_Ambient] Not Use Ambient...SKIP")
-        return False
-
-    ## データが無い場合は送信しない
-    # データが無くても全データを送信する。（無い値は0にしておくため）
-    # 利用するかはAmbient側でグラフ設定するため問題ない
-    # データロスト時に0になるので、わかりやすいはず
-
-    am = ambient.Ambient(channel, writeKey)
-
-    #データの作成 dictionaryで作成する
-    #データはd1~d8として作成する。
-    #ローカルタイムスタンプは 'created': 'YYYY-MM-DD HH:mm:ss.sss' として作成する。
-    
-    for retry in range(3):
-        # 2秒間隔で3回リトライ
-        try:
-            C.logger.info(f"Send Ambient(ch:{channel}) ... ")
-            ret = am.send(sendDATA)
-            if ret.status_code == 200 :
-                C.logger.info(f"[Ambient] Response({ret.status_code}) done")
-                return True
-            elif ret.status_code == 403 :
-                C.logger.warning(f"[Ambient] Response({ret.status_code}) wait 3 sec")
-                time.sleep(3)
-                continue
-
-            else :
-                C.logger.warning(f"[Ambient] Response({ret.status_code}) ")
-                time.sleep(0.2)
-                return False
-
-        except requests.exceptions.RequestException as e:
-            C.logger.error(f"[sent_Ambient] request failed:{e}")
-
-        except Exception as e:
-            C.logger.error(f"[sent_Ambient] Exception:{e}")
-
-        time.sleep(2)
-
-    return False 
-
-
-def sent_GAS( GAS, sendDATA):
-    """Google Apps Script(GAS) 宛てにデータ送信
-    Args:
-        GAS (str): GASのWEB-API
-        sendDATA (str): 送信データ（）
-    Returns:
-        bool: 成功/失敗
-
-    10秒タイムアウトなので３リトライで終了
-    """
-    #sendDATA['date'] = C.toTimespan(sendDATA['date'])
-    past = time.time()
-    for retry in range(3):
-        # 3秒間隔で3回リトライ
-        try:
-            ret = requests.post(GAS, data=json.dumps(sendDATA), headers={'Content-Type': 'application/json'}, timeout=15)
-            if ret.status_code == 200 :
-                C.logger.info(f"[GAS] Response({ret.status_code}) time={time.time() - past :5.2}sec")
-                return True
-            else :
-                C.logger.warning(f"[GAS] Response({ret.status_code}) time={time.time() - past :5.2}sec")
-                return False
-
-        except requests.exceptions.RequestException as e:
-            C.logger.error(f"[sent_GAS] request failed : {e}")
-            return False
-
-        except requests.exceptions.Timeout as e:
-            C.logger.error(f"[sent_GAS] request timeout : {e}")
-
-        except Exception as e:
-            C.logger.error(f"[sent_GAS] Exception:{e}")
-            return False
-
-        time.sleep(3)
-
-    return False
-
-def countFromStatus( status:C.SENS_ST , data:dict ) -> int:
-    """指定したステータスでカウントを計算
-    Args:
-        status (IntEnum): センサー状態
-        data (dict): notifyから取得したdict
-    Returns:
-        int: カウント値
-    """
-    if len(data) == 0 : return 1
-    if status == data['status'] : return data['count'] + 1
-    return 1
-
-def IsRegistMAC( mac ) -> bool :
-    """指定したMACのセンサーが登録されているか？
-    Args:
-        mac (str): センサーMAC
-    Returns:
-        bool: True 登録済
-    """
-    name = S.getSensName( mac )
-    return False if name == "" else True
-
 def _send_cloud() :
     """GATEWAYのSQLに入っているデータを選別してCloudに送信する
        ・通知が必要かをチェック
@@ -273,11 +106,13 @@ def _send_cloud() :
     ## === Latestの全データを確認して通知が必要な物はフラグを立てる
     C.logger.info("[SAST_observer] Send Cloud ....")
     notifyListAll = S.getNotifyList(0)
-    sensDATAs = S.getLatestAll()
+    sensDATAs = S.getLatestAll(delete=False)  # latestは outbox 登録時に削除する
 
-    # -- データが無ければ実行しない
+    # -- データが無ければ実行しない（送信待ちが残っていれば再送のみ）
     if len(sensDATAs) == 0:
         C.logger.warning("No Senser DATA ... skip")
+        _fanout_cloud(_outbox_jobs(S))
+        _log_outbox(S)
         return
     
     # -- dump latest DATA
@@ -290,81 +125,23 @@ def _send_cloud() :
 
 
     ## ============================================================================================
-    #  センサー温度が閾値超えかをチェック
+    #  センサー温度が閾値超えか・LOSTかを判定（libJudge 全センサーを1パスで判定）
     C.logger.info(f"Judgement SENS:{len(sensDATAs)} / NOTIFY:{len(notifyListAll)}")
-    for n in notifyListAll :
-        # センサーデータを検索
-        s = _searchSensorData(sensDATAs, n['mac'])
-        if s != None :
-            # --> センサーがLatestから見つかったので温度検知確認
-            # この状態ではLatestにセンサーが存在している（＝LOSTしていない）
-
-            # Node情報なら次にスキップ
-            if s['mac'].startswith('00:00:00') : continue
-
-            # 指定したMACの閾値情報を取得
-            (lc,lw,hw,hc) = S._getThreshold( s['mac'])
-
-            # この時点で
-            # s -- latestに挿入されているセンサー
-            # n -- latestのセンサーのnotify情報
-            # 更新日(date)、LOST日時()、状態(status)、NOTIFYフラグ(notify)、通知数（count)
-            
-            # 温度チェックの実施
-            if OverCautionTemp( s['templ'] , hc ) :
-                #超過なら通知ON（日時、通知、ステータス:警告）を更新
-                C.logger.info(f"警告 {s['mac']}")
-                count = countFromStatus( C.SENS_ST.HIGH_CAUTION, n )
-                S.updateNotify(s['mac'], C.SENS_ST.HIGH_CAUTION, count )
-
-            elif OverWanringTemp( s['templ'], hw ) :
-                #注意の温度になっているので前回の状態を確認( 5分経過 )
-                C.logger.info(f"check WARN {s['mac']} .... {s['templ']}")
-                if n['count'] == 0 :
-                    ## 前回の記録が無いので通知する。
-                    C.logger.info(f"注意 {s['mac']} <- first ")
-                    S.updateNotify(s['mac'], C.SENS_ST.HIGH_WARN, 1 )
-                # 前回の記録があるので5分経過を確認
-                elif PassedMinute( s['date'], minute=5 ) :
-                    # 5分経過していたので通知する
-                    C.logger.info(f"注意 {s['mac']} <ｰｰ {n['date']}")
-                    count = countFromStatus( C.SENS_ST.HIGH_WARN, n )
-                    S.updateNotify(s['mac'], C.SENS_ST.HIGH_WARN, count )
-                #5分経過してないなら通知はしないでそのまま
-            else :
-                #警告、注意でもなく、2分以内の更新なので正常として更新
-                C.logger.debug(f"通常 {s['mac']}")
-                S.updateNotify(s['mac'], C.SENS_ST.NORMAL, 0 )
-        else :
-            ## --- > センサーがNotifyの中に無かった場合なのでLOST疑い
-            # status == NONE はまだ接続したことが無いのでスキップ
-            if n['status'] == C.SENS_ST.NONE :
-                C.logger.debug(f"{n['mac']} -- Not Connected ... SKIP")
-                continue 
-
-            C.logger.debug(f"LOST? {n['mac']} - {n['date']}/{C.SENS_ST(n['status']).name}/{n['count']}")
-            ## 一度接続したことがあるセンサーなので、LOST疑いあり
-            if PassedMinute( n['date'], minute=15 ) and n['status'] == C.SENS_ST.NORMAL :
-                # 15分経過かつロストしていない場合は−＞初期のロスト
-                C.logger.info(f"LOST {n['mac']} <ｰｰ first")
-                S.updateNotify( n['mac'], C.SENS_ST.LOST, 1)
-
-            elif PassedMinute( n['date'], minute=15 ) and n['status'] == C.SENS_ST.LOST :
-                # 15分経過＋ロストの場合も通知して継続
-                C.logger.info(f"LOST {n['mac']} <- {n['date']} .... c:{n['count']}")
-                count = countFromStatus( C.SENS_ST.LOST, n )
-                S.updateNotify( n['mac'], C.SENS_ST.LOST, count)
-
-            ## 15分未満の場合は無視
-            C.logger.debug(f"OTHER ... SKIP")
+    J = Judge.JudgeEngine.load(S)
+    transitions = J.judge(sensDATAs, notifyListAll)
+    for t in transitions :
+        if t['status'] != C.SENS_ST.NORMAL and ( t['status'] != t['prev'] or t['count'] != t['prev_count'] ) :
+            C.logger.info(f"{C.SENS_ST(t['status']).name} {t['mac']} <- {C.SENS_ST(t['prev']).name} c:{t['count']}")
+    S.updateNotifyMany(transitions)  # 1トランザクションで反映
 
     ## ============================================================================================
-    #  discord 通知処理
-    C.logger.info("Notify to discord ...")
+    #  discord 通知（ディスパッチャに登録するだけで送信は libCloud の送信スレッドで行う）
+    C.logger.info("Make discord Notify ...")
+    D = Cloud.discord()
     max_node = S.numNode() # ノード数を取得
     for no in range(1, max_node + 1 ) : #ノード数でループ
         notifyList4Node = S.getNotifyList( no, ClearfNotify=True )
-        ## Notify List が存在するか？ 無ければ通知はSKIP 
+        ## Notify List が存在するか？ 無ければ通知はSKIP
         if not len(notifyList4Node) == 0 :
             mess = ""
             token = S.getDiscord( no )
@@ -379,34 +156,33 @@ def _send_cloud() :
                 if notify['count'] >= 10 : continue # 10回以上通知したなら通知無効
 
                 C.logger.info(f"Notify({notify['mac']}) -- {notify['date']} [{C.SENS_ST(notify['status']).name}] ct:{notify['count']}")
-                ( sens_name, node_name, nodeNo, warn ) = S.getSensorInfo(notify['mac'])
-                #( lc, lw, hw, hc ) = S._getThreshold( notify['mac'])
-                sens = _searchSensorData( sensDATAs, notify['mac'])
-                templ = sens['templ'] if sens != None else 0
-                mess += makeNotifyMessage( sens_name, node_name, notify['status'], templ , warn['hC'], warn['hW'] )
+                ( sens_name, node_name, nodeNo, warn ) = J.sensorInfo(notify['mac'])
+                if sens_name == None : continue # 設定に無いセンサーはSKIP
+                mess += makeNotifyMessage( sens_name, node_name, notify['status'], J.templ(notify['mac']), warn['hC'], warn['hW'], J.trend(notify['mac']).get('slope') )
 
             if mess != "" : ## メッセージが作成されていれば通知
                 amb_conf = S.getAmbientInfo( no )
                 if amb_conf == None :  # Ambient未指定ならNULLとして通知
-                    POST_discord( mess, token, "" )
+                    D.post( token, mess, "" )
                 else :
-                    POST_discord( mess, token,  f"{C.AMB['URL']}{amb_conf['id']}" )
+                    D.post( token, mess, f"{C.AMB['URL']}{amb_conf['id']}" )
 
     ## ===========================================================================================
-    #  Ambient送信
+    #  Ambient送信データ作成
     C.logger.info("Make Ambient DATA. ")
+    items = list()  # outbox登録データ ( sink, key, payload )
     ## ---　ノード毎でMACを纏めて、データを生成し、Ambientに送信する
     for node in range(1, S.numNode() + 1 ) :
         # -- ノードのチャンネルデータを取り出す
         amb_conf = S.getAmbientInfo(node)
-        if amb_conf == None : continue  # -- Ambentが未設定ならSKIP    
+        if amb_conf == None : continue  # -- Ambentが未設定ならSKIP
         ##-- Nodeを指定して配列再生成
-        res = [[d['node'], d['mac'], d['templ'], d['ambient_conf']] for d in sensDATAs if d['node'] == node]
+        res = [[d['node'], d['mac'], d['templ'], d['ambient_conf'], d['date']] for d in sensDATAs if d['node'] == node]
         #print(res)
 
         # 送信データのセット
         data = {}
-        if C.AMB_SEND_NODATA : 
+        if C.AMB_SEND_NODATA :
             # データが設定されていなくてもAmbientに送る場合は、全データをセットしておく
             data = { 'd1':0,'d2':0,'d3':0,'d4':0,'d5':0,'d6':0,'d7':0,'d8':0 }
         else :
@@ -417,20 +193,21 @@ def _send_cloud() :
         for sens in res :
             if sens[1].startswith("00:00:00:00:00:") : continue ## -- NodeはSKIP
             #print(sens)
-            if sens[3] == "" : 
+            if sens[3] == "" :
                 C.logger.error(f"Not set Ambient Index {sens[1]}")
                 break
             data[sens[3]] = sens[2]
 
-        #-- データが生成したなら、Ambientに送信
-        C.logger.debug(f"Send Ambient(LORA{node:02}) {data}")        
-        sent_Ambient( amb_conf, data)
-
-
+        if not amb_conf['use'] : continue # -- Ambientを利用しないならSKIP
+        ## 再送時も計測した時刻でグラフ化する（ノードのセンサーの最新の計測日時）
+        dates = [ sens[4] for sens in res if not sens[1].startswith("00:00:00:00:00:") ]
+        data['created'] = max(dates) if len(dates) != 0 else C.getTimeSTR()
+        C.logger.debug(f"Send Ambient(LORA{node:02}) {data}")
+        items.append(('ambient', amb_conf['channelID'], {'conf':amb_conf, 'data':data}))
 
     ## ============================================================================================
-    #  GAS 送信
-    C.logger.info("Send Google Apps Script (GAS) ....")
+    #  GAS 送信データ作成
+    latest = [ (d['mac'], d['date']) for d in sensDATAs ]  # outbox登録時に削除するlatest
     dataS = []
     for data in sensDATAs :
         ## GAS用に日時データを変換（UnixTime）
@@ -440,27 +217,188 @@ def _send_cloud() :
         del data['node']
         dataS.append(data)
         ## 不要なキーを削除
-    sent_GAS( C.GAS, dataS ) #配列で一気に挿入
-    C.logger.info("done.")
+    for chunk in Cloud.chunk_records(dataS) : # 大きさで分割して登録（チャンク毎に送信・再送する）
+        items.append(('gas', '', chunk))
+
+    ## outboxに登録してlatestを削除（送信に失敗してもoutboxから再送する）
+    S.enqueueOutbox(items, latest)
+
+    ## ============================================================================================
+    #  Cloud 送信（全送信先を並列実行）
+    jobs = _outbox_jobs(S)
+    C.logger.info(f"Send Cloud ({len(jobs)} requests) ....")
+    _fanout_cloud(jobs)
+    _log_outbox(S)
 
     C.logger.info(f"Cloud Send done .... Wait after {C.SPAN_SEND_CLOUD} minutes....\n")
 
 
-def _searchSensorData( sensDATAs , mac ) :
-    """ 内部関数：センサーデータのリストからMACに一致する列を返す """
-    for s in sensDATAs :
-        if s['mac'] == mac : return s
-    return None
+def _outbox_jobs( S ) -> list :
+    """ 内部関数：outboxの送信ジョブ（_fanout_cloud用）
+    Ambientはチャンネル毎に1ジョブ（チャンネル毎に並列に送信し、outboxもチャンネル毎に記録する）
+    GASはまとめて1ジョブ（チャンクの並列送信は Cloud.gas().upload() で行う）
+    """
+    jobs = list()
+    channels = dict()
+    for r in S.getOutbox('ambient') :
+        channels.setdefault(r['key'], list()).append(r)
+    for ch, rows in channels.items() :
+        jobs.append(('ambient', ch, _drain_ambient, (rows,)))
+    jobs.append(('gas', 'outbox', _drain_gas, ()))
+    return jobs
+
+def _drain_ambient( rows, deadline=None ) -> bool :
+    """1チャンネル分のoutboxの送信待ちデータを dataarray で送信（スレッドプールで実行）
+    失敗したデータは指数バックオフで次回以降に再送する
+    Args:
+        rows (list): 同じチャンネルのoutboxのdict型list（古い順）
+        deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+    Returns:
+        bool: 送信結果
+    """
+    S = SQL.SQL() ## Thread 起動なので必須
+    C.logger.info(f"[outbox] ambient({rows[0]['key']}) send {len(rows)} ( oldest {rows[0]['created']} )")
+    ## 設定は最新のものを使う
+    ok = Cloud.sent_Ambient( rows[-1]['payload']['conf'], [ r['payload']['data'] for r in rows ], deadline=deadline )
+    S.markOutbox( [ r['id'] for r in rows ], ok, "" if ok else "send error" )
+    return ok
+
+def _drain_gas( deadline=None ) -> bool :
+    """GASのoutboxの送信待ちデータをまとめて送信（スレッドプールで実行）
+    複数サイクル分を大きさ以内のチャンクにまとめて並列に送信し、チャンク毎に成否を記録する
+    失敗したデータは指数バックオフで次回以降に再送する
+    Args:
+        deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+    Returns:
+        bool: 全て送信できたか（送信待ちが無い場合もTrue）
+    """
+    S = SQL.SQL() ## Thread 起動なので必須
+    rows = S.getOutbox('gas')
+    if len(rows) == 0 : return True
+    C.logger.info(f"[outbox] gas send {len(rows)} ( oldest {rows[0]['created']} )")
+
+    chunks, part, size = list(), list(), 0
+    for r in rows :
+        n = len(json.dumps(r['payload'], ensure_ascii=False).encode())
+        if len(part) != 0 and size + n > C.GAS_UPLOAD['CHUNK'] :
+            chunks.append(part)
+            part, size = list(), 0
+        part.append(r)
+        size += n
+    if len(part) != 0 : chunks.append(part)
+
+    result = True
+    results = Cloud.gas().upload( C.GAS, [ [ d for r in rs for d in r['payload'] ] for rs in chunks ], deadline )
+    for rs, ok in zip(chunks, results) :
+        S.markOutbox( [ r['id'] for r in rs ], ok, "" if ok else "send error" )
+        result &= ok
+    if not result :
+        C.logger.warning(f"[outbox] gas {results.count(False)}/{len(results)} chunks failed ... resend later")
+    return result
+
+def _log_outbox( S ) :
+    """ 内部関数：outboxの滞留状況をログ出力 """
+    for sink, st in S.getOutboxStats().items() :
+        M_OUTBOX.labels(sink=sink).set(st['pending'])
+        if st['pending'] == 0 and st['dead'] == 0 : continue
+        C.logger.info(f"[outbox] {sink:8} pending:{st['pending']} age:{st['age']}sec attempts:{st['attempts']} dead:{st['dead']}")
+
+def _call_sink( sink, key, func, args, deadline ) -> tuple :
+    """ 内部関数：送信を実行して ( sink, key, 成否, 所要時間 ) を返す（スレッドプールで実行） """
+    start = time.time()
+    ret = func(*args, deadline=deadline)
+    M_SINK_SEC.labels(sink=sink).observe(time.time() - start)
+    M_SINK.labels(sink=sink, result="ok" if ret else "ng").inc()
+    return sink, key, bool(ret), time.time() - start
+
+def _fanout_cloud( jobs:list ) -> dict :
+    """Cloud送信をスレッドプールで並列実行し、送信先毎の結果と遅延をログ出力する
+    送信先毎に期限（C.CLOUD_DEADLINE）を設け、全体は C.CLOUD_BUDGET 秒で打ち切る
+    打ち切った送信はバックグラウンドで継続するが結果は timeout として集計する
+    Args:
+        jobs (list): ( sink, key, func, args ) のlist
+    Returns:
+        dict: 送信先毎の集計 { sink: {'num','ok','ng','timeout','max'} }
+    """
+    start = time.time()
+    futures = dict()
+    for sink, key, func, args in jobs :
+        deadline = start + min(C.CLOUD_DEADLINE.get(sink, C.CLOUD_BUDGET), C.CLOUD_BUDGET)
+        futures[_POOL.submit(_call_sink, sink, key, func, args, deadline)] = ( sink, key )
+
+    done, not_done = concurrent.futures.wait(futures, timeout=C.CLOUD_BUDGET)
+
+    stats = dict()
+    for sink, key in futures.values() :
+        stats.setdefault(sink, {'num':0, 'ok':0, 'ng':0, 'timeout':0, 'max':0.0})['num'] += 1
+    for f in done :
+        try :
+            sink, key, ok, elapsed = f.result()
+        except Exception as e :
+            sink, key = futures[f]
+            C.logger.error(f"[cloud] {sink}({key}) Exception:{e}")
+            stats[sink]['ng'] += 1
+            continue
+        st = stats[sink]
+        st['ok' if ok else 'ng'] += 1
+        st['max'] = max(st['max'], elapsed)
+        C.logger.debug(f"[cloud] {sink}({key}) {'OK' if ok else 'NG'} {elapsed:.2f}sec")
+    for f in not_done :
+        sink, key = futures[f]
+        C.logger.warning(f"[cloud] {sink}({key}) over budget {C.CLOUD_BUDGET}sec")
+        stats[sink]['timeout'] += 1
+        M_SINK.labels(sink=sink, result="timeout").inc()
+
+    for sink, st in stats.items() :
+        C.logger.info(f"[cloud] {sink:8} num:{st['num']} ok:{st['ok']} ng:{st['ng']} timeout:{st['timeout']} max:{st['max']:.2f}sec")
+    C.logger.info(f"[cloud] cycle {time.time() - start:.2f}sec / budget {C.CLOUD_BUDGET}sec")
+    M_CYCLE_SEC.observe(time.time() - start)
+    st = Cloud.discord().stats(reset=True)
+    C.logger.info(f"[cloud] discord  queued:{st['queued']} sent:{st['sent']} failed:{st['failed']} 429:{st['limited']} pending:{st['pending']} delay:{st['delay']:.2f}sec")
+    st = HTTP.stats(reset=True)
+    C.logger.info(f"[cloud] HTTP new:{st['new']}({st['new_avg']:.2f}sec) reuse:{st['reuse']}({st['reuse_avg']:.2f}sec) saved:{st['saved']:.2f}sec error:{st['error']}")
+    return stats
+
+
+def _getConfVersion4GApps( conf_date ) :
+    """ 内部関数：GASの設定の版（更新日付）だけを取得する（sens=version 設定データ本体は取得しない）
+    Args:
+        conf_date (str): 保存している更新日付（YYYY-MM-DD HH:MM:SS）
+    Returns:
+        bool: True 更新あり / False 更新なし / None 版の確認ができない（GASが未対応・通信エラー）
+    """
+    try :
+        res = HTTP.get(C.GAS, params={'sens':'version'}, timeout=15)
+        if res.status_code != 200 : return None
+        cloud_date = datetime.datetime.strptime(res.json()['date'], "%Y/%m/%d %H:%M:%S")
+    except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e :
+        C.logger.debug(f"[observer] GAS version check not available : {e}")
+        return None
+    C.logger.debug(f"[observer] conf version local:{conf_date} cloud:{cloud_date}")
+    return conf_date == None or C.str2Datetime(conf_date) != cloud_date
 
 
 def _getSetting4GApps( verbose=False ) :
-    ''' GASにて指定されたURLから設定情報を取得して更新する。'''
+    ''' GASにて指定されたURLから設定情報を取得して更新する。
+    先に設定の版（更新日付）を確認し、変わっていなければ設定データ本体は取得しない。
+    本体を取得した場合もハッシュが同じならDATABASEは更新しない。ACKはバックグラウンドで送信する。
+    '''
     C.logger.info(f"[observer] Get Config Data for Google")
     start=time.time()
+    S = SQL.SQL()
+    ( conf_date, conf_hash ) = S.getConfVersion()
+
+    ## 版の確認（GASが sens=version に対応していなければ本体を取得して判断）
+    changed = _getConfVersion4GApps( conf_date )
+    if changed == False :
+        C.logger.info(f"----- No update required (version) {time.time() - start:.3g}sec")
+        _POOL.submit( _sendACK2GAS, "" )
+        return False
+
     header = {"content-type": "application/json"}
+    if conf_hash != "" : header['If-None-Match'] = f'"{conf_hash}"'
     try :
-        urllib3_cn.allowed_gai_family = allowed_gai_family4
-        res = requests.get(f"{C.GAS}?sens=sensor", headers=header, timeout=15)
+        res = HTTP.get(f"{C.GAS}?sens=sensor", headers=header, timeout=15)
 
     except requests.exceptions.Timeout as e:
         C.logger.error(f"[observer] GAS request timeout : {e} -- skip")
@@ -470,9 +408,13 @@ def _getSetting4GApps( verbose=False ) :
         C.logger.error(f"[observer] HTTP Connection Error : {e} .... SKIP")
         return False
 
+    if res.status_code == 304 :
+        C.logger.info(f"----- No update required (not modified) {time.time() - start:.3g}sec")
+        _POOL.submit( _sendACK2GAS, "" )
+        return False
+
     # データがGASから取得できた
     if res.status_code == 200 :
-        S = SQL.SQL()
         updateDate = None
         try : 
             updateDate = datetime.datetime.strptime(res.json()[0]['date'], "%Y/%m/%d %H:%M:%S")
@@ -481,52 +423,57 @@ def _getSetting4GApps( verbose=False ) :
             ## GASの日付エラー
             mess = f"Update Date is Invalid ... {res.json()[0]['date']}"
             C.logger.error(mess)
-            _sendACK2GAS( mess )
+            _POOL.submit( _sendACK2GAS, mess )
             return False
 
         # GASデータの取得
         confData = []
         for d in res.json()[1:] :
             confData.append(d)
-        (ret, mess ) = S.updateSystemConf( confData, updateDate )
-
-        if verbose :
-            import pprint
-            C.logger.info(pprint.pformat(confData))
-        
+        confHash = hashlib.sha256(json.dumps(confData, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        if confHash == conf_hash :
+            ## 設定内容が同じなので更新日付のみ記録
+            C.logger.info(f"----- No update required (same hash) {time.time() - start:.3g}sec")
+            S.setConfVersion( updateDate, confHash )
+            _POOL.submit( _sendACK2GAS, "" )
+            return False
+        (ret, mess ) = S.updateSystemConf( confData, updateDate, confHash )
 
         if ret :
             C.logger.info(f"Update done. {time.time() - start:.3g}sec")
             if verbose :
                 import pprint
                 C.logger.info(pprint.pformat(confData))
-            _sendACK2GAS( mess )
+            _POOL.submit( _sendACK2GAS, mess )
             return True
             
         elif ret == None :
             C.logger.error(f"Update Error. {time.time() - start:.3g}sec")
-            _sendACK2GAS( mess )
+            _POOL.submit( _sendACK2GAS, mess )
 
         else :
             C.logger.info(f"----- No update required {time.time() - start:.3g}sec")
-            _sendACK2GAS( mess )
+            S.setConfVersion( updateDate, confHash )
+            _POOL.submit( _sendACK2GAS, mess )
             return False
 
     else :
-        C.logger.error(f"Connection Error code:{res.status_code}  {time.time() - start:.3g}sec")
-        _sendACK2GAS( mess )
-        C.logger.debug(f"MESS{mess}")
+        mess = f"Connection Error code:{res.status_code}"
+        C.logger.error(f"{mess}  {time.time() - start:.3g}sec")
+        _POOL.submit( _sendACK2GAS, mess )
 
 
 def _sendACK2GAS( message ) :
-    """ 内部関数：GASにACKを送信（メッセージ付き）"""
+    """ 内部関数：GASにACKを送信（メッセージ付き）
+    リトライで最大60秒かかるため _POOL（バックグラウンド）で実行する
+    """
 
     # ACKを返送(5回実施)
     header = {"content-type": "application/json"}
     count = 0
     while True :
         try :
-            res = requests.get(f"{C.GAS}?sens=ack&mess={message}", headers=header)
+            res = HTTP.get(C.GAS, params={'sens':'ack', 'mess':message}, headers=header, timeout=15)
 
         except Exception as e :
             C.logger.error(f"HTTP Connection Error : {e} .... SKIP")
@@ -557,22 +504,29 @@ def _checkBattery() :
     battery_info = {}
     S = SQL.SQL()
     mess = ""
+    states = S.getSensorStateAll()  # センサー毎の最新状態（historyは検索しない）
+    forecasts = S.getBattForecastAll()  # 電池交換日の予測（batt_fit）
     for node in range( 1, S.numNode()+1 ) :
         sensors = S.getSensors( node )
         for s in sensors :
             # センサーデータ取得
             try :
                 ( mac, name ) = s
-                ( batt, date, rssi, ext ) = S.getBattery(mac)
+                st = states[mac]
+                ( batt, date, rssi, ext ) = ( st['batt'], st['batt_date'], st['rssi'], st['ext'] )
                 battery_info['name'] = name
                 battery_info['batt'] = batt
                 C.logger.info(f"{name}:{mac}({date})- {batt}%")
             except Exception as e :
                 C.logger.debug(f"No data {mac} ... skikp")
                 continue
+            if batt == None : continue  # 電池の値を受信していない
             #情報生成
-            if batt <= 15.0 : 
+            fc = forecasts.get(mac, {})
+            if batt <= C.BATT_FIT['REPLACE'] : 
                 mess += f"{name} : {batt}% 要交換!!\n"
+            elif fc.get('date') != None :
+                mess += f"{name} : {batt}% 交換予定 {fc['date']}（あと{fc['days']}日）\n"
             else :
                 mess += f"{name} : {batt}% \n"
         
@@ -581,13 +535,19 @@ def _checkBattery() :
         ( no, node_name) = S.getNodeInfo( node )
         mess = f"{node_name} のバッテリー情報\n" + mess 
         
-        # DIscord通知
+        # DIscord通知（同じWebhookのノードは1つのメッセージにまとめて送信）
         token = S.getDiscord( node )
-        POST_discord( mess, token, "" )
+        Cloud.discord().post( token, mess, "" )
         mess = ""
     
+def _rollupHistory() :
+    """ historyの1時間毎の集計（rollup_hour）を更新 """
+    S = SQL.SQL()
+    S.rollupHistory()
+
 def _intr_term( num, frame) :
     C.logger.warning(f"SIGTERM catch exit... {num}")
+    Cloud.discord().flush(5)  # 送信待ちの通知を送ってから終了
     sys.exit(0)
 
 ## MAIN
@@ -613,6 +573,7 @@ if __name__ == '__main__' :
     elif len(args) != 1 and args[1].upper() == "BATTERY" :
         C.logger.info("Notify Sensor BatteryInfo ")
         _checkBattery()
+        Cloud.discord().flush()
         sys.exit(0)
 
     ### UNIX Signal Register
@@ -626,9 +587,8 @@ if __name__ == '__main__' :
         C.logger.error("NBUild /boot/GAS_ssetting/py and Resgtert System... shutdown")
         sys.exit(1)
     ##2 URL 404
-    import requests
     try :
-        res = requests.get(C.GAS)
+        res = HTTP.get(C.GAS, timeout=15)
     except Exception as e:
         C.logger.error(f"GAS URL {C.GAS} is Error Occord \n{e}")
         sys.exit(1)
@@ -639,22 +599,25 @@ if __name__ == '__main__' :
     # 設定情報の更新
     _getSetting4GApps(True)
 
-    ### =========== スケジューラ登録
+    ### =========== スケジューラ登録（ジョブ毎に独立して実行）
+    R = RT.runtime()
     ## 2分毎に秒にsend_cloud()を実行
     C.logger.info(f"[observer] _send_cloud() {C.SPAN_SEND_CLOUD} minutes.")
-    schedule.every(C.SPAN_SEND_CLOUD).minutes.at(':00').do(_send_cloud)
+    R.every(C.SPAN_SEND_CLOUD * 60, _send_cloud, name="send_cloud")
 
     ## 1時間毎にGoogleから設定情報を取得して更新
     C.logger.info(f"[observer] _getSetting4GApps() {C.SPAN_CONFIG_UPDATE} hours.")
-    schedule.every(C.SPAN_CONFIG_UPDATE).hours.do(_getSetting4GApps)
+    R.every(C.SPAN_CONFIG_UPDATE * 3600, _getSetting4GApps, offset=time.time(), name="config")
 
     ## 毎日朝8時にバッテリー情報を通知
     C.logger.info(f"[observer] _checkBattery() 8:15 hours.")
-    schedule.every().day.at("08:15").do(_checkBattery)
-
-    ## 実行し続ける ループ 
-    while True:
-        # 次の行で実行まで待つ。
-        schedule.run_pending()
-        # 終わったらsleepしてもう一度
-        time.sleep(1)
+    R.daily("08:15", _checkBattery, name="battery")
+
+    ## 毎時05分にhistoryの1時間毎の集計を更新（libSQLite.aggregate で使用）
+    R.every(3600, _rollupHistory, offset=300, name="rollup")
+
+    ## メトリクスの出力（libMetrics.py）
+    Metrics.start("observer", background=False)
+
+    ## 実行し続ける（SIGTERM/SIGHUPで終了）
+    R.run()
@@ -18,12 +18,13 @@ import config as C
 import libMachineInfo as M
 import libSensor as SENSOR
 import libSQLite as SQL
+import libRuntime as RT
+import libMetrics as Metrics
 
 ## import system
 import time
 import sys
 import signal
-import schedule
 
 ###### SIGTERM 
 def intr_signal_term(num,frame):
@@ -105,12 +106,10 @@ if __name__ == '__main__':
     C.logger.info("[Recoder] Init NODE Databases...")
     S = SQL.SQL("STARTUP_NODE")
 
-    ## データを送信するするスケジュール登録
-    schedule.every().minute.at(sec).do(_getSensorDATA)
+    ## データを送信するするスケジュール登録（毎分 start_sec 秒）
+    R = RT.runtime()
+    R.every(60, _getSensorDATA, offset=start_sec, name="sensor")
+    Metrics.start("recorder", background=False)
 
-    ## 無限ループ
-    while True:
-        # 次の行で実行まで待つ。
-        schedule.run_pending()
-        # 終わったらsleepしてもう一度
-        time.sleep(1)
+    ## 無限ループ（ROOTで無い場合は _getSensorDATA() の sys.exit で終了）
+    R.run()
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+SAST Gatewayキャプチャ再生ツール SAST_replay.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+Summary:
+libLORA.py GATE で記録したキャプチャファイル（libCapture.py）を再生し、
+Gatewayと同じ decode_frame() → 重複チェック → appendData() の経路でSQLiteに投入する。
+・最速再生（性能の回帰確認）
+・実時間再生（--realtime / --speed）
+・まとめて投入（--batch N で appendDataMany）
+・NumPyの構造化配列でまとめてデコード（--numpy）
+現場で起きたデコード不具合をラズパイ無しで再現するために利用する。
+
+使い方:
+  ./SAST_replay.py capture.bin --db ./replay.sqlite [--realtime] [--speed 2] [--batch 200] [--all] [--numpy]
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+## import ORIGINAL
+import config as C
+import libSQLite as SQL
+import libCapture as CAP
+
+## import system
+import argparse
+import datetime
+import sys
+import time
+
+NUMPY_CHUNK = 8192      # NumPyでまとめてデコードするレコード数
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="replay SAST gateway capture file")
+    parser.add_argument("capture", help="capture file (libLORA.py GATE capture)")
+    parser.add_argument("--db", default="./replay.sqlite", help="SQLite database to ingest into")
+    parser.add_argument("--realtime", action="store_true", help="replay with recorded timing")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed factor for --realtime")
+    parser.add_argument("--batch", type=int, default=0, help="ingest with appendDataMany every N records (0: appendData)")
+    parser.add_argument("--all", action="store_true", help="ingest all records without useSensor() check")
+    parser.add_argument("--numpy", action="store_true", help="decode with numpy structured dtype (not with --realtime)")
+    return parser.parse_args()
+
+
+def replay( path:str, realtime=False, speed=1.0, batch=0, use_all=False, use_numpy=False ) -> dict :
+    """キャプチャファイルを再生してSQLに投入
+    Args:
+        path (str): キャプチャファイル
+        realtime (bool, optional): 記録時の間隔で再生する. 初期値 False.
+        speed (float, optional): 実時間再生の倍速. 初期値 1.0.
+        batch (int, optional): N件毎にappendDataManyで投入（0はappendData）. 初期値 0.
+        use_all (bool, optional): useSensor()を確認せずに全て投入. 初期値 False.
+        use_numpy (bool, optional): NumPyの構造化配列でまとめてデコード（実時間再生以外）. 初期値 False.
+    Returns:
+        dict: 再生結果
+    """
+    ## libLORA は読み込み時にSQL()を生成するので DB_PATH 設定後に読み込む
+    import libLORA as L
+
+    S = SQL.SQL()
+    link = L.LinkRegistry()
+    dedupe = L.RecordDedupe()
+    use_cache = {}
+    pending = list()
+    result = {'frames':0, 'records':0, 'inserted':0, 'skipped':0, 'rejected':0 }
+
+    def ingest( records ) :
+        ''' 重複チェック → useSensor() → appendData / appendDataMany '''
+        nonlocal pending
+        for sdata in records :
+            result['records'] += 1
+            if dedupe.seen(sdata) : continue
+            if not use_all :
+                key = ( sdata['node'], sdata['mac'] )
+                if key not in use_cache : use_cache[key] = S.useSensor(sdata['node'], sdata['mac'])
+                if not use_cache[key] :
+                    result['skipped'] += 1
+                    continue
+
+            if batch <= 0 :
+                if S.appendData(sdata)[0] : result['inserted'] += 1
+                continue
+            pending.append(sdata)
+            if len(pending) >= batch :
+                result['inserted'] += S.appendDataMany(pending)
+                pending = list()
+
+    ## NumPy用のバッファ（レコード毎のRSSIと日付範囲）
+    use_numpy = use_numpy and not realtime
+    if use_numpy and L.np == None :
+        C.logger.warning("[replay] numpy not found ... use struct decoder")
+        use_numpy = False
+    buf = bytearray()
+    buf_rssi, buf_start, buf_end = list(), list(), list()
+    size = L.DATA_STRUCT.size
+
+    def flush_numpy() :
+        nonlocal buf, buf_rssi, buf_start, buf_end
+        if len(buf) == 0 : return
+        records, rejected = L.decode_records_np(bytes(buf), buf_rssi, L.np.array(buf_start), L.np.array(buf_end))
+        result['rejected'] += rejected
+        ingest(records)
+        buf = bytearray()
+        buf_rssi, buf_start, buf_end = list(), list(), list()
+
+    first_recv = None
+    start = time.time()
+    for recv_time, rssi, payload in CAP.readCapture(path) :
+        ## 実時間再生の場合は記録時の間隔まで待つ
+        if realtime :
+            if first_recv == None : first_recv = recv_time
+            wait = (recv_time - first_recv) / speed - (time.time() - start)
+            if wait > 0 : time.sleep(wait)
+
+        result['frames'] += 1
+        today = datetime.date.fromtimestamp(recv_time)
+
+        if use_numpy and len(payload) % size == 0 :
+            ## 端数の無いフレームは連結してまとめてデコード
+            num = len(payload) // size
+            day_start, day_end = L._day_range(today)
+            buf += payload
+            buf_rssi += [rssi] * num
+            buf_start += [day_start] * num
+            buf_end += [day_end] * num
+            if len(buf_rssi) >= NUMPY_CHUNK : flush_numpy()
+            continue
+
+        nodeNO, channel, sequence, records = L.decode_frame(payload, rssi, link, today)
+        if nodeNO == None : continue
+        link.frame(nodeNO, sequence, rssi)
+        ingest(records)
+
+    flush_numpy()
+    result['inserted'] += S.appendDataMany(pending)
+    result['elapsed'] = time.time() - start
+    result['dups'] = dedupe.dups
+    result['rejected'] += sum([ l['rejected'] for l in link.snapshot() ])
+    result['links'] = link.snapshot()
+    return result
+
+
+if __name__ == '__main__' :
+    args = get_args()
+
+    ## 投入先のDATABASEを作成（既存のテーブルは消さない）
+    SQL.DB_PATH = args.db
+    S = SQL.SQL("SETUP")
+    del S
+
+    C.logger.info(f"[replay] {args.capture} -> {args.db}")
+    try :
+        res = replay(args.capture, realtime=args.realtime, speed=args.speed, batch=args.batch, use_all=args.all, use_numpy=args.numpy)
+    except (OSError, ValueError) as e :
+        print(f"ERROR : {e}")
+        sys.exit(1)
+
+    elapsed = res['elapsed'] if res['elapsed'] > 0 else 1e-9
+    print(f"frames   : {res['frames']} ({res['frames']/elapsed:.1f} frames/sec)")
+    print(f"records  : {res['records']} ({res['records']/elapsed:.1f} records/sec)")
+    print(f"inserted : {res['inserted']}  skipped:{res['skipped']}  dups:{res['dups']}  rejected:{res['rejected']}")
+    print(f"elapsed  : {res['elapsed']:.3f}sec")
+    for l in res['links'] :
+        print(f" NODE{l['node']:02} frames:{l['frames']} loss:{l['loss']:.3f} rssi:{l['rssi']} rejected:{l['rejected']}")
+    sys.exit(0)
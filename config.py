@@ -10,19 +10,54 @@ Ver. 2.0.1 2025/01/20
 Ver. 2.1.0 2025/02/16 Lora設定を移植（システム毎にアドレスを変える）
 Auther F.Takahashi
 """
+import atexit
+import datetime
+import logging
+import logging.handlers  as ih
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from enum import IntEnum
+
 ### -- Lora ADDR
 GATE_ADDR = 0x2310
 GATE_CHANNEL = 0
 BCAST_ADDR = 0xffff
 NODE_CHANNEL = 10
+## GATE 無線モジュール（E220）一覧 ※モジュール毎にチャンネルとNodeを分ける
+#  port:UART / channel:GATEの受信CH / node_channel:NodeのCH(Beacon送信先)
+#  nodes:担当するNode番号（[]は他のモジュールに無い全Node 担当外のNodeのフレームは登録もACKもしない） / beacon:Beacon送信秒(":SS")
+GATE_RADIOS = [
+    {'port':'/dev/ttyS0', 'channel':GATE_CHANNEL, 'node_channel':NODE_CHANNEL, 'nodes':[], 'beacon':':00'},
+#    {'port':'/dev/ttyUSB0', 'channel':GATE_CHANNEL+20, 'node_channel':NODE_CHANNEL+20, 'nodes':[5,6,7,8], 'beacon':':30'},
+]
 
 ### TIME Settings
 ## GATE
 SPAN_SEND_CLOUD = 2     #minute
+CLOUD_BUDGET = 90       #sec (1回のCloud送信全体の上限 SPAN_SEND_CLOUD未満にする)
+CLOUD_DEADLINE = {'discord':20, 'ambient':30, 'gas':60}  #sec (送信先毎の期限)
+CLOUD_WORKERS = 8       # Cloud送信の同時実行数
+## GATE Cloud送信待ち（outbox）
+OUTBOX_BATCH = 30       # 1回にまとめて送信する件数（key毎 Ambientはチャンネル毎の送信サイクル数）
+OUTBOX_BACKOFF = 30     #sec 失敗時の再送間隔（失敗毎に2倍）
+OUTBOX_BACKOFF_MAX = 1800 #sec 再送間隔の上限
+OUTBOX_MAX_ATTEMPTS = 200 # この回数失敗したら再送しない（DEAD）
+OUTBOX_KEEP = 1         #day 送信済みデータの保持期間
 SPAN_CONFIG_UPDATE = 1  #hour
+RUNTIME_WORKERS = 4     # 定周期ジョブを実行するスレッド数（libRuntime.py）
 SPAN_BEACON = 60        #sec
+SPAN_LINK_SNAPSHOT = 60 #sec (node_link テーブルへの保存間隔)
+## GATE 受信フレームのキャプチャファイル（""は記録しない / libLORA.py GATE の第2引数でも指定可）
+CAPTURE_PATH = ""
 ## NODE
 SPAN_SENSOR = 60        #sec
+## WOR(Wake On Radio)モード  GATEはBeacon/コマンドをWOR送信(mode1)、NODEは送信後WOR受信(mode2)で待機
+#  wor_cycle は E220_setting.ini で全モジュール同じ値にすること
+WOR_MODE = False
 SUB_PACKET = 200       #byte of 1 send(Lora Subpacket bytes)
 
 ## SENSOR Vaild MAC Addr 
@@ -39,21 +74,64 @@ VaildMACs = ['49:24:11',
 # /boot/GAT_setting.py 参照
 
 ###### Ambient Board URL
-AMB = {'URL':"https://ambidata.io/bd/board.html?id="}
+## INTERVAL: チャンネル毎の最短送信間隔（秒）
+AMB = {'URL':"https://ambidata.io/bd/board.html?id=", 'API':"http://ambidata.io/api/v2/channels/", 'INTERVAL':5}
+
+###### Discord Webhook (libCloud.py)
+DISCORD = {'API':"https://discord.com/api/webhooks/", 'LIMIT':2000}
+DISCORD_COALESCE = 3    #sec この時間内の通知は1つのメッセージにまとめる
+DISCORD_RATE = (5, 2)   # Webhook毎の送信上限（5回/2秒）
+DISCORD_RETRY = 5       # 429・通信エラー時の再送回数
+
+###### GAS Upload (libCloud.py)
+## CHUNK: 1回に送信するJSONの最大バイト数 / GZIP: 圧縮して送信（GAS側の対応が必要） / WORKERS: 同時送信数
+GAS_UPLOAD = {'CHUNK':32768, 'GZIP':False, 'WORKERS':2}
+
+###### Battery forecast (libSQLite.py batt_fit)
+## REPLACE: 交換と判断する電池残量(%) / JUMP: この値以上増えたら電池交換とみなして回帰をやり直す(%)
+## MIN_DAYS: 予測に必要な計測期間（日）
+BATT_FIT = {'REPLACE':15.0, 'JUMP':10.0, 'MIN_DAYS':2.0}
+
+###### Trend detection (libSQLite.py sensor_trend / libJudge.py)
+## TAU: 温度のEWMAの時定数（分） / SLOPE_TAU: 上昇率(℃/分)の平滑化の時定数（分） / GAP: これ以上間隔が空いたらやり直す（分）
+## RISE: 早期警告の上昇率(℃/分 半分以下で解除) / MIN_SAMPLES: 判定に必要な計測数 / STUCK: 温度・湿度が同じ値のままの時間（分）
+TREND = {'TAU':3.0, 'SLOPE_TAU':3.0, 'GAP':15.0, 'RISE':0.8, 'MIN_SAMPLES':3, 'STUCK':60.0}
 
 ###### Non Data send to Ambient
 AMB_SEND_NODATA = False
 
+###### HTTP Session (libHTTP.py)
+## ホスト毎のIPアドレス指定 4:IPv4 6:IPv6 （未記載はシステムのアドレス順 AF_UNSPEC）
+#  GASは従来どおりIPv4固定（4G/LTE回線向け）。比較は ./libHTTP.py URL 10 4 と ./libHTTP.py URL 10 6
+HTTP_FAMILY = {'script.google.com':4, 'script.googleusercontent.com':4}
+HTTP_BACKOFF = 0.5      # リトライ間隔の係数（0.5, 1.0, 2.0 ... 秒）
+
+###### Metrics (libMetrics.py)
+## DIR: node_exporter textfile collector の出力先（""は出力しない SDカードへの書込を避けて /run に置く）
+## PORT: http://127.0.0.1:PORT/metrics で公開（0は無効） / INTERVAL: textfileの出力間隔（秒）
+METRICS = {'DIR':"/run/sast", 'PORT':0, 'INTERVAL':60}
+
+###### Local Dashboard (SAST_dashboard.py)
+## BIND/PORT: http://BIND:PORT/ で公開 / MAX_AGE: 応答キャッシュの最長保持秒（DATABASE更新時は即時破棄）
+## POLL: DATABASE更新の確認間隔（秒） / HOURS,BUCKET: グラフの期間（時間）と集計幅（秒）
+DASHBOARD = {'BIND':"127.0.0.1", 'PORT':8080, 'MAX_AGE':60, 'POLL':1.0, 'HOURS':6, 'BUCKET':600}
+
 ###### Logging
-import logging
-import logging.handlers  as ih
 """
 logger Logger : 通常のlogger
 loggerOLED Logger : OLED用のlogger
 
+出力（Syslog・ファイル・画面）は QueueHandler → QueueListener のスレッドで行い、
+ログを出力した処理はSDカード・syslogへの書込を待たない。
+ログのレベルは LOG_LEVEL（環境変数 SAST_LOG_LEVEL で変更可）で、レベル未満のログは作成もしない。
+実行中は setLogLevel() または SIGUSR2（LOG_LEVEL ⇔ DEBUG の切り替え）で変更できる。
+頻繁に呼ばれる処理では f文字列ではなく %形式（logger.debug("... %s", val)）で書き、
+出力しないレベルでは文字列を作らないようにする。
 """
+LOG_LEVEL = logging.getLevelName(os.environ.get('SAST_LOG_LEVEL', "INFO").upper())
+if not isinstance(LOG_LEVEL, int) : LOG_LEVEL = logging.INFO
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
 
 ### --- Screen
 stream_Handler = logging.StreamHandler()
@@ -72,10 +150,11 @@ file_Handler.setFormatter(logging.Formatter('%(asctime)s::%(module)s:%(levelname
 file_Handler.maxBytes = 1024 * 1024
 file_Handler.backupCount = 3
 
-### -- Set Handler
-logger.addHandler(syslog_Handler)
-logger.addHandler(stream_Handler)
-logger.addHandler(file_Handler)
+### -- Set Handler（出力はQueueListenerのスレッドで行う）
+log_Queue = queue.Queue(-1)
+log_Listener = ih.QueueListener(log_Queue, syslog_Handler, stream_Handler, file_Handler, respect_handler_level=True)
+logger.addHandler(ih.QueueHandler(log_Queue))
+log_Listener.start()
 
 
 ### --- OELD Syslog --- facility is local1
@@ -83,7 +162,25 @@ loggerOLED = logging.getLogger('OLED')
 syslog2_Handler = ih.SysLogHandler(address="/dev/log",facility=ih.SysLogHandler.LOG_LOCAL1)
 syslog2_Handler.setLevel(logging.INFO)
 syslog2_Handler.setFormatter(logging.Formatter('OLED:%(levelname)s:%(message)s'))
-loggerOLED.addHandler( loggerOLED )
+loggerOLED.addHandler( syslog2_Handler )
+
+def setLogLevel( level ) -> None :
+    """ログのレベルを変更（実行中に変更可）
+    Args:
+        level (int|str): logging.DEBUG / "DEBUG" など
+    """
+    if isinstance(level, str) : level = logging.getLevelName(level.upper())
+    logger.setLevel(level)
+    logger.warning(f"Log level -> {logging.getLevelName(level)}")
+
+def _intr_loglevel( num, frame ) :
+    ''' SIGUSR2 で LOG_LEVEL と DEBUG を切り替える（ログのロックを持っている処理に割り込むのでスレッドで変更） '''
+    level = logging.DEBUG if logger.level != logging.DEBUG else LOG_LEVEL
+    threading.Thread(target=setLogLevel, args=(level,), name="LogLevel").start()
+
+atexit.register(log_Listener.stop)  # 終了時に残りのログを出力
+if threading.current_thread() is threading.main_thread() :
+    signal.signal(signal.SIGUSR2, _intr_loglevel)
 
 ### --- Nodeシステム状態
 
@@ -92,12 +189,9 @@ SEARCH_SECOND = 3.0
 
 
 ###### Main DATA Queue
-import queue 
 Q = queue.Queue()
 
 ##### Time String Functions
-import time
-import datetime
 def getTimeSTR( short=False ) -> str:
     """現在の日付の文字列を返す
     Args:
@@ -164,8 +258,21 @@ def toTimespan( time_str:str ) -> time :
     """
     return int(datetime.datetime.timestamp(str2Datetime(time_str)))
 
+##### Lora Radio Functions
+def radioForNode( node:int ) -> dict :
+    """Nodeを担当するGATEの無線モジュール設定を返す
+    Args:
+        node (int): Node番号
+    Returns:
+        dict: GATE_RADIOS の要素（nodesに無い場合はnodes=[]のモジュール、それも無ければ先頭）
+    """
+    for radio in GATE_RADIOS :
+        if node in radio.get('nodes', []) : return radio
+    for radio in GATE_RADIOS :
+        if len(radio.get('nodes', [])) == 0 : return radio
+    return GATE_RADIOS[0]
+
 ##### Notify Status Enum
-from enum import IntEnum
 class SENS_ST(IntEnum):
     """センサー状態Enum（DATABASE用) """
     NONE = -1,
@@ -175,6 +282,15 @@ class SENS_ST(IntEnum):
     LOW_CAUTION = 3,
     HIGH_WARN = 4,
     HIGH_CAUTION = 5,
+    RISE_WARN = 6,      # 温度の急上昇（閾値を超える前の早期警告）
+    STUCK = 7,          # 値が変化しない（センサー故障の疑い）
+
+#### Cloud Outbox Status Enum
+class OUTBOX_ST(IntEnum):
+    """Cloud送信待ちの状態（DATABASE用） """
+    PENDING = 0,
+    SENT = 1,
+    DEAD = 2,
 
 #### Node System Status Enum
 class NODE_STAT(IntEnum):
@@ -194,7 +310,6 @@ class NODE_STAT(IntEnum):
 GAS = {}
 
 try :
-    import sys
     sys.path.append('/boot')
     from GAS_setting import URL
     GAS = URL
@@ -203,3 +318,20 @@ except ImportError :
     logger.error("/boot/GAS_setting.py Not Found")
     sys.exit(-1)
     pass
+
+###### Cloud URL override（ローカルの代替サーバー SAST_cloudsim.py で試験する時）
+#  環境変数 SAST_CLOUD_URL=http://127.0.0.1:18080 で Ambient/Discord/GAS の送信先を置き換える
+def setCloudURL( base:str ) -> None :
+    """Ambient/Discord/GAS の送信先を base のサーバーに置き換える
+    Args:
+        base (str): http://host:port
+    """
+    global GAS
+    base = base.rstrip('/')
+    AMB['API'] = f"{base}/api/v2/channels/"
+    DISCORD['API'] = f"{base}/api/webhooks/"
+    GAS = f"{base}/macros/exec"
+    logger.warning(f"Cloud URL override -> {base}")
+
+if os.environ.get('SAST_CLOUD_URL', "") != "" :
+    setCloudURL(os.environ['SAST_CLOUD_URL'])
@@ -58,9 +58,9 @@ sudo raspi-config
 
 2. install librarys 
 sudo apt install -y sqlite3 git python3-dev python3-pip vim 
-sudo pip3 install Adafruit_SSD1306 Pillow ipget pyserial schedule
+sudo pip3 install Adafruit_SSD1306 Pillow ipget pyserial
 sudo pip3 install git+https://github.com/AmbientDataInc/ambient-python-lib.git 
-sudo pip3 install wiringpi psutil schedule ipget bluepy smbus2
+sudo pip3 install wiringpi psutil ipget bluepy smbus2
 
 3. add user Permissions
 bluepy-helper eg. python3 - bluepy 1.3.0 
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""
+Gateway 受信フレームのキャプチャライブラリ libCapture.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+Lora_GATEが受信した生フレーム（L_LENヘッダ以降のbyte列）とRSSI、受信時刻を
+追記専用のバイナリファイルに記録する。記録したファイルは SAST_replay.py で再生し、
+デコード不具合の再現や性能の回帰確認に利用する。
+
+ファイル形式:
+    先頭 : CAP_MAGIC (8byte)
+    以降 : CAP_RECORD( 受信時刻(double), RSSI(b), 長さ(H) ) + フレーム本体 の繰り返し
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import os
+import struct
+import threading
+import time
+
+CAP_MAGIC = b'SASTCAP\x01'
+# RECV_TIME(d), RSSI(b), LEN(H)
+CAP_RECORD = struct.Struct('<dbH')
+
+
+class CaptureWriter :
+    """ キャプチャファイル書き込みクラス（追記専用）
+    Summary: 1フレーム毎にflushするので、途中で電源断しても直前のフレームまでは読み出せる。
+    """
+    _fp = None
+    _lock = None
+    path = ""
+    frames = 0
+
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fp = open(path, 'ab')
+        if new : self._fp.write(CAP_MAGIC)
+        self._fp.flush()
+        C.logger.info(f"[Capture] open {path}")
+
+    def write(self, payload, rssi:int, recv_time=None) -> None:
+        """フレームを1件記録
+        Args:
+            payload (bytes): 受信フレーム（L_LENヘッダ以降）
+            rssi (int): 受信RSSI(dBm)
+            recv_time (float, optional): 受信時刻（UNIX時間）. 初期値 現在時刻
+        """
+        if recv_time == None : recv_time = time.time()
+        rssi = max(-128, min(127, int(rssi)))
+        with self._lock :
+            self._fp.write(CAP_RECORD.pack(recv_time, rssi, len(payload)))
+            self._fp.write(payload)
+            self._fp.flush()
+            self.frames += 1
+
+    def close(self) -> None:
+        with self._lock :
+            if self._fp != None :
+                self._fp.close()
+                self._fp = None
+        C.logger.info(f"[Capture] close {self.path} ({self.frames} frames)")
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def readCapture( path:str ) :
+    """キャプチャファイルを先頭から読み出す（ジェネレータ）
+    Args:
+        path (str): キャプチャファイル
+    Raises:
+        ValueError: キャプチャファイルではない
+    Yields:
+        tuple: ( recv_time, rssi, payload )
+    """
+    with open(path, 'rb') as fp :
+        if fp.read(len(CAP_MAGIC)) != CAP_MAGIC :
+            raise ValueError(f"Not SAST capture file {path}")
+        while True :
+            head = fp.read(CAP_RECORD.size)
+            if len(head) == 0 : break
+            if len(head) != CAP_RECORD.size :
+                C.logger.warning(f"[Capture] truncated header at end of {path}")
+                break
+            recv_time, rssi, length = CAP_RECORD.unpack(head)
+            payload = fp.read(length)
+            if len(payload) != length :
+                C.logger.warning(f"[Capture] truncated frame at end of {path}")
+                break
+            yield recv_time, rssi, payload
+
+
+if __name__ == '__main__' :
+    import sys
+    import datetime
+    args = sys.argv
+
+    if len(args) >= 3 and args[1].upper() == 'DUMP' :
+        for recv_time, rssi, payload in readCapture(args[2]) :
+            print(f"{datetime.datetime.fromtimestamp(recv_time)} [{rssi}dBm] ({len(payload)}) {payload.hex()}")
+        sys.exit(0)
+
+    print(f"Usage : {args[0]} DUMP capture_file")
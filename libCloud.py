@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+"""
+Cloud送信ライブラリ libCloud.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+[Discord]
+Discord Webhook への通知をWebhook毎のキューに溜めて送信するディスパッチャ。
+・一定時間（C.DISCORD_COALESCE秒）内の通知は複数ノード分でも1つのメッセージにまとめる
+・Discordの文字数制限（C.DISCORD['LIMIT']）を超える場合は行単位で分割
+・Webhook毎のトークンバケット（C.DISCORD_RATE）で送信間隔を制御し、
+  X-RateLimit-Remaining/Reset-After ヘッダーと 429(Retry-After) に従って待つ
+  （429は破棄せずに待ってから再送する）
+送信は libHTTP のセッションを利用し、Webhook毎の送信スレッドで行う。
+[Ambient]
+チャンネル毎のトークンバケットで最短送信間隔を守る送信スケジューラ。
+複数サンプルは dataarray で各サンプルの計測日時（created）付きでまとめて送信する。
+[GAS]
+送信データをJSONの大きさで分割（C.GAS_UPLOAD['CHUNK']）し、並列数を制限して送信する。
+GASが対応していれば gzip で圧縮する（C.GAS_UPLOAD['GZIP']）。
+
+使い方:
+    import libCloud as Cloud
+    Cloud.discord().post(token, mess, linkURL)
+    Cloud.discord().flush(timeout)   # プログラム終了前に送信待ちを送る
+    Cloud.sent_Ambient(amb_conf, [ {'d1':20.5, 'created':'2026-10-19 10:00:00'}, ... ], deadline)
+    Cloud.gas().upload(C.GAS, Cloud.chunk_records(records), deadline)  # チャンク毎の成否
+
+    ./libCloud.py DISCORD token message   テスト送信
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import libHTTP as HTTP
+import concurrent.futures
+import gzip
+import json
+import threading
+import time
+import requests
+
+
+def split_message( mess:str, limit=C.DISCORD['LIMIT'] ) -> list :
+    """メッセージを文字数制限以内に分割（行の途中では分割しない、1行が長い場合のみ行を分割）
+    Args:
+        mess (str): メッセージ
+        limit (int, optional): 最大文字数. 初期値 C.DISCORD['LIMIT'].
+    Returns:
+        list: 分割したメッセージ
+    """
+    chunks = list()
+    buf = ""
+    for line in mess.splitlines(keepends=True) :
+        while len(line) > limit :
+            if buf != "" :
+                chunks.append(buf)
+                buf = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if len(buf) + len(line) > limit :
+            chunks.append(buf)
+            buf = ""
+        buf += line
+    if buf.strip() != "" : chunks.append(buf)
+    return [ c.rstrip("\n") for c in chunks ]
+
+
+class TokenBucket :
+    """ トークンバケット
+    Summary: rate 回/per 秒で補充し、最大 rate 個まで溜める。
+    pause() でサーバー指定の時間（Retry-After等）送信を止める。
+    """
+    def __init__(self, rate:int, per:float) -> None:
+        """
+        Args:
+            rate (int): 期間内の送信回数（バケットの大きさ）
+            per (float): 期間（秒）
+        """
+        self.size = float(rate)
+        self.fill = rate / per
+        self.tokens = float(rate)
+        self.stamp = time.monotonic()
+        self.until = 0.0
+        self.lock = threading.Lock()
+
+    def _wait(self) -> float :
+        ''' 内部関数：トークンを1つ取得して0を返す（取得できなければ待ち秒） '''
+        with self.lock :
+            now = time.monotonic()
+            self.tokens = min(self.size, self.tokens + (now - self.stamp) * self.fill)
+            self.stamp = now
+            if now < self.until : return self.until - now
+            if self.tokens >= 1.0 :
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.fill
+
+    def acquire(self, deadline=None) -> bool :
+        """トークンが取得できるまで待つ
+        Args:
+            deadline (float, optional): 期限（UNIX時間）期限までに取得できなければ待たずに戻る. 初期値 None.
+        Returns:
+            bool: 取得できたか
+        """
+        while True :
+            w = self._wait()
+            if w <= 0 : return True
+            if deadline != None and time.time() + w > deadline : return False
+            time.sleep(w)
+
+    def pause(self, sec:float) -> None :
+        ''' sec秒 送信を止める（トークンも空にする） '''
+        with self.lock :
+            self.tokens = 0.0
+            self.stamp = time.monotonic()
+            self.until = max(self.until, self.stamp + sec)
+
+
+class _Webhook :
+    """ 内部クラス：Webhook毎の送信キューと送信スレッド """
+    def __init__(self, owner, token:str) -> None:
+        self.owner = owner
+        self.token = token
+        self.queue = list()     # ( 登録時刻, メッセージ )
+        self.busy = False
+        self.bucket = TokenBucket(*C.DISCORD_RATE)
+        self.thread = threading.Thread(target=self._run, name=f"Discord-{token[:8]}", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None :
+        ''' 送信スレッド：最初の通知から C.DISCORD_COALESCE 秒待ってまとめて送信 '''
+        cond = self.owner.cond
+        while True :
+            with cond :
+                while len(self.queue) == 0 : cond.wait()
+                while not self.owner.flushing :
+                    w = self.queue[0][0] + self.owner.window - time.time()
+                    if w <= 0 : break
+                    cond.wait(w)
+                items, self.queue = self.queue, list()
+                self.busy = True
+            try :
+                self._deliver(items)
+            except Exception as e :
+                C.logger.error(f"[Discord] Exception:{e}")
+            with cond :
+                self.busy = False
+                cond.notify_all()
+
+    def _deliver(self, items:list) -> None :
+        ''' まとめたメッセージを文字数制限で分割して送信 '''
+        chunks = split_message("\n".join(m for _, m in items))
+        if len(items) > 1 :
+            C.logger.info(f"[Discord] coalesce {len(items)} messages -> {len(chunks)} posts")
+        for chunk in chunks :
+            ok = self._send(chunk)
+            self.owner._count('sent' if ok else 'failed', time.time() - items[0][0])
+
+    def _send(self, content:str) -> bool :
+        """1メッセージを送信（429・通信エラーは待って再送）
+        Returns:
+            bool: 成功/失敗
+        """
+        url = C.DISCORD['API'] + self.token
+        for retry in range(C.DISCORD_RETRY) :
+            self.bucket.acquire()
+            try :
+                res = HTTP.post(url, json={'content':content}, timeout=15)
+            except requests.exceptions.RequestException as e :
+                C.logger.error(f"[Discord] request failed:{e}")
+                time.sleep(2 ** retry)
+                continue
+
+            ## レート制限ヘッダー（残り0ならリセットまで待つ）
+            if res.headers.get('X-RateLimit-Remaining') == '0' :
+                self.bucket.pause(_float(res.headers.get('X-RateLimit-Reset-After'), 1.0))
+
+            if res.status_code == 429 :
+                wait = _retry_after(res)
+                C.logger.warning(f"[Discord] Response(429) retry after {wait:.2f}sec")
+                self.owner._count('limited')
+                if res.headers.get('X-RateLimit-Global') != None :
+                    self.owner._pause_all(wait)
+                else :
+                    self.bucket.pause(wait)
+                continue
+            if res.status_code in (200, 204) :
+                C.logger.debug(f"POST Discord->Result({res.status_code})")
+                return True
+            if res.status_code >= 500 :
+                C.logger.warning(f"[Discord] Response({res.status_code}) retry")
+                time.sleep(2 ** retry)
+                continue
+            C.logger.error(f"[Discord] Response({res.status_code}) {res.text[:100]}")
+            return False
+        C.logger.error(f"[Discord] give up after {C.DISCORD_RETRY} retry")
+        return False
+
+
+def _remain( deadline, limit:float ) -> float :
+    """ 内部関数：期限までの残り秒（limitを上限、期限なしはlimit） """
+    if deadline == None : return limit
+    return max(0.1, min(limit, deadline - time.time()))
+
+def _float( value, default:float ) -> float :
+    ''' 内部関数：ヘッダーの数値（無い・不正ならdefault） '''
+    try :
+        return float(value)
+    except (TypeError, ValueError) :
+        return default
+
+def _retry_after( res ) -> float :
+    ''' 内部関数：429の待ち秒（JSONの retry_after → Retry-After ヘッダー → 1秒） '''
+    try :
+        return float(res.json()['retry_after'])
+    except Exception :
+        return _float(res.headers.get('Retry-After'), 1.0)
+
+
+class DiscordDispatcher :
+    """ Discord通知ディスパッチャ
+    Summary: post() はキューに登録するだけで戻る。送信はWebhook毎のスレッドで行う。
+    """
+    def __init__(self, window=C.DISCORD_COALESCE) -> None:
+        """
+        Args:
+            window (float, optional): まとめる時間（秒）. 初期値 C.DISCORD_COALESCE.
+        """
+        self.window = window
+        self.flushing = False
+        self.cond = threading.Condition()
+        self.hooks = dict()
+        self.counts = {'queued':0, 'sent':0, 'failed':0, 'limited':0, 'delay':0.0}
+
+    def post(self, token:str, mess:str, linkURL="") -> None :
+        """通知をキューに登録
+        Args:
+            token (str): discord WebhookのID/TOKEN
+            mess (str): 通知メッセージ
+            linkURL (str, optional): グラフURL. 初期値 "".
+        """
+        if token == None or token == False or token == "" or mess == "" : return
+        if linkURL != "" : mess = f"{mess}\n📊グラフ\n{linkURL}"
+        with self.cond :
+            hook = self.hooks.get(token)
+            if hook == None :
+                hook = self.hooks[token] = _Webhook(self, token)
+            hook.queue.append( (time.time(), mess) )
+            self.counts['queued'] += 1
+            self.cond.notify_all()
+
+    def flush(self, timeout=C.CLOUD_DEADLINE['discord']) -> bool :
+        """送信待ちをまとめる時間を待たずに送信し、送信完了まで待つ
+        Args:
+            timeout (float, optional): 最大待ち秒. 初期値 C.CLOUD_DEADLINE['discord'].
+        Returns:
+            bool: 全て送信処理できたか
+        """
+        end = time.time() + timeout
+        with self.cond :
+            self.flushing = True
+            self.cond.notify_all()
+            try :
+                while any( len(h.queue) != 0 or h.busy for h in self.hooks.values() ) :
+                    if time.time() >= end : return False
+                    self.cond.wait(end - time.time())
+                return True
+            finally :
+                self.flushing = False
+
+    def pending(self) -> int :
+        ''' 送信待ちの通知数 '''
+        with self.cond :
+            return sum( len(h.queue) for h in self.hooks.values() )
+
+    def stats(self, reset=False) -> dict :
+        """送信状況
+        Args:
+            reset (bool, optional): 集計をリセットする. 初期値 False.
+        Returns:
+            dict: { queued, sent, failed, limited, delay, pending }  delayは登録から送信完了までの最大秒
+        """
+        with self.cond :
+            st = dict(self.counts)
+            if reset : self.counts = {'queued':0, 'sent':0, 'failed':0, 'limited':0, 'delay':0.0}
+            st['pending'] = sum( len(h.queue) for h in self.hooks.values() )
+        return st
+
+    def _count(self, key:str, delay=0.0) -> None :
+        ''' 内部関数：集計 '''
+        with self.cond :
+            self.counts[key] += 1
+            self.counts['delay'] = max(self.counts['delay'], delay)
+
+    def _pause_all(self, sec:float) -> None :
+        ''' 内部関数：グローバルレート制限 全Webhookを止める '''
+        with self.cond :
+            hooks = list(self.hooks.values())
+        for h in hooks : h.bucket.pause(sec)
+
+
+_dispatcher = None
+_lock = threading.Lock()
+
+def discord() -> DiscordDispatcher :
+    ''' Discordディスパッチャ（プロセスで1つ、最初の呼び出しで作成） '''
+    global _dispatcher
+    with _lock :
+        if _dispatcher == None : _dispatcher = DiscordDispatcher()
+        return _dispatcher
+
+
+class AmbientScheduler :
+    """ Ambient送信スケジューラ
+    Summary: チャンネル毎のトークンバケットで最短送信間隔（C.AMB['INTERVAL']秒）を守って送信する。
+    複数サンプル（再送・停止後の取り戻し）は dataarray で1回にまとめ、各サンプルの created で記録する。
+    403（送信間隔違反）はその場で固定時間待たず、チャンネルのバケットを止めて次のトークンで再送する。
+    """
+    def __init__(self, interval=C.AMB['INTERVAL']) -> None:
+        """
+        Args:
+            interval (float, optional): チャンネル毎の最短送信間隔（秒）. 初期値 C.AMB['INTERVAL'].
+        """
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.channels = dict()
+
+    def _bucket(self, channel) -> TokenBucket :
+        ''' 内部関数：チャンネルのトークンバケット（無ければ作成） '''
+        with self.lock :
+            if channel not in self.channels :
+                self.channels[channel] = TokenBucket(1, max(self.interval, 0.01))
+            return self.channels[channel]
+
+    def send(self, amb_conf:dict, sendDATA, deadline=None) -> bool :
+        """Ambientにデータ送信
+        Args:
+            amb_conf (dict): 送信先のAmbient情報（DICT形式）
+            sendDATA (dict/list): 送信データ( { 'd1': data, 'd2':data ..... , 'created':日時 })
+                                  listは dataarray でまとめて送信（createdの古い順）
+            deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+        Returns:
+            bool : True 成功 / False 失敗
+        """
+        channel = amb_conf['channelID']
+        if not amb_conf['use'] :
+            C.logger.warning(f"[sent_Ambient] Not Use Ambient...SKIP")
+            return False
+
+        ## Ambient API に直接送信（ambientライブラリと同じ形式）
+        if isinstance(sendDATA, list) :
+            if len(sendDATA) == 0 : return True
+            url = f"{C.AMB['API']}{channel}/dataarray"
+            body = {'writeKey':amb_conf['writeKey'], 'data':sorted(sendDATA, key=lambda d: d.get('created', ""))}
+            num = len(sendDATA)
+        else :
+            url = f"{C.AMB['API']}{channel}/data"
+            body = dict(sendDATA)
+            if 'created' not in body : body['created'] = C.getTimeSTR()
+            body['writeKey'] = amb_conf['writeKey']
+            num = 1
+
+        bucket = self._bucket(channel)
+        for retry in range(3) :
+            if not bucket.acquire(deadline) :
+                C.logger.warning(f"[sent_Ambient] ch:{channel} deadline over")
+                return False
+            try :
+                C.logger.info(f"Send Ambient(ch:{channel}) {num} samples ... ")
+                ret = HTTP.post(url, json=body, timeout=_remain(deadline, 10))
+            except requests.exceptions.RequestException as e :
+                C.logger.error(f"[sent_Ambient] request failed:{e}")
+                continue
+            if ret.status_code == 200 :
+                C.logger.info(f"[Ambient] Response({ret.status_code}) done")
+                return True
+            if ret.status_code == 403 :
+                ## 送信間隔違反 次の送信まで間隔をあける
+                C.logger.warning(f"[Ambient] Response({ret.status_code}) ch:{channel} wait {self.interval}sec")
+                bucket.pause(self.interval)
+                continue
+            C.logger.warning(f"[Ambient] Response({ret.status_code}) ")
+            return False
+        return False
+
+
+_ambient = None
+
+def ambient() -> AmbientScheduler :
+    ''' Ambient送信スケジューラ（プロセスで1つ、最初の呼び出しで作成） '''
+    global _ambient
+    with _lock :
+        if _ambient == None : _ambient = AmbientScheduler()
+        return _ambient
+
+def sent_Ambient( amb_conf, sendDATA, deadline=None ) -> bool :
+    """Ambientにデータ送信（AmbientScheduler.send）
+    Args:
+        amb_conf (dict): 送信先のAmbient情報（DICT形式）
+        sendDATA (dict/list): 送信データ  listは dataarray でまとめて送信
+        deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+    Returns:
+        bool : True 成功 / False 失敗
+    """
+    return ambient().send(amb_conf, sendDATA, deadline)
+
+
+def chunk_records( records:list, limit=C.GAS_UPLOAD['CHUNK'] ) -> list :
+    """レコードのlistをJSONの大きさが limit バイト以内になるように分割（レコードの途中では分割しない）
+    Args:
+        records (list): 送信データ（dictのlist）
+        limit (int, optional): 1チャンクのJSONの最大バイト数. 初期値 C.GAS_UPLOAD['CHUNK'].
+    Returns:
+        list: チャンク（recordsのlist）のlist
+    """
+    chunks = list()
+    part, size = list(), 2
+    for r in records :
+        n = len(json.dumps(r, ensure_ascii=False).encode()) + 2
+        if len(part) != 0 and size + n > limit :
+            chunks.append(part)
+            part, size = list(), 2
+        part.append(r)
+        size += n
+    if len(part) != 0 : chunks.append(part)
+    return chunks
+
+
+class GASUploader :
+    """ Google Apps Script(GAS) 送信
+    Summary: チャンクを C.GAS_UPLOAD['WORKERS'] 本まで並列に送信し、チャンク毎の成否を返す。
+    C.GAS_UPLOAD['GZIP'] が True なら gzip で圧縮して送信し、
+    GASが圧縮を受け付けない（400/411/415）場合は非圧縮で送り直して以降は圧縮しない。
+    """
+    def __init__(self) -> None:
+        self.gzip = C.GAS_UPLOAD['GZIP']
+        self.lock = threading.Lock()
+
+    def _post(self, url:str, data:list, deadline=None) -> bool :
+        """1チャンクを送信（タイムアウト・通信エラーは期限まで最大3回）
+        Returns:
+            bool: 成功/失敗
+        """
+        body = json.dumps(data).encode()
+        past = time.time()
+        for retry in range(3) :
+            if deadline != None and deadline - time.time() <= 0 :
+                C.logger.warning(f"[sent_GAS] deadline over")
+                return False
+            compress = self.gzip
+            headers = {'Content-Type': 'application/json'}
+            payload = body
+            if compress :
+                headers['Content-Encoding'] = 'gzip'
+                payload = gzip.compress(body)
+            try :
+                ret = HTTP.post(url, data=payload, headers=headers, timeout=_remain(deadline, 15))
+            except requests.exceptions.Timeout as e :
+                C.logger.error(f"[sent_GAS] request timeout : {e}")
+                time.sleep(_remain(deadline, 3))
+                continue
+            except requests.exceptions.RequestException as e :
+                C.logger.error(f"[sent_GAS] request failed : {e}")
+                return False
+
+            if ret.status_code == 200 :
+                C.logger.info(f"[GAS] Response({ret.status_code}) {len(data)} records {len(payload)}byte time={time.time() - past :5.2}sec")
+                return True
+            if compress and ret.status_code in (400, 411, 415) :
+                C.logger.warning(f"[GAS] Response({ret.status_code}) gzip not supported ... send without compression")
+                with self.lock : self.gzip = False
+                continue
+            C.logger.warning(f"[GAS] Response({ret.status_code}) time={time.time() - past :5.2}sec")
+            return False
+        return False
+
+    def upload(self, url:str, chunks:list, deadline=None) -> list :
+        """チャンクを並列に送信
+        Args:
+            url (str): GASのWEB-API
+            chunks (list): チャンク（recordsのlist）のlist
+            deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+        Returns:
+            list: チャンク毎の成否（chunksと同じ順）
+        """
+        if len(chunks) == 0 : return []
+        if len(chunks) == 1 : return [ self._post(url, chunks[0], deadline) ]
+        workers = min(C.GAS_UPLOAD['WORKERS'], len(chunks))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="GAS") as pool :
+            return list(pool.map(lambda c: self._post(url, c, deadline), chunks))
+
+
+_gas = None
+
+def gas() -> GASUploader :
+    ''' GAS送信（プロセスで1つ、最初の呼び出しで作成） '''
+    global _gas
+    with _lock :
+        if _gas == None : _gas = GASUploader()
+        return _gas
+
+def sent_GAS( GAS, sendDATA, deadline=None ) -> bool :
+    """Google Apps Script(GAS) 宛てにデータ送信（大きさで分割して並列送信）
+    Args:
+        GAS (str): GASのWEB-API
+        sendDATA (list/dict): 送信データ
+        deadline (float, optional): 送信期限（UNIX時間）. 初期値 None.
+    Returns:
+        bool: 全チャンク成功/失敗
+    """
+    if not isinstance(sendDATA, list) : sendDATA = [ sendDATA ]
+    return all( gas().upload(GAS, chunk_records(sendDATA), deadline) )
+
+
+if __name__ == '__main__' :
+    import sys
+    args = sys.argv
+    if len(args) >= 4 and args[1].upper() == 'DISCORD' :
+        D = discord()
+        for mess in args[3:] : D.post(args[2], mess)
+        ok = D.flush()
+        st = D.stats()
+        print(f"queued:{st['queued']} sent:{st['sent']} failed:{st['failed']} 429:{st['limited']} delay:{st['delay']:.2f}sec {'' if ok else 'TIMEOUT'}")
+        sys.exit(0 if ok and st['failed'] == 0 else 1)
+    print("usage: libCloud.py DISCORD token message [message ...]")
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+"""
+Cloud送信用 HTTPクライアントライブラリ libHTTP.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+Discord / Ambient / GAS への送信で使う requests.Session をホスト毎に1つ保持し、
+Keep-Aliveで接続を使いまわす（DNS・TCP・TLSのハンドシェイクを毎回行わない）。
+・ホスト毎の IPv4/IPv6 指定（config.HTTP_FAMILY 未記載のホストはシステムのアドレス順）
+  urllib3 の allowed_gai_family をスレッドローカルを参照する関数に一度だけ置き換え、
+  セッション毎の指定をリクエスト中のみ有効にする。
+・リトライ/バックオフ（接続エラーは全メソッド、429/5xxはGETのみ）
+・新規接続と再利用の回数、それぞれの平均応答時間を集計（stats）
+
+使い方:
+    import libHTTP as HTTP
+    res = HTTP.post(url, json=data, timeout=10)
+    HTTP.stats(reset=True)
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import socket
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib3.util.connection as urllib3_cn
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+FAMILY = { 0:socket.AF_UNSPEC, 4:socket.AF_INET, 6:socket.AF_INET6 }
+
+_local = threading.local()
+_lock = threading.Lock()
+_clients = {}
+_stats = { 'new':0, 'reuse':0, 'new_time':0.0, 'reuse_time':0.0, 'connect_time':0.0, 'error':0 }
+
+
+###### urllib3 への差し込み（一度だけ）
+def _allowed_gai_family() :
+    ''' 内部関数：リクエスト中のセッションのアドレスファミリを返す（指定なしは AF_UNSPEC） '''
+    return getattr(_local, 'family', socket.AF_UNSPEC)
+
+_create_connection = urllib3_cn.create_connection
+def _counted_connection( *args, **kwargs ) :
+    ''' 内部関数：新規接続（TCP）を計測する '''
+    start = time.time()
+    sock = _create_connection( *args, **kwargs )
+    _local.new_conn = getattr(_local, 'new_conn', 0) + 1
+    _local.connect_time = getattr(_local, 'connect_time', 0.0) + time.time() - start
+    return sock
+
+urllib3_cn.allowed_gai_family = _allowed_gai_family
+urllib3_cn.create_connection = _counted_connection
+
+
+class HTTPClient :
+    """ ホスト毎のHTTPセッション
+    Summary: Keep-Alive・リトライ設定済みの requests.Session と IPv4/IPv6 指定を持つ。
+    Sessionは複数スレッドから利用可能（接続プールは C.CLOUD_WORKERS 本まで）。
+    """
+    host = ""
+    family = socket.AF_UNSPEC
+    session = None
+
+    def __init__(self, host:str, family=socket.AF_UNSPEC) -> None:
+        """
+        Args:
+            host (str): scheme://host[:port]
+            family (int, optional): socket.AF_INET / AF_INET6 / AF_UNSPEC. 初期値 AF_UNSPEC.
+        """
+        self.host = host
+        self.family = family
+        retry = Retry( total=3, connect=3, read=2, status=2, backoff_factor=C.HTTP_BACKOFF,
+                       status_forcelist=RETRY_STATUS, allowed_methods=frozenset(['GET', 'HEAD']),
+                       respect_retry_after_header=True, raise_on_status=False )
+        adapter = HTTPAdapter( pool_connections=1, pool_maxsize=C.CLOUD_WORKERS, max_retries=retry )
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method:str, url:str, **kwargs) -> requests.Response :
+        """リクエストを送信（例外は呼び出し元で処理する）
+        Args:
+            method (str): GET / POST
+            url (str): URL
+            kwargs : requests.Session.request の引数
+        Returns:
+            requests.Response: レスポンス
+        """
+        _local.family = self.family
+        _local.new_conn = 0
+        _local.connect_time = 0.0
+        start = time.time()
+        try :
+            res = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException :
+            with _lock : _stats['error'] += 1
+            raise
+        finally :
+            _local.family = socket.AF_UNSPEC
+
+        ## 成功したリクエストのみ 新規接続/再利用 で集計
+        elapsed = time.time() - start
+        with _lock :
+            if _local.new_conn != 0 :
+                _stats['new'] += 1
+                _stats['new_time'] += elapsed
+                _stats['connect_time'] += _local.connect_time
+            else :
+                _stats['reuse'] += 1
+                _stats['reuse_time'] += elapsed
+        return res
+
+
+def client( url:str, family=None ) -> HTTPClient :
+    """URLのホストに対応するセッションを返す（無ければ作成）
+    Args:
+        url (str): URL
+        family (int, optional): 4 / 6 / 0（Noneは config.HTTP_FAMILY のホスト指定）. 初期値 None.
+    Returns:
+        HTTPClient: セッション
+    """
+    u = urllib.parse.urlsplit(url)
+    if family == None : family = C.HTTP_FAMILY.get(u.hostname, 0)
+    key = ( f"{u.scheme}://{u.netloc}", family )
+    with _lock :
+        if key not in _clients :
+            C.logger.debug(f"[HTTP] new session {key[0]} IPv{family if family != 0 else '4/6'}")
+            _clients[key] = HTTPClient(key[0], FAMILY[family])
+        return _clients[key]
+
+def get( url:str, family=None, **kwargs ) -> requests.Response :
+    ''' GETリクエスト（例外は呼び出し元で処理する） '''
+    return client(url, family).request('GET', url, **kwargs)
+
+def post( url:str, family=None, **kwargs ) -> requests.Response :
+    ''' POSTリクエスト（例外は呼び出し元で処理する） '''
+    return client(url, family).request('POST', url, **kwargs)
+
+def stats( reset=False ) -> dict :
+    """接続の再利用状況を返す
+    saved は再利用したリクエストが新規接続だった場合に掛かったであろう時間の推定値
+    （新規接続と再利用の平均応答時間の差 × 再利用回数）
+    Args:
+        reset (bool, optional): 集計をリセットする. 初期値 False.
+    Returns:
+        dict: { new, reuse, new_avg, reuse_avg, connect_avg, saved, error, sessions }
+    """
+    with _lock :
+        st = dict(_stats)
+        if reset :
+            for k in _stats : _stats[k] = 0 if isinstance(_stats[k], int) else 0.0
+        st['sessions'] = len(_clients)
+    st['new_avg'] = st['new_time'] / st['new'] if st['new'] != 0 else 0.0
+    st['reuse_avg'] = st['reuse_time'] / st['reuse'] if st['reuse'] != 0 else 0.0
+    st['connect_avg'] = st['connect_time'] / st['new'] if st['new'] != 0 else 0.0
+    st['saved'] = max(0.0, st['new_avg'] - st['reuse_avg']) * st['reuse'] if st['new'] != 0 else 0.0
+    return st
+
+def close() -> None :
+    ''' 全セッションを閉じる '''
+    with _lock :
+        for c in _clients.values() : c.session.close()
+        _clients.clear()
+
+
+if __name__ == '__main__' :
+    import sys
+    ## 同じURLに繰り返しアクセスして新規接続と再利用の時間を比較する
+    if len(sys.argv) < 2 :
+        print("usage: libHTTP.py URL [count] [4|6]")
+        sys.exit(1)
+    url = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) >= 3 else 5
+    family = int(sys.argv[3]) if len(sys.argv) >= 4 else None
+    for i in range(count) :
+        start = time.time()
+        try :
+            res = get(url, family=family, timeout=15)
+            print(f"{i+1:3} : {res.status_code} {time.time() - start:.3f}sec")
+        except requests.exceptions.RequestException as e :
+            print(f"{i+1:3} : ERROR {e}")
+    st = stats()
+    print(f"new:{st['new']} avg {st['new_avg']:.3f}sec (connect {st['connect_avg']:.3f}sec)  reuse:{st['reuse']} avg {st['reuse_avg']:.3f}sec  saved:{st['saved']:.3f}sec")
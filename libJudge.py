@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+"""
+センサー状態判定ライブラリ libJudge.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+SAST_observer._send_cloud() の温度閾値判定・LOST判定を1回で行う判定エンジン。
+latest・notify・センサー設定（閾値・名前）を最初に1回だけ読み込んでMACで索引し、
+全センサーを1パスで判定して状態遷移（transition）のlistを返す。
+判定内容は従来の _send_cloud() と同じ
+・高温警告（HIGH_CAUTION）: 毎回カウントアップ
+・高温注意（HIGH_WARN）: 初回、または計測から5分経過でカウントアップ
+・正常（NORMAL）: カウント0
+・LOST: 最後の更新から15分経過（NORMAL・RISE_WARN・STUCK→LOST、LOSTはカウントアップ）
+閾値未満のセンサーは、登録時に更新した温度の傾向（sensor_trend）で早期警告する
+・急上昇（RISE_WARN）: 上昇率が C.TREND['RISE']℃/分 以上（半分未満で解除） 初回、または前回の通知から5分経過でカウントアップ
+・値が変化しない（STUCK）: 温度・湿度が C.TREND['STUCK']分 同じ値のまま（通知は1回 継続中は日時のみ更新）
+日時の経過判定は日時文字列（YYYY-MM-DD HH:MM:SS）の比較で行い strptime を使わない。
+
+使い方:
+    J = Judge.JudgeEngine.load(S)
+    transitions = J.judge(S.getLatestAll(delete=False), S.getNotifyList(0))
+
+    ./libJudge.py BENCH [sensors]   従来方式との比較（一時DATABASEを作成）
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import datetime
+
+WARN_MINUTE = 5     # 高温注意の再通知間隔（分）
+LOST_MINUTE = 15    # LOST判定（分）
+
+
+def _before( now:datetime.datetime, minute:int ) -> str :
+    ''' 内部関数：現在からminute分前の日時文字列（これ以前なら経過済） '''
+    return (now - datetime.timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _over( templ, thr ) -> bool :
+    ''' 内部関数：閾値以上か？（閾値なしは超えない） '''
+    return thr != None and templ != None and thr <= templ
+
+def _count( status, n:dict ) -> int :
+    ''' 内部関数：同じ状態が続いていればカウントアップ（0件は1） '''
+    if len(n) == 0 : return 1
+    if status == n['status'] : return n['count'] + 1
+    return 1
+
+
+class JudgeEngine :
+    """ センサー状態判定エンジン
+    Summary: センサー設定をMACで索引して保持し、judge()で1回分の判定を行う。
+    Discord通知文の作成に必要なセンサー名・ノード名・閾値・温度も索引から返す。
+    """
+    sensors = {}
+    nodes = {}
+    latest = {}
+    trends = {}
+
+    def __init__(self, sensors:dict, nodes:dict, trends={}) -> None:
+        """
+        Args:
+            sensors (dict): { mac: {'name', 'node', 'warn'} } SQL.getSensorConfAll()
+            nodes (dict): { node_no: name }
+            trends (dict, optional): { mac: {'slope','n','stuck','stuck_date',...} } SQL.getSensorTrendAll()
+        """
+        self.sensors = sensors
+        self.nodes = nodes
+        self.trends = trends
+        self.latest = {}
+
+    @classmethod
+    def load(cls, S) :
+        """SQLからセンサー設定を読み込んでエンジンを作成
+        Args:
+            S (SQL): libSQLite.SQL
+        Returns:
+            JudgeEngine: 判定エンジン
+        """
+        sensors, nodes = S.getSensorConfAll()
+        return cls(sensors, nodes, S.getSensorTrendAll())
+
+    def judge(self, latest:list, notify:list, now=None) -> list :
+        """全センサーを1パスで判定
+        Args:
+            latest (list): latestのdict型list（getLatestAll）
+            notify (list): notifyのdict型list（getNotifyList(0)）
+            now (datetime, optional): 判定時刻（Noneは現在）
+        Returns:
+            list: 状態遷移 {'mac', 'node', 'status', 'count', 'prev', 'prev_count'} のlist
+                  notify毎に従来の updateNotify() を呼んでいた内容
+        """
+        now = now if now != None else datetime.datetime.now()
+        warn_before = _before(now, WARN_MINUTE)
+        lost_before = _before(now, LOST_MINUTE)
+        stuck_before = _before(now, C.TREND['STUCK'])
+        self.latest = { d['mac']:d for d in latest }
+        transitions = list()
+
+        for n in notify :
+            mac = n['mac']
+            s = self.latest.get(mac)
+            status = None
+            if s != None :
+                # --> センサーがLatestから見つかったので温度検知確認
+                if mac.startswith('00:00:00') : continue # Node情報ならSKIP
+                conf = self.sensors.get(mac)
+                warn = conf['warn'] if conf != None else {}
+                if _over( s['templ'], warn.get('hC') ) :
+                    status, count = C.SENS_ST.HIGH_CAUTION, _count( C.SENS_ST.HIGH_CAUTION, n )
+                elif _over( s['templ'], warn.get('hW') ) :
+                    if n['count'] == 0 :
+                        ## 前回の記録が無いので通知する
+                        status, count = C.SENS_ST.HIGH_WARN, 1
+                    elif s['date'] <= warn_before :
+                        ## 計測から5分経過していたので通知する
+                        status, count = C.SENS_ST.HIGH_WARN, _count( C.SENS_ST.HIGH_WARN, n )
+                    # 5分経過してないなら通知はしないでそのまま
+                else :
+                    status, count = self._trend( mac, n, warn_before, stuck_before )
+            else :
+                ## --- > Latestに無いのでLOST疑い（未接続はSKIP）
+                if n['status'] == C.SENS_ST.NONE : continue
+                if n['date'] != None and n['date'] <= lost_before :
+                    if n['status'] in (C.SENS_ST.NORMAL, C.SENS_ST.RISE_WARN, C.SENS_ST.STUCK) :
+                        status, count = C.SENS_ST.LOST, 1
+                    elif n['status'] == C.SENS_ST.LOST :
+                        status, count = C.SENS_ST.LOST, _count( C.SENS_ST.LOST, n )
+
+            if status == None : continue
+            transitions.append({'mac':mac, 'node':n['node'], 'status':status, 'count':count,
+                                'prev':n['status'], 'prev_count':n['count']})
+        return transitions
+
+    def _trend(self, mac:str, n:dict, warn_before:str, stuck_before:str) -> tuple :
+        ''' 内部関数：閾値未満のセンサーを温度の傾向で判定  ( status, count ) statusがNoneは変更なし '''
+        t = self.trends.get(mac)
+        if t == None or t['n'] < C.TREND['MIN_SAMPLES'] : return C.SENS_ST.NORMAL, 0
+        rising = n['status'] == C.SENS_ST.RISE_WARN
+        if t['slope'] >= C.TREND['RISE'] or ( rising and t['slope'] >= C.TREND['RISE'] / 2 ) :
+            if not rising or n['date'] == None or n['date'] <= warn_before :
+                return C.SENS_ST.RISE_WARN, _count( C.SENS_ST.RISE_WARN, n )
+            return None, 0     # 5分経過してないなら通知はしないでそのまま
+        if t['stuck'] >= C.TREND['MIN_SAMPLES'] and t['stuck_date'] <= stuck_before :
+            if n['status'] == C.SENS_ST.STUCK : return C.SENS_ST.STUCK, n['count']     # 通知は1回（日時のみ更新）
+            return C.SENS_ST.STUCK, 1
+        return C.SENS_ST.NORMAL, 0
+
+    def trend(self, mac:str) -> dict :
+        ''' 判定時の温度の傾向（無ければ空のdict） '''
+        return self.trends.get(mac, {})
+
+    def sensorInfo(self, mac:str) -> tuple :
+        """通知文用のセンサー情報（SQL.getSensorInfoと同じ形式）
+        Args:
+            mac (str): センサーMAC
+        Returns:
+            tuple: ( sens_name, node_name, nodeNo, warn )
+        """
+        conf = self.sensors.get(mac)
+        if conf == None : return None, None, None, None
+        return conf['name'], self.nodes.get(conf['node']), conf['node'], conf['warn']
+
+    def templ(self, mac:str) :
+        ''' 判定時のlatestの温度（無ければ0） '''
+        s = self.latest.get(mac)
+        return s['templ'] if s != None else 0
+
+
+def _legacy_passed( dateSTR:str, minute:int ) -> bool :
+    ''' 内部関数：従来の PassedMinute（日時文字列からminute分経過したか strptimeで計算） '''
+    try :
+        last = datetime.datetime.strptime(dateSTR, "%Y-%m-%d %H:%M:%S")
+        return ( datetime.datetime.now() - last ).total_seconds() >= minute * 60
+    except Exception as e :
+        C.logger.warning(f"PassedMinute ERROR {e}")
+        return False
+
+def _legacy_search( sensDATAs, mac ) :
+    ''' 内部関数：従来の _searchSensorData（latestのlistを先頭から探す） '''
+    for s in sensDATAs :
+        if s['mac'] == mac : return s
+    return None
+
+def _legacy_judge( S, sensDATAs, notifyListAll ) -> list :
+    ''' 内部関数：従来の _send_cloud() の判定（比較用 updateNotifyの代わりにlistを返す）
+    センサー毎に latest を線形探索し、閾値をSQLで取得する '''
+    transitions = list()
+    for n in notifyListAll :
+        s = _legacy_search(sensDATAs, n['mac'])
+        if s != None :
+            if s['mac'].startswith('00:00:00') : continue
+            (lc,lw,hw,hc) = S._getThreshold( s['mac'])
+            if hc <= s['templ'] :
+                transitions.append((s['mac'], C.SENS_ST.HIGH_CAUTION, _count( C.SENS_ST.HIGH_CAUTION, n )))
+            elif hw <= s['templ'] :
+                if n['count'] == 0 :
+                    transitions.append((s['mac'], C.SENS_ST.HIGH_WARN, 1))
+                elif _legacy_passed( s['date'], minute=5 ) :
+                    transitions.append((s['mac'], C.SENS_ST.HIGH_WARN, _count( C.SENS_ST.HIGH_WARN, n )))
+            else :
+                transitions.append((s['mac'], C.SENS_ST.NORMAL, 0))
+        else :
+            if n['status'] == C.SENS_ST.NONE : continue
+            if _legacy_passed( n['date'], minute=15 ) and n['status'] == C.SENS_ST.NORMAL :
+                transitions.append((n['mac'], C.SENS_ST.LOST, 1))
+            elif _legacy_passed( n['date'], minute=15 ) and n['status'] == C.SENS_ST.LOST :
+                transitions.append((n['mac'], C.SENS_ST.LOST, _count( C.SENS_ST.LOST, n )))
+    return transitions
+
+def bench( sensors=1000, nodes=10 ) -> dict :
+    """従来の判定と判定エンジンの比較（一時DATABASEにセンサーを作成）
+    Args:
+        sensors (int, optional): センサー数. 初期値 1000.
+        nodes (int, optional): ノード数. 初期値 10.
+    Returns:
+        dict: { sensors, legacy, engine, load, match }  時間は秒
+    """
+    import os
+    import random
+    import tempfile
+    import time
+    import libSQLite
+
+    tmpdir = tempfile.mkdtemp(prefix="sast_judge_")
+    libSQLite.DB_PATH = os.path.join(tmpdir, "judge.sqlite")
+    S = libSQLite.SQL("SETUP")
+
+    ## センサー設定・latest・notifyを作成（温度・経過時間はばらつかせる）
+    random.seed(1)
+    now = datetime.datetime.now()
+    conf, latest, notify = list(), list(), list()
+    for no in range(1, nodes+1) :
+        conf.append((f"00:00:00:00:00:{no:02}", f"NODE{no}", f"LORA{no:02}", "", ""))
+    for i in range(sensors) :
+        mac = f"49:22:{i >> 16 & 0xff:02x}:{i >> 8 & 0xff:02x}:{i & 0xff:02x}:00"
+        node = i % nodes + 1
+        conf.append((mac, f"S{i}", str(node), 1, "NONE,NONE,35,40"))
+        status = random.choice([C.SENS_ST.NONE, C.SENS_ST.NORMAL, C.SENS_ST.LOST, C.SENS_ST.HIGH_WARN])
+        age = random.choice([1, 6, 20])
+        date = (now - datetime.timedelta(minutes=age)).strftime("%Y-%m-%d %H:%M:%S")
+        notify.append((mac, date, status, 0, random.choice([0, 1, 3]), str(node)))
+        if random.random() < 0.9 :
+            latest.append((mac, date, node, random.choice([20.0, 36.0, 41.0]), 50.0, 3.0, -80, 0))
+    c = S.connection.cursor()
+    c.executemany("INSERT INTO conf (mac, name, node, use, warn) VALUES (?,?,?,?,?)", conf)
+    c.executemany("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?,?,?,?,?,?)", notify)
+    c.executemany("INSERT INTO latest (mac, date, node, templ, humid, batt, rssi, status) VALUES (?,?,?,?,?,?,?,?)", latest)
+    S.connection.commit()
+
+    sensDATAs = S.getLatestAll(delete=False)
+    notifyListAll = S.getNotifyList(0)
+    result = {'sensors':sensors}
+
+    start = time.perf_counter()
+    legacy = _legacy_judge(S, sensDATAs, notifyListAll)
+    result['legacy'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    J = JudgeEngine.load(S)
+    result['load'] = time.perf_counter() - start
+    engine = J.judge(sensDATAs, notifyListAll)
+    result['engine'] = time.perf_counter() - start
+
+    result['match'] = legacy == [ (t['mac'], t['status'], t['count']) for t in engine ]
+    return result
+
+
+if __name__ == '__main__' :
+    import logging
+    import sys
+    args = sys.argv
+    if len(args) != 1 and args[1].upper() == 'BENCH' :
+        num = int(args[2]) if len(args) >= 3 else 1000
+        C.logger.setLevel(logging.WARNING)  # ログ出力の時間は含めない
+        res = bench(num)
+        print(f"judge benchmark : {res['sensors']} sensors")
+        print(f" legacy : {res['legacy']*1000:9.2f} msec")
+        print(f" engine : {res['engine']*1000:9.2f} msec (load {res['load']*1000:.2f} msec)  x{res['legacy']/res['engine']:.1f}")
+        print(f" match  : {res['match']}")
+        sys.exit(0)
+    print("usage: libJudge.py BENCH [sensors]")
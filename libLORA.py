@@ -25,12 +25,24 @@ import time
 import datetime
 import serial
 import threading
+import queue
+import os
+import select
 import struct
 import sys
-import schedule
+import collections
+import logging
 import libMachineInfo as M
 from enum import IntEnum
 from libSQLite import SQL
+from libCapture import CaptureWriter
+import libRuntime as RT
+import libMetrics as Metrics
+
+try :
+    import numpy as np
+except ImportError :
+    np = None
 
 try:
     import RPi.GPIO as GPIO
@@ -49,13 +61,24 @@ L_LEN = '@H'
 L_DATA = '@BBH6sLhhhhh' ### -- Beacon Data Structure
 # TYPE(B), SEQ(B), TIME(L)
 L_BEACON = '@BBL'
+### -- Precompiled Structures
+LEN_STRUCT = struct.Struct(L_LEN)
+DATA_STRUCT = struct.Struct(L_DATA)
+MAC_CACHE_SIZE = 4096       # MAC文字列キャッシュの上限
 ### -- Beacon Interval
 BEACON_INTERVAL = 60 # Beacon自体の送信間隔（秒）
 BEACON_COUNT = 1  # 回送信する(送信間隔は60秒→コード側記載
 ### --- Sender Interval
 DATA_SEND_COUNT = 1         # 1データの送信回数
 DATA_SEND_TIME = 0.1        # 送信間隔（秒）
-### --- ACK 
+FRAME_WAIT = 0.2            # 最初のバイトから1フレームを受信し終えるまでの上限（秒）
+### --- Link Statistics
+LINK_SEQ_MOD = 255          # NodeのSEQはbyteでループ（Lora_NODE.getSeq）
+LINK_SEQ_RESYNC = 30        # これ以上のSEQ飛びはNode再起動とみなしロスに数えない
+LINK_RSSI_ALPHA = 0.2       # RSSI EWMAの係数
+DEDUPE_SIZE = 4096          # 重複チェックで保持するレコード数
+WRITER_BATCH = 64           # 書込スレッドが1回にまとめて登録するフレーム数
+### --- ACK
 class RESCODE(IntEnum):
     """ Response CODE  """
     NONE = 0
@@ -63,6 +86,26 @@ class RESCODE(IntEnum):
     BCAST = 3,
     TIMEOUT = -1,
 
+### --- ログ出力用（出力する時だけ16進文字列にする）
+class _Hex :
+    """ logger の %s 引数に渡すとログを出力する時だけ bytes.hex() する """
+    __slots__ = ('data',)
+    def __init__(self, data) -> None:
+        self.data = data
+    def __str__(self) -> str :
+        return bytes(self.data).hex()
+
+### --- Metrics（libMetrics.py）
+M_FRAMES = Metrics.counter("sast_lora_frames_total", "received frames with decodable records", ("radio",))
+M_RECORDS = Metrics.counter("sast_lora_records_total", "decoded records", ("radio",))
+M_FRAME_SEC = Metrics.histogram("sast_lora_frame_seconds", "decode, queue and ACK time per received frame", ("radio",))
+M_ACKS = Metrics.counter("sast_lora_acks_total", "ACK sent (gateway) / received (node)", ("radio", "result"))
+M_BEACONS = Metrics.counter("sast_lora_beacons_total", "beacon send", ("radio",))
+M_BEACON_SEC = Metrics.histogram("sast_lora_beacon_seconds", "beacon send time", ("radio",))
+M_QUEUE = Metrics.gauge("sast_lora_writer_queue", "frames waiting for the writer thread")
+M_WRITE_SEC = Metrics.histogram("sast_lora_write_seconds", "writer batch time (dedupe, useSensor, appendDataMany)")
+M_DUPS = Metrics.counter("sast_lora_duplicate_records_total", "records dropped by dedupe")
+
 ### GPIO settings
 LED_G = 19
 LED_R = 13
@@ -157,91 +200,195 @@ def Led_flash( led, times = 3, join=False ) :
         times (int, optional): 点滅回数. 初期値 3.
         join (bool, optional): スレッドを待機するか？. 初期値 False.
     """
-    C.logger.debug(f"LED {led}({times})")
+    C.logger.debug("LED %s(%s)", led, times)
     led = threading.Thread( target=_Led_flash_thread, args=( led, times ))
     led.start()
     if join : led.join()
 
 
-class Lora_GATE :
-    """ LoRa Gateway Class
-    Summary: 一定間隔でBeaconを送信する（初期値1分）、またNodeからのデータを受信して、SQLに記録する。
-    """ 
+class LinkRegistry :
+    """ Node毎のリンク統計（Gatewayのメモリ上で保持）
+    Summary: 受信フレーム毎にSEQの欠番、RSSI(EWMA)、最終受信時刻、ACK数、デコード不可数を記録する。
+    snapshot()の内容を定期的にnode_linkテーブルへ保存し、ObserverやOLEDはそちらを参照する。
+    受信スレッドとBeaconスレッドから呼ばれるのでLockで排他する。
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._nodes = {}
+
+    def _get(self, node) -> dict :
+        ''' 内部関数：Nodeの統計を取得（無ければ作成） '''
+        if node not in self._nodes :
+            self._nodes[node] = {'node':node, 'last_seq':None, 'frames':0, 'gaps':0,
+                                 'rssi':None, 'last_seen':None, 'acks':0, 'rejected':0 }
+        return self._nodes[node]
+
+    def frame(self, node, seq, rssi) -> int :
+        """受信フレームを記録
+        Args:
+            node (int): Node番号
+            seq (int): フレームのSEQ
+            rssi (int): 受信RSSI(dBm)
+        Returns:
+            int: 今回検出した欠番数
+        """
+        with self._lock :
+            n = self._get(node)
+            gap = 0
+            if n['last_seq'] != None :
+                diff = (seq - n['last_seq']) % LINK_SEQ_MOD
+                if 1 < diff <= LINK_SEQ_RESYNC : gap = diff - 1
+                elif diff > LINK_SEQ_RESYNC : C.logger.info(f"[Link] Node:{node} SEQ resync {n['last_seq']}->{seq}")
+            n['gaps'] += gap
+            n['frames'] += 1
+            n['last_seq'] = seq
+            n['rssi'] = rssi if n['rssi'] == None else n['rssi'] + LINK_RSSI_ALPHA * (rssi - n['rssi'])
+            n['last_seen'] = time.time()
+            return gap
+
+    def ack(self, node) -> None:
+        ''' ACK送信を記録 '''
+        with self._lock :
+            self._get(node)['acks'] += 1
+
+    def reject(self, node, num=1) -> None:
+        ''' デコードできなかったレコードを記録 '''
+        with self._lock :
+            self._get(node)['rejected'] += num
+
+    def snapshot(self) -> list :
+        """ 現在の統計をnode_linkテーブル形式のlistで返す
+        Returns:
+            list: Node毎の統計(dict)
+        """
+        ret = list()
+        with self._lock :
+            for n in self._nodes.values() :
+                d = dict(n)
+                total = d['frames'] + d['gaps']
+                d['loss'] = d['gaps'] / total if total != 0 else 0.0
+                if d['last_seen'] != None :
+                    d['last_seen'] = datetime.datetime.fromtimestamp(d['last_seen']).strftime("%Y-%m-%d %H:%M:%S")
+                ret.append(d)
+        return ret
+
+
+class RecordDedupe :
+    """ 受信レコードの重複チェック
+    Summary: (mac, date, node) をキーに直近 DEDUPE_SIZE 件を保持し、同じレコードの再登録を防ぐ。
+    """
+    def __init__(self, size=DEDUPE_SIZE) -> None:
+        self._size = size
+        self._keys = collections.OrderedDict()
+        self.dups = 0
+
+    def seen(self, sdata:dict) -> bool :
+        """登録済みのレコードか？（未登録なら記録する）
+        Args:
+            sdata (dict): decode_frame()が返すレコード
+        Returns:
+            bool: True 重複
+        """
+        key = ( sdata['mac'], sdata['date'], sdata['node'] )
+        if key in self._keys :
+            self.dups += 1
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self._size : self._keys.popitem(last=False)
+        return False
+
+
+class GateRadio :
+    """ Gatewayの無線モジュール（E220）1台分
+    Summary: 1台のUARTに対して受信スレッドを持ち、Beaconは共有のRuntime（libRuntime）のジョブで送信する。
+    デコードしたレコードはLora_GATEの共有キューに渡し、SQLへの登録はLora_GATEの書込スレッドで行う。
+    ACKはSQLの書込を待たずに受信スレッドから返送する。
+    """
     _Lora_Fixed_addr = True
-    sendDATA = {}
     _ser = None
-
-    def __init__(self) -> None:
-        S = SQL()
-        C.logger.info(f"START Lora_GATE  {M.getHostname()}")
-        #S.initLatest()
-        S.initNotify()
-        signal.signal(signal.SIGTERM, self._intr_term)
-        signal.signal(signal.SIGHUP, self._intr_term)
-        self._ser = serial.Serial(PORT, BAUD, timeout=10) 
-        self.thr_Reciver = threading.Thread(target=self._reciver, name="Rerciver", daemon=True )
-        self.thr_Beacon  = threading.Thread(target=self._beacon_sender , name="Beacon", daemon=True )
+    _lock = None
+    gate = None
+    primary = False
+    name = ""
+    port = ""
+    channel = 0
+    node_channel = 0
+    nodes = []
+    beacon = ":00"
+
+    def __init__(self, gate, conf:dict, index=0) -> None:
+        """
+        Args:
+            gate (Lora_GATE): 共有のリンク統計・キャプチャ・書込キューを持つGateway
+            conf (dict): config.GATE_RADIOS の1要素
+            index (int, optional): モジュール番号（スレッド名・ログ用）
+        """
+        self.gate = gate
+        self.primary = ( index == 0 )   # M0/M1(GPIO)が接続されているモジュール
+        self.name = f"R{index}"
+        self.port = conf.get('port', PORT)
+        self.channel = conf.get('channel', C.GATE_CHANNEL)
+        self.node_channel = conf.get('node_channel', C.NODE_CHANNEL)
+        self.nodes = conf.get('nodes', [])
+        self.beacon = conf.get('beacon', ":00")
+        self._lock = threading.RLock()
+        self._ser = serial.Serial(self.port, BAUD, timeout=10)
+        self._m_frames = M_FRAMES.labels(radio=self.name)
+        self._m_records = M_RECORDS.labels(radio=self.name)
+        self._m_frame_sec = M_FRAME_SEC.labels(radio=self.name)
+        self._m_acks = M_ACKS.labels(radio=self.name, result="sent")
+        C.logger.info(f"[{self.name}] {self.port} CH:{self.channel} NODE_CH:{self.node_channel} NODES:{self.nodes or 'ALL'} BEACON:{self.beacon}")
+        self.thr_Reciver = threading.Thread(target=self._reciver, name=f"Reciver-{self.name}", daemon=True )
+
+    def start(self) -> None:
         self.thr_Reciver.start()
-        self.thr_Beacon.start()
+        self._beacon_sender()
 
-    def __del__(self) -> None:
-        C.logger.info("Lora_GATE destruct...")
-        self._ser .close()
+    def close(self) -> None:
+        if self._ser != None : self._ser.close()
 
     def _reciver(self) :
         ''' Thread起動 LoRa Data Reciver '''
-        S = SQL() ## Thread 起動なので必須
-        prev_time = time.time()
-        sequence = 0
-        channel = 0
         while True :
-            # -- データ受信待機（23バイトで分割されてLISTに）
-            datas, node_rssi = self._recv_Data()
-            # 一つずつ処理
-            for data in datas :
-                #node_rssi = int(raw_data[-1]) - 256         #最終バイトは、RSSI
-                #data = bytes(raw_data[:len(raw_data)-1])    #残りがデータ
-
-                try : 
-                    # 順にデータのデコード
-                    (node, ch, seq, mac, time_s, templ, humid, batt, rssi, status ) = data_unpack(data)
-                except Exception as e :
-                    C.logger.warning(f"Decode Error -- {e}")
-                    continue
+            # -- データ受信待機
+            payload, node_rssi = self._recv_Data()
+            start = time.perf_counter()
+            # 一括デコード
+            nodeNO, channel, sequence, records = decode_frame(payload, node_rssi, self.gate.link)
+
+            # デコードできたデータが無いのでACKは送らない
+            if nodeNO == None : continue
+            self._m_frames.inc()
+            self._m_records.inc(len(records))
+            Led_flash("GREEN",1)  #LED点灯
+            if not self.accepts(nodeNO) :
+                ## 担当外のNodeは登録もACKもしない（担当のモジュールが受信・ACKする）
+                C.logger.debug("[%s] Node:%d is not assigned this radio %s ... drop", self.name, nodeNO, self.nodes)
+                self.gate.link.reject(nodeNO, len(records))
+                continue
 
-                Led_flash("GREEN",1)  #LED点灯
-                nodeNO = node
-                sequence = seq
-                channel = ch
-
-                C.logger.info(f"Node:{node}/{ch}[{node_rssi}dBm] SEQ:{seq} MAC:{mac} [{time_s}] {templ} {humid} {batt} {rssi} {status}")
-
-                ## SQLへの投入データ生成
-                sdata = {}
-                sdata['node'] = node
-                sdata['date'] = time_s.strftime("%Y-%m-%d %H:%M:%S")
-                sdata['mac'] = mac
-                sdata['templ'] = templ
-                sdata['humid'] = humid
-                sdata['batt'] = batt
-
-                # 送信データがNode本体かSenstorかでRSSIを変える
-                if mac.startswith('00:00:00') :
-                    #C.logger.debug("DATA is Node")
-                    sdata['rssi'] = node_rssi
-                else :
-                    #C.logger.debug("DATA is Sensor")
-                    sdata['rssi'] = rssi
-                sdata['status'] = status
+            # SQLへの登録は書込スレッドに任せる
+            self.gate.queue.put(records)
 
-                if S.useSensor(node, mac) : 
-                    #-- Config登録済のMACのみ登録（ぶら下がっているnodeの場合のみ）
-                    S.appendData(sdata)
-                
             # データ配列の処理終了で1個ACKを送信
-            self._send_ack(node, channel, sequence)
-
-
+            self.gate.link.frame(nodeNO, sequence, node_rssi)
+            self._send_ack(nodeNO, channel, sequence)
+            self.gate.link.ack(nodeNO)
+            self._m_acks.inc()
+            self._m_frame_sec.observe(time.perf_counter() - start)
+
+    def accepts(self, node:int) -> bool :
+        ''' 担当するNodeか？（nodesが[]のモジュールは他のモジュールに無い全Node） '''
+        if len(self.nodes) != 0 : return node in self.nodes
+        return node not in self.gate.assigned
+
+    def _write(self, payload) :
+        ''' 送信（ACKとBeaconが同時に書き込まないように排他） '''
+        with self._lock :
+            while True :
+                if self._ser .out_waiting == 0 : break
+            self._ser .write( bytes(payload) )
+            self._ser .flush()
 
     def _send_ack(self, node, channel, seq, ack='A' ) :
         ''' ACK を返送 '''
@@ -249,34 +396,26 @@ class Lora_GATE :
         if self._Lora_Fixed_addr : payload += makeLoraADDR( C.GATE_ADDR+node, channel)
         data = struct.pack(L_BEACON, ord(ack), seq, int(time.time()) )
         payload += data
-        C.logger.debug(f"ACK:{ack} {payload.hex()}")
-        while True :
-            if self._ser .out_waiting == 0 : break
-        #print(f"ack payload ={payload}")
-        self._ser .write( bytes(payload) )
-        self._ser .flush()
-        payload = None
+        C.logger.debug("[%s] ACK:%s %s", self.name, ack, _Hex(payload))
+        self._write(payload)
 
-
-    def _recv_Data(self) -> list:
-        '''Revice Lora return Bytes() '''
-        C.logger.debug("Waiting DATA Recive ... ")
+    def _recv_Data(self) -> tuple:
+        '''Revice Lora return ( Bytes(), RSSI ) '''
+        C.logger.debug("[%s] Waiting DATA Recive ... ", self.name)
         payload = bytearray()   # ByteArryじゃないと追記できない
         payload_rssi = bytes()
         header = bytearray()
-        datas = list()
         length = 0
 
         while True:
             # ヘッダーの受信待ち
-            #print(f"ser : in_waiting({ self._ser.in_waiting})")
             if self._ser.in_waiting != 0 :
-                header = self._ser.read(struct.calcsize(L_LEN))
-                if len(header) != struct.calcsize(L_LEN) : 
-                    C.logger.error(f"L_LEN decode  header({len(header)} : {header.hex()}) --- skip")
+                header = self._ser.read(LEN_STRUCT.size)
+                if len(header) != LEN_STRUCT.size :
+                    C.logger.error(f"[{self.name}] L_LEN decode  header({len(header)} : {header.hex()}) --- skip")
                     continue
-                length, = struct.unpack(L_LEN,header)
-                C.logger.debug(f"header({length}) : {header}")
+                length, = LEN_STRUCT.unpack(header)
+                C.logger.debug("header(%d) : %s", length, header)
                 break
             else :
                 time.sleep(0.5)
@@ -294,47 +433,174 @@ class Lora_GATE :
                 continue
 
         # データ前受信したので次に
-        payload_rssi = self._ser.read(1) # RSSI取得 
+        payload_rssi = self._ser.read(1) # RSSI取得
 
-        C.logger.debug(f"RECV({len(payload)-1}/{length}) {payload.hex()}")
+        C.logger.debug("[%s] RECV(%d/%d) %s", self.name, len(payload)-1, length, _Hex(payload))
 
-        # データ分解
-        s = struct.calcsize(L_DATA)
+        # データの分解は decode_frame() で行う
         rssi = int.from_bytes(payload_rssi,'big') - 256
-        datas = [payload[i:i+s] for i in range(0, len(payload), s )]
-        #C.logger.debug(f"Recived datas={datas}")
-        return datas , rssi 
+        if self.gate.capture != None : self.gate.capture.write(payload, rssi)
+        return payload , rssi
 
     def _beacon_sender(self) :
-        ''' 毎分0秒に Beaconを送信 scheduler利用 '''
-        C.logger.info(" START Beacon Sender ... ")
+        ''' 毎分指定秒に Beaconを送信 共有のRuntime（libRuntime）に登録 '''
+        C.logger.info(f"[{self.name}] START Beacon Sender ... ")
 
-        ## 毎分0秒に_send_beacon()を実行
-        schedule.every().minute.at(":00").do(self._send_beacon)
-
-        ## 実行し続ける ループ 
-        while True:
-            # 次の行で実行まで待つ。
-            schedule.run_pending()
-            time.sleep(1)
+        ## 毎分 beacon 秒に_send_beacon()を実行（モジュール毎に独立したジョブ）
+        R = RT.runtime()
+        R.every(60, self._send_beacon, offset=int(self.beacon.lstrip(':')), name=f"Beacon-{self.name}", timeout=30)
+        R.start()
 
     def _send_beacon(self) :
         ''' Beaconを送信  BEACON_COUNT回 ビーコンを送信'''
-        C.logger.info(f" Send Beacon >> {BEACON_COUNT} times")
+        C.logger.info(f"[{self.name}] Send Beacon >> {BEACON_COUNT} times")
+        start = time.perf_counter()
         Led_flash("RED", 3)
+        payloads = list()
         for i in range( 1 , BEACON_COUNT+1 ) :
             payload = bytearray()
-            if self._Lora_Fixed_addr : 
-                payload += makeLoraADDR( C.BCAST_ADDR, C.NODE_CHANNEL)
+            if self._Lora_Fixed_addr :
+                payload += makeLoraADDR( C.BCAST_ADDR, self.node_channel)
             data = struct.pack(L_BEACON, ord('B'), i, int(time.time()) )
             payload += data
-            C.logger.debug(f" Beacon :{i} {payload.hex()}")
-            while True :
-                if self._ser .out_waiting == 0 : break
-            self._ser .write( bytes(payload) )
-            self._ser .flush()
-            payload = None
-        C.logger.debug(" Beacon Sended.")
+            C.logger.debug("[%s] Beacon :%d %s", self.name, i, _Hex(payload))
+            payloads.append(payload)
+        self._send_wor(payloads)
+        M_BEACONS.labels(radio=self.name).inc()
+        M_BEACON_SEC.labels(radio=self.name).observe(time.perf_counter() - start)
+        C.logger.debug(f"[{self.name}] Beacon Sended.")
+
+    def send_command(self, code='R', node=None) :
+        """Nodeへコマンドを送信（WOR_MODEではWOR受信中のNodeを起こす）
+        Args:
+            code (str, optional): 'R' データ送信要求 / 'B' 送信タイミングの再同期. 初期値 'R'.
+            node (int, optional): 送信先Node（Noneは全Node）. 初期値 None.
+        """
+        addr = C.BCAST_ADDR if node == None else C.GATE_ADDR + node
+        seq = 1 if code == 'B' else 0  # NodeはSEQ=1のBeaconで再同期する
+        payload = bytearray()
+        if self._Lora_Fixed_addr : payload += makeLoraADDR( addr, self.node_channel)
+        payload += struct.pack(L_BEACON, ord(code), seq, int(time.time()) )
+        C.logger.info(f"[{self.name}] Send Command:{code} > {'ALL' if node == None else node}")
+        self._send_wor([payload])
+
+    def _send_wor(self, payloads:list) :
+        ''' Beacon/コマンドの送信（WOR_MODEはmode1でWORプリアンブルを付けて送信、送信後mode0に戻す） '''
+        with self._lock :
+            wor = C.WOR_MODE and self.primary
+            if wor :
+                setMode(1)
+                WaitAUX()
+            for payload in payloads :
+                self._write(payload)
+            if wor :
+                time.sleep(0.1)
+                WaitAUX()   # プリアンブル(wor_cycle)を含めた送信完了待ち
+                setMode(0)
+                WaitAUX()
+
+
+class Lora_GATE :
+    """ LoRa Gateway Class
+    Summary: 一定間隔でBeaconを送信する（初期値1分）、またNodeからのデータを受信して、SQLに記録する。
+    config.GATE_RADIOS に記載した無線モジュール（GateRadio）を全て起動し、
+    各モジュールの受信データは共有キューを経由して1つの書込スレッドでSQLに登録する。
+    リンク統計・重複チェック・キャプチャは全モジュールで共有する。
+    """
+    radios = []
+    assigned = set()
+    queue = None
+    link = None
+    dedupe = None
+    capture = None
+
+    def __init__(self, capture="", radios=None) -> None:
+        """
+        Args:
+            capture (str, optional): 受信フレームを記録するキャプチャファイル（""は記録しない）
+            radios (list, optional): 無線モジュールの設定（Noneは config.GATE_RADIOS）
+        """
+        S = SQL()
+        C.logger.info(f"START Lora_GATE  {M.getHostname()}")
+        #S.initLatest()
+        S.createExtendTables()
+        S.initNotify()
+        self.link = LinkRegistry()
+        self.dedupe = RecordDedupe()
+        self.queue = C.Q
+        if capture != "" : self.capture = CaptureWriter(capture)
+        if threading.current_thread() is threading.main_thread() :
+            signal.signal(signal.SIGTERM, self._intr_term)
+            signal.signal(signal.SIGHUP, self._intr_term)
+            signal.signal(signal.SIGUSR1, self._intr_request)
+
+        ## 無線モジュールの起動（nodesに記載したNodeはそのモジュールのみで受信する）
+        radios = C.GATE_RADIOS if radios == None else radios
+        self.assigned = { node for conf in radios for node in conf.get('nodes', []) }
+        self.radios = [ GateRadio(self, conf, i) for i, conf in enumerate(radios) ]
+        self.thr_Writer = threading.Thread(target=self._writer, name="Writer", daemon=True )
+        self.thr_Writer.start()
+        for radio in self.radios : radio.start()
+
+    def __del__(self) -> None:
+        C.logger.info("Lora_GATE destruct...")
+        for radio in self.radios : radio.close()
+
+    def _writer(self) :
+        ''' Thread起動 全モジュールの受信データをSQLに登録（共有の書込スレッド） '''
+        S = SQL() ## Thread 起動なので必須
+        last_snapshot = time.time()
+        while True :
+            ## キューに溜まっているフレームをまとめて取り出す
+            frames = list()
+            try :
+                frames.append(self.queue.get(timeout=1.0))
+                while len(frames) < WRITER_BATCH :
+                    frames.append(self.queue.get_nowait())
+            except queue.Empty :
+                pass
+            M_QUEUE.set(self.queue.qsize())
+
+            start = time.perf_counter()
+            dups = self.dedupe.dups
+            sdatas = list()
+            for records in frames :
+                for sdata in records :
+                    if self.dedupe.seen(sdata) : continue # 受信済みのデータは登録しない
+                    if S.useSensor(sdata['node'], sdata['mac']) :
+                        #-- Config登録済のMACのみ登録（ぶら下がっているnodeの場合のみ）
+                        sdatas.append(sdata)
+            if len(sdatas) != 0 : S.appendDataMany(sdatas)
+            if len(frames) != 0 :
+                M_DUPS.inc(self.dedupe.dups - dups)
+                M_WRITE_SEC.observe(time.perf_counter() - start)
+
+            ## リンク統計をnode_linkに保存
+            if time.time() - last_snapshot >= C.SPAN_LINK_SNAPSHOT :
+                last_snapshot = time.time()
+                self._snapshot_link(S)
+
+    def _snapshot_link(self, S) :
+        ''' リンク統計をnode_linkテーブルに保存 '''
+        links = self.link.snapshot()
+        for l in links :
+            C.logger.debug(f"[Link] Node:{l['node']} SEQ:{l['last_seq']} loss:{l['loss']:.3f} RSSI:{l['rssi']} ACK:{l['acks']} REJ:{l['rejected']}")
+        S.updateNodeLink(links)
+
+    def request(self, code='R', node=None) :
+        """全モジュールからNodeへコマンドを送信
+        Args:
+            code (str, optional): 'R' データ送信要求 / 'B' 送信タイミングの再同期. 初期値 'R'.
+            node (int, optional): 送信先Node（Noneは全Node）. 初期値 None.
+        """
+        for radio in self.radios :
+            if node != None and len(radio.nodes) != 0 and node not in radio.nodes : continue
+            radio.send_command(code, node)
+
+    def _intr_request(self, num, frame) :
+        ''' SIGUSR1 で全Nodeにデータ送信を要求 '''
+        C.logger.info(f"[GATE] SIGUSR1 catch request data...")
+        threading.Thread(target=self.request, name="Request", daemon=True ).start()
 
     def _intr_term(self, num, frame) :
         C.logger.warning(f"[GATE] SIGTERM catch exit...")
@@ -351,10 +617,16 @@ class Lora_NODE :
     _Lora_Fixed_addr = True
     _BeaconReviced = None
     _NodeNo = 0
+    _radio = None
     _thr_Beacon = None
     _thr_Sender = None
     _seq : int = 0 
     _TimeSkew : bool = False
+    _thr_WOR = None
+    _ser_lock = None    # 送信スレッドとWOR受信スレッドのシリアル排他
+    _wake = None        # WORコマンド受信で送信待機を中断
+    _resync : bool = False
+    _base_time = 0
 
     def getSeq(self) -> int :
         ''' シーケンス番号の生成 byteでループ'''
@@ -370,10 +642,14 @@ class Lora_NODE :
         #S.initLatest()
         S.changeNodeStatus(C.NODE_STAT.START.value)
         self._ser = serial.Serial(PORT, BAUD, timeout=60)
+        self._NodeNo = nodeNO
+        self._radio = C.radioForNode(nodeNO)   # 担当するGATEの無線モジュール
+        self._ser_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thr_WOR = threading.Thread(target=self._wor_listener, name="WORListener", daemon=True )
         self._thr_Beacon = threading.Thread(target=self._beaconReciver, name="BeaconReciver", daemon=True )
         self._thr_Sender = threading.Thread(target=self._sender, name="Sender", daemon=True )
         self._thr_Beacon.start()
-        self._NodeNo = nodeNO
         signal.signal(signal.SIGTERM, self._intr_term)
         signal.signal(signal.SIGHUP, self._intr_term)
         C.logger.info(f"START LoRa Node - NO:{self._NodeNo}")
@@ -381,15 +657,19 @@ class Lora_NODE :
     def _sender(self) :
         ''' Thread起動 LoRa Data Sender '''
         C.logger.info("Start Sender thread.")
-        base_time = time.time()
+        self._base_time = time.time()
         next_time = 0
         while True :
-            t = threading.Thread(target=self._send_data, name="send_data")
-            t.start()
-            t.join()
-            next_time = ((base_time - time.time()) % BEACON_INTERVAL) or BEACON_INTERVAL
+            if not self._resync :
+                with self._ser_lock :
+                    t = threading.Thread(target=self._send_data, name="send_data")
+                    t.start()
+                    t.join()
+            self._resync = False
+            next_time = ((self._base_time - time.time()) % BEACON_INTERVAL) or BEACON_INTERVAL
             C.logger.debug(f"done ... sleep({next_time})")
-            time.sleep(next_time)
+            self._wake.wait(next_time)  # WORでコマンドを受信した場合は待機を中断
+            self._wake.clear()
     
 
     def _send_data(self) :
@@ -412,7 +692,7 @@ class Lora_NODE :
         batt = M.getBatteryPiSugar3()
         volt = M.getVoltagePiSugar3()
         chrg = M.isChargePiSuger3()
-        sendDATA.append( data_pack( self._NodeNo, seq, node_mac, int(time.time()), templ, volt, batt, 0, chrg ) )
+        sendDATA.append( data_pack( self._NodeNo, seq, node_mac, int(time.time()), templ, volt, batt, 0, chrg, ch=self._radio['node_channel'] ) )
 
         ## センサーの情報をSQLから取得
         sensorDATA = S.getLatestDATA(NODE_NO, delete=True)
@@ -421,13 +701,13 @@ class Lora_NODE :
             data_count += 1
             if data_count > MAX_DATA : break  # -- サブパケットを超えた分は送信できない
             s['status'] = S.getStatus( s['mac'] )
-            C.logger.debug(f"SENSOR : {s}")
-            sendDATA.append( data_pack( self._NodeNo, seq, s['mac'], C.toTimespan(s['date']), s['templ'], s['humid'], s['batt'], s['rssi'], s['status'] ))
+            C.logger.debug("SENSOR : %s", s)
+            sendDATA.append( data_pack( self._NodeNo, seq, s['mac'], C.toTimespan(s['date']), s['templ'], s['humid'], s['batt'], s['rssi'], s['status'], ch=self._radio['node_channel'] ))
         
         #C.logger.debug(f"sendDATA : {sendDATA}")
         ## 1つのデータにパッキング
-        stream = makeSendDataStream( C.GATE_ADDR, C.GATE_CHANNEL, sendDATA)
-        C.logger.debug(f" SEND({len(stream)})> {stream.hex()}")
+        stream = makeSendDataStream( C.GATE_ADDR, self._radio['channel'], sendDATA)
+        C.logger.debug(" SEND(%d)> %s", len(stream), _Hex(stream))
 
         ## データの送信
         Led_flash( "GREEN", len(sendDATA) )
@@ -445,6 +725,7 @@ class Lora_NODE :
         ## ACK待ち 
         time.sleep(1) # 応答まで1秒待ち
         ret, timeL = self._wait_ack( seq )
+        M_ACKS.labels(radio="NODE", result="ack" if ret == RESCODE.ACK else "none").inc()
         if ret == RESCODE.ACK :
             C.logger.info("recv: ACK ")
             S.changeNodeStatus(C.NODE_STAT.GOOD)
@@ -452,10 +733,10 @@ class Lora_NODE :
             C.logger.error(f"recv: {ret}")
             S.changeNodeStatus(C.NODE_STAT.NO_ACK)
 
-        ## LoRa Module DeepSleep
-        setMode(3)
+        ## LoRa Module DeepSleep（WOR_MODEはWOR受信で待機）
+        setMode(2 if C.WOR_MODE else 3)
         WaitAUX()
-        C.logger.info("Lora Module sleep zzzz....")
+        C.logger.info(f"Lora Module {'WOR listen' if C.WOR_MODE else 'sleep zzzz'}....")
 
     def _wait_ack(self, sequence, TIME_OUT = 1 ) :
         ''' ホストから戻りコードを受信する'''
@@ -556,50 +837,105 @@ class Lora_NODE :
                 Led( "GREEN" , False )
                 break
 
-        setMode(3)
-        WaitAUX()
+        if C.WOR_MODE :
+            ## 以降はWOR受信スレッドでBeacon/コマンドを受信する
+            self._thr_WOR.start()
+        else :
+            setMode(3)
+            WaitAUX()
         C.logger.info("Terminate Beacon Reciver.")
+
+    def _wor_listener(self) :
+        ''' Thread起動 WOR受信(mode2)でGATEからのBeacon/コマンドを待機
+        B(SEQ=1) : 送信タイミングをBeaconに合わせ直す
+        R : すぐにデータを送信
+        '''
+        C.logger.info("Start WOR Listener.")
+        size = struct.calcsize(L_BEACON) + 1
+        while True :
+            ## 受信するまでブロック（ポーリングしない）
+            select.select([self._ser.fileno()], [], [])
+            frame = None
+            with self._ser_lock :
+                # 送信中(ACK待ち含む)はシリアルを使わない 送信側が読んだ後なら何もしない
+                if self._ser.in_waiting != 0 :
+                    frame = self._read_frame(size)
+            if frame == None : continue
+            code, seq, recv_datetime, rssi = self._parse_beacon(frame)
+
+            C.logger.info(f"--WOR({code}) < SEQ:{seq} DATE:{recv_datetime}  RSSI:{rssi}")
+            if code == 'B' and seq == 1 :
+                # --- Node NO x 10 秒後に送信するよう再同期
+                self._base_time = time.time() + self._NodeNo * 10
+                self._resync = True
+                self._wake.set()
+            elif code == 'R' :
+                self._wake.set()
     
     def _recv_beacon(self) :
-        ''' Revice Becon '''
+        ''' Revice Becon（正しい長さのフレームを受信するまで待つ） '''
         C.logger.debug("Wait Beacon Recive ...")
-        payload = bytearray()   # ByteArryじゃないと追記できない
-        while True:
-            if self._ser .in_waiting != 0:
-                payload += self._ser.read_all()
-
-            elif self._ser.in_waiting == 0 and len(payload) != 0:
-                time.sleep(0.010) # さらに待って追加受信
-                payload += self._ser.read_all()
-
-            if len(payload) -1 == struct.calcsize(L_BEACON) :
-                rssi = int(payload[-1]) - 256
-                beacon = bytes(payload[:len(payload)-1])
-                code, seq, recv_date = struct.unpack( L_BEACON, beacon )
-                recv_datetime = datetime.datetime.fromtimestamp(recv_date)
-                diffTime = datetime.datetime.now() - recv_datetime
-                C.logger.debug(f"Recive({chr(code)}) date:{recv_datetime} diff:{diffTime.seconds} rssi:{rssi}")
-
-                if datetime.timedelta(seconds=10) < diffTime :
-                    C.logger.error("SystemTime difference with the GATEWAY is more than 10 seconds!!")
-                    # -- DateTime adjust 
-                    import subprocess
-                    command = f"sudo date --set \"{recv_datetime.year:04}-{recv_datetime.month:02}-{recv_datetime.date:02} {recv_datetime.hour:02}:{recv_datetime.minute:02}:{recv_datetime.second:02}\""
-                    C.logger.debug(command)
-                    process = subprocess.Popen(command,shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    output, error = process.communicate()
-                    if process.returncode == 0:
-                        C.logger.info(f"date Command done . {output.decode()}")
-                    else:
-                        C.logger.error(f"date Commane Error Occored : {error.decode()}")
-
-                    self._TimeSkew = True
-                else :
-                    self._TimeSkew = False
-
-                return ( chr(code), seq, recv_datetime, rssi ) 
+        size = struct.calcsize(L_BEACON) + 1
+        while True :
+            select.select([self._ser.fileno()], [], [])
+            frame = self._read_frame(size)
+            if frame != None : return self._parse_beacon(frame)
+
+    def _read_frame(self, size:int, wait=FRAME_WAIT) :
+        """受信済の最初のバイトから wait 秒以内に1フレーム（RSSI含む）を読む
+        長さが違う（途中で切れた・長すぎる・2フレーム連結）フレームは捨てる
+        Args:
+            size (int): フレームのバイト数（RSSI含む）
+            wait (float, optional): 最初のバイトからの受信期限（秒）. 初期値 FRAME_WAIT.
+        Returns:
+            bytes: フレーム（長さが違う場合は None）
+        """
+        fd = self._ser.fileno()
+        payload = bytearray(self._ser.read(self._ser.in_waiting or 1))
+        deadline = time.monotonic() + wait
+        while len(payload) < size :
+            remain = deadline - time.monotonic()
+            if remain <= 0 or not select.select([fd], [], [], remain)[0] : break
+            payload += self._ser.read(self._ser.in_waiting or 1)
+        ## 続けて届くバイトがあれば長すぎるフレーム
+        if len(payload) == size and select.select([fd], [], [], 0.010)[0] :
+            payload += self._ser.read(self._ser.in_waiting or 1)
+        if len(payload) != size :
+            C.logger.warning("Drop frame (%d/%d bytes) %s", len(payload), size, _Hex(payload))
+            return None
+        return bytes(payload)
+
+    def _parse_beacon(self, frame:bytes) -> tuple :
+        """Beacon/コマンドのフレームを解析（GATEWAYとの時刻差が10秒を超えたら時刻を合わせる）
+        Args:
+            frame (bytes): L_BEACON + RSSI のフレーム（_read_frame）
+        Returns:
+            tuple: ( code, seq, recv_datetime, rssi )
+        """
+        rssi = int(frame[-1]) - 256
+        code, seq, recv_date = struct.unpack( L_BEACON, frame[:-1] )
+        recv_datetime = datetime.datetime.fromtimestamp(recv_date)
+        diffTime = datetime.datetime.now() - recv_datetime
+        C.logger.debug(f"Recive({chr(code)}) date:{recv_datetime} diff:{diffTime.seconds} rssi:{rssi}")
+
+        if datetime.timedelta(seconds=10) < diffTime :
+            C.logger.error("SystemTime difference with the GATEWAY is more than 10 seconds!!")
+            # -- DateTime adjust 
+            import subprocess
+            command = f"sudo date --set \"{recv_datetime.year:04}-{recv_datetime.month:02}-{recv_datetime.date:02} {recv_datetime.hour:02}:{recv_datetime.minute:02}:{recv_datetime.second:02}\""
+            C.logger.debug(command)
+            process = subprocess.Popen(command,shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            output, error = process.communicate()
+            if process.returncode == 0:
+                C.logger.info(f"date Command done . {output.decode()}")
+            else:
+                C.logger.error(f"date Commane Error Occored : {error.decode()}")
+
+            self._TimeSkew = True
+        else :
+            self._TimeSkew = False
 
-            time.sleep(1.0)
+        return ( chr(code), seq, recv_datetime, rssi ) 
 
     def _intr_term(self, num, frame) :
         C.logger.warning("[NODE] SIGTERM catch exit...")
@@ -626,36 +962,149 @@ def build_datas( payload, struct_str, is_rssi=True, is_fidxed=True) :
 
 
 
-def data_pack( node, seq, mac, times:int, templ, humid, batt, rssi, status ) :
-    ''' Encode DATA ByteString  Throw Exception '''
+def data_pack( node, seq, mac, times:int, templ, humid, batt, rssi, status, ch=None ) :
+    ''' Encode DATA ByteString  Throw Exception （chはNodeのチャンネル Noneは C.NODE_CHANNEL） '''
+    if ch == None : ch = C.NODE_CHANNEL
     templ_s = int(templ * 10)
     humid_s = int(humid * 10)
     batt_s = int(batt * 10)
     mac_s = MAC_encode(mac)
-    data = struct.pack( L_DATA , node, C.NODE_CHANNEL, seq, mac_s, times, templ_s, humid_s, batt_s, rssi, status)
-    #print(f"{node} {C.NODE_CHANNEL} {seq} {mac} {times} {templ_s} {humid_s} {batt_s} {rssi} {status} -> \n{data} len={len(data)}")
+    data = struct.pack( L_DATA , node, ch, seq, mac_s, times, templ_s, humid_s, batt_s, rssi, status)
+    #print(f"{node} {ch} {seq} {mac} {times} {templ_s} {humid_s} {batt_s} {rssi} {status} -> \n{data} len={len(data)}")
     return data
 
-def data_unpack( data:bytes ) :
-    ''' Decode DATA ByteString  Throw Exception '''
+def _day_range( today ) -> tuple :
+    ''' 内部関数：指定日(ローカル時刻)の 0時〜翌0時 をUNIX時間で返す '''
+    start = time.mktime(today.timetuple())
+    end = time.mktime((today + datetime.timedelta(days=1)).timetuple())
+    return start, end
+
+def decode_frame( payload, node_rssi:int, link=None, today=None ) -> tuple :
+    """受信した1フレーム分のレコードを一括デコードしてSQL投入用のdictにする
+    Gatewayの受信スレッドとSAST_replay.pyで共通利用する
+    memoryviewとDATA_STRUCT.iter_unpack()でフレームを分割・コピーせずにデコードする
+    チェック内容は data_unpack() と同じ
+    Args:
+        payload (bytes): L_LENヘッダ以降の受信データ（L_DATAの連続）
+        node_rssi (int): フレームの受信RSSI(dBm)
+        link (LinkRegistry, optional): デコード不可を記録するリンク統計
+        today (date, optional): 日付チェックの基準日（Noneは本日）
+    Returns:
+        tuple: ( nodeNO, channel, sequence, records ) デコードできない場合 nodeNOはNone
+    """
+    nodeNO = None
+    channel = 0
+    sequence = 0
+    records = list()
+    mv = memoryview(payload)
+    size = DATA_STRUCT.size
+    num = len(mv) // size
+
+    ## L_DATAに満たない端数はデコード不可
+    if len(mv) % size != 0 :
+        C.logger.error(f"DateSize Missmatch require({size} <- {len(mv) % size} )")
+        if link != None : link.reject(mv[num*size])
+
+    day_start, day_end = _day_range(today if today != None else datetime.date.today())
+    last_times = None
+    date_str = ""
+    for (node, ch, seq, mac_s, times, templ_s, humid_s, batt_s, rssi, stat) in DATA_STRUCT.iter_unpack(mv[:num*size]) :
+        if not (1 <= node <=99) or not ( day_start <= times < day_end ) or not ( -1 <= stat <= 10 ) :
+            C.logger.warning(f"Decode Error -- NODE:{node} TIME:{times} STATUS:{stat}")
+            if link != None : link.reject(node)
+            continue
+
+        if times != last_times :
+            ## 同じフレーム内は同時刻が多いので直前の文字列を使いまわす
+            last_times = times
+            date_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(times))
+        mac = MAC_decode(mac_s)
+
+        nodeNO = node
+        sequence = seq
+        channel = ch
+
+        ## SQLへの投入データ生成
+        # 送信データがNode本体かSenstorかでRSSIを変える
+        sdata = {'node':node, 'date':date_str, 'mac':mac, 'templ':templ_s/10, 'humid':humid_s/10, 'batt':batt_s/10,
+                 'rssi':node_rssi if mac.startswith('00:00:00') else rssi, 'status':stat }
+        C.logger.info("Node:%d/%d[%ddBm] SEQ:%d MAC:%s [%s] %s %s %s %d %d", node, ch, node_rssi, seq, mac, date_str,
+                      sdata['templ'], sdata['humid'], sdata['batt'], rssi, stat)
+        records.append(sdata)
+
+    return nodeNO, channel, sequence, records
+
+def _data_dtype() :
+    ''' 内部関数：L_DATAと同じメモリ配置のNumPy構造化dtype（ネイティブのアライメントに合わせる） '''
+    names = ['node', 'ch', 'seq', 'mac', 'time', 'templ', 'humid', 'batt', 'rssi', 'stat']
+    codes = ['B', 'B', 'H', '6s', 'L', 'h', 'h', 'h', 'h', 'h']
+    formats = ['V6' if c == '6s' else np.dtype(c) for c in codes]
+    offsets = list()
+    prefix = '@'
+    for c in codes :
+        prefix += c
+        offsets.append(struct.calcsize(prefix) - struct.calcsize('@'+c))
+    return np.dtype({'names':names, 'formats':formats, 'offsets':offsets, 'itemsize':DATA_STRUCT.size})
+
+def decode_records_np( buf, rssi, day_start, day_end ) -> tuple :
+    """キャプチャ再生用：複数フレームを連結したバッファをNumPyの構造化配列で一括デコード
+    Args:
+        buf (bytes): L_DATAの連続（端数無し）
+        rssi (ndarray): レコード毎のフレーム受信RSSI
+        day_start (ndarray): レコード毎の日付チェック開始（UNIX時間）
+        day_end (ndarray): レコード毎の日付チェック終了（UNIX時間）
+    Returns:
+        tuple: ( records, rejected ) recordsはdecode_frame()と同じdictのlist
+    """
+    if np == None : raise ImportError("numpy not found")
+    arr = np.frombuffer(buf, dtype=_data_dtype())
+    ok = (arr['node'] >= 1) & (arr['node'] <= 99) & (arr['stat'] >= -1) & (arr['stat'] <= 10)
+    ok &= (arr['time'] >= day_start) & (arr['time'] < day_end)
+    arr = arr[ok]
+    rssi = np.asarray(rssi)[ok]
+    templ = (arr['templ'] / 10).tolist()
+    humid = (arr['humid'] / 10).tolist()
+    batt = (arr['batt'] / 10).tolist()
+    records = list()
+    last_times = None
+    date_str = ""
+    for i, (node, times, mac_s, r, stat) in enumerate(zip(arr['node'].tolist(), arr['time'].tolist(), arr['mac'].tolist(), arr['rssi'].tolist(), arr['stat'].tolist())) :
+        if times != last_times :
+            last_times = times
+            date_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(times))
+        mac = MAC_decode(mac_s)
+        records.append({'node':node, 'date':date_str, 'mac':mac, 'templ':templ[i], 'humid':humid[i], 'batt':batt[i],
+                        'rssi':int(rssi[i]) if mac.startswith('00:00:00') else r, 'status':stat })
+    return records, int(len(ok) - ok.sum())
+
+def data_unpack( data:bytes, today=None ) :
+    ''' Decode DATA ByteString  Throw Exception
+        today : 日付チェックの基準日（Noneは本日、キャプチャ再生時は受信日を指定）'''
     if len(data) != struct.calcsize(L_DATA) :
         C.logger.error(f"DateSize Missmatch require({struct.calcsize(L_DATA)} <- {len(data)} )")
     node, node_ch, seq,mac_s, times, templ_s,humid_s,batt_s,rssi,stat = struct.unpack( L_DATA, data )
     mac = MAC_decode(mac_s)  # Throw Exception
     time_s = datetime.datetime.fromtimestamp(times)
+    if today == None : today = datetime.date.today()
     #Add Check DATA 2023/04/16
     if not (1 <= node <=99) : raise Exception(f"NODE Error {node}")
     if not (0 <= seq  <=65535) : raise Exception(f"SEQ Error {seq}" )
-    if not ( time_s.date() == datetime.date.today() ) :raise Exception(f"DATE Error {time_ｓ}")
+    if not ( time_s.date() == today ) :raise Exception(f"DATE Error {time_ｓ}")
     #if not ( -10 <= templ_s <= 80 ) : raise Exception("Templ Error")    
     #if not ( 0 <= humid_s <= 100 ) : raise Exception("Humid Error") 
     if not ( -1 <= stat <= 10 ) : raise Exception(f"STATUS Error {stat}") 
     return node, node_ch, seq, mac, time_s, templ_s/10, humid_s/10, batt_s/10, rssi, stat
     
+_MAC_CACHE = {}
 def MAC_decode( mac:bytes ) :
-    '''Encode Bytes for MAC Address'''
-    a,b,c,d,e,f = struct.unpack('@6B', mac )
-    return f"{a:02x}:{b:02x}:{c:02x}:{d:02x}:{e:02x}:{f:02x}"
+    '''Encode Bytes for MAC Address（変換結果はキャッシュする）'''
+    s = _MAC_CACHE.get(mac)
+    if s == None :
+        mac = bytes(mac)
+        if len(mac) != 6 : raise ValueError(f"MAC length Error {len(mac)}")
+        if len(_MAC_CACHE) >= MAC_CACHE_SIZE : _MAC_CACHE.clear()
+        s = _MAC_CACHE[mac] = mac.hex(':')
+    return s
 
 def MAC_encode( mac:str ) :
     '''Decode String MAC to Bytes'''
@@ -668,9 +1117,150 @@ def MAC_encode( mac:str ) :
             return None
     return bytes(ret)
 
+def bench_decode( frames=2000, per_frame=5 ) -> dict :
+    """デコードのマイクロベンチマーク（libLORA.py BENCH）
+    旧方式（フレームをbytesに分割 → data_unpack() → MACを6回format → strftime）と
+    decode_frame()（memoryview + iter_unpack + MACキャッシュ）、NumPy版を比較する
+    Args:
+        frames (int, optional): フレーム数. 初期値 2000.
+        per_frame (int, optional): 1フレームのレコード数. 初期値 5.
+    Returns:
+        dict: 方式毎の処理時間（秒）
+    """
+    now = int(time.time())
+    payloads = list()
+    for f in range(frames) :
+        recs = [ data_pack(1, f % LINK_SEQ_MOD, f"49:24:11:00:{f % 200:02x}:{i:02x}", now, 25.0+i, 60.0, 90, -70, 1) for i in range(per_frame) ]
+        payloads.append(b''.join(recs))
+    size = DATA_STRUCT.size
+    result = {'records': frames * per_frame}
+
+    def mac_legacy( mac ) :
+        a,b,c,d,e,f = struct.unpack('@6B', mac )
+        return f"{a:02x}:{b:02x}:{c:02x}:{d:02x}:{e:02x}:{f:02x}"
+
+    ## 旧方式
+    start = time.perf_counter()
+    for payload in payloads :
+        datas = [payload[i:i+size] for i in range(0, len(payload), size )]
+        for data in datas :
+            if len(data) != struct.calcsize(L_DATA) : continue
+            node, ch, seq, mac_s, times, templ_s, humid_s, batt_s, rssi, stat = struct.unpack( L_DATA, data )
+            mac = mac_legacy(mac_s)
+            time_s = datetime.datetime.fromtimestamp(times)
+            if not ( time_s.date() == datetime.date.today() ) : continue
+            C.logger.info(f"Node:{node}/{ch}[-80dBm] SEQ:{seq} MAC:{mac} [{time_s}] {templ_s/10} {humid_s/10} {batt_s/10} {rssi} {stat}")
+            sdata = {'node':node, 'date':time_s.strftime("%Y-%m-%d %H:%M:%S"), 'mac':mac, 'templ':templ_s/10, 'humid':humid_s/10, 'batt':batt_s/10, 'rssi':rssi, 'status':stat }
+    result['legacy'] = time.perf_counter() - start
+
+    ## decode_frame()
+    _MAC_CACHE.clear()
+    start = time.perf_counter()
+    for payload in payloads :
+        decode_frame(payload, -80)
+    result['struct'] = time.perf_counter() - start
+
+    ## NumPy（まとめてデコード）
+    if np != None :
+        _MAC_CACHE.clear()
+        buf = b''.join(payloads)
+        num = len(buf) // size
+        day_start, day_end = _day_range(datetime.date.today())
+        start = time.perf_counter()
+        decode_records_np(buf, np.full(num, -80), np.full(num, day_start), np.full(num, day_end))
+        result['numpy'] = time.perf_counter() - start
+    return result
+
+def selftest_pty( num=2, frames=3, timeout=10.0 ) -> bool :
+    """無線モジュールの代わりに擬似端末(pty)を使ってGatewayの複数モジュール受信を確認する
+    モジュール毎に担当Nodeからフレームを送信し、同じptyからACKが返ること、
+    全モジュールのデータが共有の書込スレッドで一時DATABASEに登録されることを確認する
+    Args:
+        num (int, optional): 無線モジュール数. 初期値 2.
+        frames (int, optional): Node毎の送信フレーム数. 初期値 3.
+        timeout (float, optional): ACK/登録待ちのタイムアウト（秒）. 初期値 10.0.
+    Returns:
+        bool: 成功 True
+    """
+    import select
+    import tempfile
+    import libSQLite
+
+    ## 一時DATABASE
+    tmpdir = tempfile.mkdtemp(prefix="sast_pty_")
+    libSQLite.DB_PATH = os.path.join(tmpdir, "pty.sqlite")
+    SQL("SETUP")
+
+    ## モジュール毎にptyを作成（slave側をGATEのUARTとして使う）
+    masters = list()
+    radios = list()
+    for i in range(num) :
+        master, slave = os.openpty()
+        masters.append(master)
+        radios.append({'port':os.ttyname(slave), 'channel':C.GATE_CHANNEL+i, 'node_channel':C.NODE_CHANNEL+i,
+                       'nodes':[i+1], 'beacon':':00'})
+    gate = Lora_GATE(radios=radios)
+
+    ok = True
+    ack_size = 3 + struct.calcsize(L_BEACON)
+    base = int(time.time()) - frames  # フレーム毎に計測時刻を変える（重複チェック対策）
+    for f in range(1, frames+1) :
+        for i, master in enumerate(masters) :
+            node = i + 1
+            data = data_pack(node, f, f'00:00:00:00:00:{node:02}', base+f, 20.0+f, 3.3, 80.0, 0, 0, ch=radios[i]['node_channel'])
+            ## アドレス部はモジュールで取り除かれ、末尾にRSSIが付加される
+            os.write(master, struct.pack(L_LEN, len(data)) + data + bytes([256-60-i]))
+
+            ## ACK待ち（Beaconも同じ長さなので種別で判定）
+            acked = False
+            buf = bytearray()
+            limit = time.time() + timeout
+            while not acked and time.time() < limit :
+                r, _, _ = select.select([master], [], [], 0.2)
+                if len(r) != 0 : buf += os.read(master, 256)
+                while len(buf) >= ack_size :
+                    msg = bytes(buf[:ack_size])
+                    buf = buf[ack_size:]
+                    code, seq, _ = struct.unpack(L_BEACON, msg[3:])
+                    addr = (msg[0] << 8) | msg[1]
+                    if chr(code) == 'A' and seq == f and addr == C.GATE_ADDR+node and msg[2] == radios[i]['node_channel'] :
+                        acked = True
+            print(f"[{gate.radios[i].name}] {radios[i]['port']} NODE{node:02} SEQ:{f} ACK:{'OK' if acked else 'NG'}")
+            ok &= acked
+
+    ## 担当外のNode（他のモジュールのNode）のフレームは登録もACKもしない
+    if num >= 2 :
+        node = 2
+        data = data_pack(node, 1, f'00:00:00:00:00:{node:02}', base, 20.0, 3.3, 80.0, 0, 0, ch=radios[0]['node_channel'])
+        os.write(masters[0], struct.pack(L_LEN, len(data)) + data + bytes([256-60]))
+        buf = bytearray()
+        limit = time.time() + 1.0
+        while time.time() < limit :
+            r, _, _ = select.select([masters[0]], [], [], 0.2)
+            if len(r) != 0 : buf += os.read(masters[0], 256)
+        acked = any( chr(buf[i+3]) == 'A' for i in range(0, len(buf) - ack_size + 1, ack_size) )
+        print(f"[{gate.radios[0].name}] NODE{node:02} not assigned ACK:{'SENT' if acked else 'NONE'}")
+        ok &= not acked
+
+    ## 書込スレッドの登録待ち
+    S = SQL()
+    count = 0
+    limit = time.time() + timeout
+    while time.time() < limit :
+        count = S.connection.execute("select count(*) from history").fetchone()[0]
+        if count >= num * frames : break
+        time.sleep(0.2)
+    print(f"history : {count}/{num*frames}")
+    ok &= ( count == num * frames )
+
+    for l in gate.link.snapshot() :
+        print(f" NODE{l['node']:02} frames:{l['frames']} acks:{l['acks']} rssi:{l['rssi']} rejected:{l['rejected']}")
+    for master in masters : os.close(master)
+    return ok
+
 def makeLoraADDR( addr, channel ) :
     ''' 固定アドレス送信時にアドレスデータを作成 addr, channelは16進'''
-    C.logger.debug(f"LORA_ADDR: 0x{addr:04x} - 0x{channel:02x}")
+    C.logger.debug("LORA_ADDR: 0x%04x - 0x%02x", addr, channel)
     t_addr = int(addr)
     t_addr_H = t_addr >> 8
     t_addr_L = t_addr & 0xFF
@@ -695,14 +1285,17 @@ def makeSendDataStream ( addr, channnel, data : list )  -> bytearray :
     # データ連結
     stream += (struct.pack(L_LEN, size))
     stream += buff
-    C.logger.debug(f"[makeSendDataStream] L_LEN({size} / DATA({len(data)} @ {struct.calcsize(L_DATA)})")
+    C.logger.debug("[makeSendDataStream] L_LEN(%d / DATA(%d @ %d)", size, len(data), DATA_STRUCT.size)
 
     return stream
 
 #### ------------------------------------------------------- main
 if __name__ == "__main__" :
     setupGPIO()
-    NODE_NO=M.getNodeNo()
+    try :
+        NODE_NO=M.getNodeNo()
+    except ValueError :
+        NODE_NO=-1  # SASTのホスト名以外（PTY/BENCHのみ実行可）
     args = sys.argv
 
     try :
@@ -721,16 +1314,20 @@ if __name__ == "__main__" :
                 C.logger.critical(f"ERROR This Machine NODE - {M.getHostname()}")
                 sys.exit(0)
             C.logger.info(f"--- GATEWAY --- {NODE_NO:02}")
-            C.logger.info(f"ADDR:{C.GATE_ADDR:#x}-{C.GATE_CHANNEL:02}")
             print("lilbLoRa.py -- START for GATE")
-            print(f"ADDR:{C.GATE_ADDR:#x}-{C.GATE_CHANNEL:02}")
+            for radio in C.GATE_RADIOS :
+                C.logger.info(f"ADDR:{C.GATE_ADDR:#x}-{radio['channel']:02} {radio['port']}")
+                print(f"ADDR:{C.GATE_ADDR:#x}-{radio['channel']:02} {radio['port']}")
 
             ## E220 LoRa Module init
             setMode(0)
             WaitAUX()
 
-            ## START UP Lora Thread
-            GATE = Lora_GATE()
+            ## START UP Lora Thread（引数でキャプチャファイルを指定可能）
+            capture = args[2] if len(args) >= 3 else C.CAPTURE_PATH
+            if capture != "" : print(f"capture > {capture}")
+            GATE = Lora_GATE(capture=capture)
+            Metrics.start("gateway")
 
             # 無限ループ（CTRL+CでInterrupt）
             while True:
@@ -738,13 +1335,14 @@ if __name__ == "__main__" :
 
         
         elif args[1].upper() == 'NODE' :
-            if NODE_NO == 0 : 
+            if NODE_NO <= 0 : 
                 C.logger.critical(f"ERROR!!! This HOST is GATEWAY - {M.getHostname()}")
                 sys.exit(0)
+            radio = C.radioForNode(NODE_NO)
             C.logger.info(f"--- NODE -- {NODE_NO:02}")
-            C.logger.info(f"ADDR:{(C.GATE_ADDR+NODE_NO):#x}-{C.NODE_CHANNEL:02}")
+            C.logger.info(f"ADDR:{(C.GATE_ADDR+NODE_NO):#x}-{radio['node_channel']:02} -> GATE CH:{radio['channel']:02}")
             print(f"lilbLoRa.py -- START for NODE{NODE_NO:02}")
-            print(f"ADDR:{(C.GATE_ADDR+NODE_NO):#x}-{C.NODE_CHANNEL:02}")
+            print(f"ADDR:{(C.GATE_ADDR+NODE_NO):#x}-{radio['node_channel']:02} -> GATE CH:{radio['channel']:02}")
 
             ## E220 LoRa Module init
             setMode(0)
@@ -752,11 +1350,31 @@ if __name__ == "__main__" :
 
             ## START UP Lora Thread
             NODE = Lora_NODE(NODE_NO)
+            Metrics.start("node")
 
             # 無限ループ（CTRL+CでInterrupt）
             while True:
                 time.sleep(10)
 
+        elif args[1].upper() == 'BENCH' :
+            frames = int(args[2]) if len(args) >= 3 else 2000
+            level = C.logger.level
+            C.logger.setLevel(logging.WARNING)  # ログ出力の時間は含めない
+            res = bench_decode(frames)
+            C.logger.setLevel(level)
+            print(f"decode benchmark : {res['records']} records")
+            for k in ['legacy', 'struct', 'numpy'] :
+                if k not in res : continue
+                print(f" {k:7} : {res[k]*1000:8.2f} msec  {res['records']/res[k]:10.0f} rec/sec  x{res['legacy']/res[k]:.2f}")
+            sys.exit(0)
+
+        elif args[1].upper() == 'PTY' :
+            ## 擬似端末で複数モジュールのGatewayを確認（実機不要）
+            num = int(args[2]) if len(args) >= 3 else 2
+            ret = selftest_pty(num)
+            print("PTY selftest " + ("OK" if ret else "NG"))
+            sys.exit(0 if ret else 1)
+
         elif args[1].upper() == 'AUX' :
             mode = 'HIGH' if GPIO.input(AUX_PIN) == 1 else 'LOW'
             C.logger.info(f"AUX pin is {mode}")
@@ -0,0 +1,378 @@
+#!/usr/bin/python3
+"""
+メトリクス（計測値）ライブラリ libMetrics.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+ログに散らばっていた処理時間・件数（Search time ... / [GAS] Response(...) time= など）を
+カウンター・ゲージ・ヒストグラムとしてプロセス内に集計し、Prometheus のテキスト形式で出力する。
+・出力は node_exporter の textfile collector 用ファイル（C.METRICS['DIR']/sast_<プログラム名>.prom）
+  と、ローカルのHTTP（C.METRICS['PORT'] 0は無効）
+・記録は加算・バケット探索（bisect）のみで、文字列の組み立ては出力時（C.METRICS['INTERVAL']秒毎）に行う
+・ラベル付きの値は labels() で子を取り出して保持しておくと、記録時にラベルの検索も不要
+
+使い方:
+    import libMetrics as Metrics
+    FRAMES = Metrics.counter("sast_lora_frames_total", "received frames", ("radio",))
+    FRAMES.labels(radio="R0").inc()
+    SQL_SEC = Metrics.histogram("sast_sql_seconds", "query duration", ("op",))
+    @Metrics.timed(SQL_SEC)          # 関数名を op ラベルにして処理時間を記録
+    def appendDataMany(...) : ...
+    with SQL_SEC.labels(op="x").time() : ...
+    Metrics.start("gateway")         # textfile の定期出力・HTTPの起動
+
+    ./libMetrics.py SHOW         動作確認（サンプルを記録して出力）
+    ./libMetrics.py BENCH [num]  記録1回あたりの処理時間
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import bisect
+import functools
+import http.server
+import os
+import threading
+import time
+
+## 秒単位の処理時間用バケット（Pi Zeroでの SQL 1ms 程度 〜 Cloud送信 数十秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
+
+def _fmt( v ) -> str :
+    ''' 内部関数：Prometheusの数値表記 '''
+    if v == float('inf') : return "+Inf"
+    if isinstance(v, float) and v.is_integer() : return str(int(v))
+    return repr(v)
+
+def _label_str( names:tuple, values:tuple, extra="" ) -> str :
+    ''' 内部関数：ラベルの表記 {a="x",b="y"} '''
+    pairs = [ f'{n}="{str(v)}"' for n, v in zip(names, values) ]
+    if extra != "" : pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) != 0 else ""
+
+
+class _Timer :
+    """ 処理時間の計測（with文 / デコレータ） """
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child) -> None:
+        self.child = child
+        self.start = 0.0
+
+    def __enter__(self) :
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool :
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _CounterChild :
+    """ カウンターの値（ラベル毎） """
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock) -> None:
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, n=1) -> None :
+        ''' n加算（減算はしない） '''
+        with self._lock : self.value += n
+
+
+class _GaugeChild :
+    """ ゲージの値（ラベル毎） """
+    __slots__ = ('value', '_lock')
+
+    def __init__(self, lock) -> None:
+        self.value = 0.0
+        self._lock = lock
+
+    def set(self, v) -> None :
+        self.value = v
+
+    def inc(self, n=1) -> None :
+        with self._lock : self.value += n
+
+    def dec(self, n=1) -> None :
+        with self._lock : self.value -= n
+
+
+class _HistogramChild :
+    """ ヒストグラムの値（ラベル毎） バケット毎の件数は累積せずに持ち、出力時に累積する """
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, lock, buckets:tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # 最後は +Inf
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, v:float) -> None :
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock :
+            self.counts[i] += 1
+            self.sum += v
+
+    def time(self) -> _Timer :
+        ''' with文で処理時間を記録 '''
+        return _Timer(self)
+
+
+class _Metric :
+    """ メトリクス（ラベルの組み合わせ毎に子を持つ） """
+    kind = ""
+
+    def __init__(self, name:str, doc:str, labelnames=()) -> None:
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if len(self.labelnames) == 0 : self._default = self.labels()
+
+    def _child(self) :
+        raise NotImplementedError
+
+    def labels(self, **kv) :
+        """ラベルの値に対応する子（記録用）を返す（無ければ作成）
+        Returns:
+            子: inc() / set() / observe() を持つ
+        """
+        key = tuple( kv[n] for n in self.labelnames )
+        child = self._children.get(key)
+        if child == None :
+            with self._lock :
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _samples(self) -> list :
+        ''' 内部関数：( ラベル値, 子 ) のlist '''
+        with self._lock :
+            return list(self._children.items())
+
+
+class Counter(_Metric) :
+    """ カウンター（増加のみ） """
+    kind = "counter"
+
+    def _child(self) :
+        return _CounterChild(self._lock)
+
+    def inc(self, n=1) -> None :
+        self._default.inc(n)
+
+    def render(self) -> list :
+        return [ f"{self.name}{_label_str(self.labelnames, k)} {_fmt(c.value)}" for k, c in self._samples() ]
+
+
+class Gauge(_Metric) :
+    """ ゲージ（現在値） """
+    kind = "gauge"
+
+    def _child(self) :
+        return _GaugeChild(self._lock)
+
+    def set(self, v) -> None :
+        self._default.set(v)
+
+    def inc(self, n=1) -> None :
+        self._default.inc(n)
+
+    def dec(self, n=1) -> None :
+        self._default.dec(n)
+
+    def render(self) -> list :
+        return [ f"{self.name}{_label_str(self.labelnames, k)} {_fmt(c.value)}" for k, c in self._samples() ]
+
+
+class Histogram(_Metric) :
+    """ ヒストグラム（処理時間・サイズの分布） """
+    kind = "histogram"
+
+    def __init__(self, name:str, doc:str, labelnames=(), buckets=DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _child(self) :
+        return _HistogramChild(self._lock, self.buckets)
+
+    def observe(self, v:float) -> None :
+        self._default.observe(v)
+
+    def time(self) -> _Timer :
+        return _Timer(self._default)
+
+    def render(self) -> list :
+        lines = list()
+        for k, c in self._samples() :
+            with self._lock :
+                counts, total = list(c.counts), c.sum
+            acc = 0
+            for le, n in zip(self.buckets + (float('inf'),), counts) :
+                acc += n
+                le_str = 'le="' + _fmt(float(le)) + '"'
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames, k, le_str)} {acc}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, k)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, k)} {acc}")
+        return lines
+
+
+class Registry :
+    """ メトリクスの登録先（プロセスで1つ） """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric:_Metric) -> _Metric :
+        ''' 登録（同じ名前が登録済ならそちらを返す） '''
+        with self._lock :
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str :
+        """ Prometheus のテキスト形式（exposition format）
+        Returns:
+            str: 全メトリクス
+        """
+        with self._lock :
+            metrics = list(self._metrics.values())
+        lines = list()
+        for m in metrics :
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+def counter( name:str, doc:str, labelnames=() ) -> Counter :
+    ''' カウンターを作成（登録済なら登録済のもの） '''
+    return REGISTRY.register(Counter(name, doc, labelnames))
+
+def gauge( name:str, doc:str, labelnames=() ) -> Gauge :
+    ''' ゲージを作成（登録済なら登録済のもの） '''
+    return REGISTRY.register(Gauge(name, doc, labelnames))
+
+def histogram( name:str, doc:str, labelnames=(), buckets=DEFAULT_BUCKETS ) -> Histogram :
+    ''' ヒストグラムを作成（登録済なら登録済のもの） '''
+    return REGISTRY.register(Histogram(name, doc, labelnames, buckets))
+
+def timed( hist:Histogram, label="op" ) :
+    """関数の処理時間を記録するデコレータ（関数名を label のラベル値にする）
+    Args:
+        hist (Histogram): ラベル label を1つ持つヒストグラム
+        label (str, optional): ラベル名. 初期値 "op".
+    """
+    def deco( func ) :
+        child = hist.labels(**{label:func.__name__})
+        @functools.wraps(func)
+        def wrapper( *args, **kwargs ) :
+            start = time.perf_counter()
+            try :
+                return func(*args, **kwargs)
+            finally :
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return deco
+
+
+## --- 出力
+UP = gauge("sast_start_time_seconds", "process start time (unix time)")
+UP.set(time.time())
+
+def write_textfile( path:str ) -> bool :
+    """textfile collector 用のファイルを出力（一時ファイルに書いてから置き換える）
+    Args:
+        path (str): 出力ファイル
+    Returns:
+        bool: True 成功
+    """
+    try :
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f :
+            f.write(REGISTRY.render())
+        os.replace(tmp, path)
+        return True
+    except OSError as e :
+        C.logger.warning(f"[metrics] write {path} Error:{e}")
+        return False
+
+
+class _Handler(http.server.BaseHTTPRequestHandler) :
+    """ GET /metrics で出力 """
+    def do_GET(self) :
+        if self.path.split('?')[0] not in ("/", "/metrics") :
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) :
+        pass
+
+
+_started = None
+
+def start( prog:str, background=True ) -> None :
+    """出力を開始（textfile を C.METRICS['INTERVAL'] 秒毎に出力、PORT指定時はHTTPで公開）
+    共有のRuntime（libRuntime）に登録する。プロセスで1回だけ有効
+    Args:
+        prog (str): プログラム名（出力ファイル名 sast_<prog>.prom）
+        background (bool, optional): 共有のRuntimeをバックグラウンドで起動する
+                                     （呼び出し元が後で R.run() する場合は False）. 初期値 True.
+    """
+    global _started
+    if _started != None : return
+    _started = prog
+    conf = C.METRICS
+    if conf['DIR'] != "" :
+        import libRuntime as RT
+        path = os.path.join(conf['DIR'], f"sast_{prog}.prom")
+        R = RT.runtime()
+        R.every(conf['INTERVAL'], lambda: write_textfile(path), name="metrics")
+        if background : R.start()
+        C.logger.info(f"[metrics] textfile {path} every {conf['INTERVAL']}sec")
+    if conf['PORT'] != 0 :
+        try :
+            srv = http.server.ThreadingHTTPServer(("127.0.0.1", conf['PORT']), _Handler)
+        except OSError as e :
+            C.logger.error(f"[metrics] HTTP port {conf['PORT']} Error:{e}")
+            return
+        threading.Thread(target=srv.serve_forever, name="Metrics", daemon=True).start()
+        C.logger.info(f"[metrics] http://127.0.0.1:{conf['PORT']}/metrics")
+
+
+if __name__ == '__main__' :
+    import sys
+    args = sys.argv
+    if len(args) != 1 and args[1].upper() == 'SHOW' :
+        c = counter("sast_demo_total", "demo counter", ("kind",))
+        c.labels(kind="a").inc()
+        c.labels(kind="b").inc(3)
+        h = histogram("sast_demo_seconds", "demo histogram")
+        for v in (0.0005, 0.02, 0.3, 2.0) : h.observe(v)
+        with h.time() : time.sleep(0.01)
+        print(REGISTRY.render(), end="")
+        sys.exit(0)
+    if len(args) != 1 and args[1].upper() == 'BENCH' :
+        num = int(args[2]) if len(args) >= 3 else 100000
+        c = counter("sast_bench_total", "bench")
+        h = histogram("sast_bench_seconds", "bench", ("op",)).labels(op="x")
+        for name, func in (("counter.inc", lambda: c.inc()), ("histogram.observe", lambda: h.observe(0.003))) :
+            start = time.perf_counter()
+            for i in range(num) : func()
+            print(f" {name:18} : {(time.perf_counter() - start) / num * 1e6:.2f} usec")
+        start = time.perf_counter()
+        for i in range(num) :
+            with h.time() : pass
+        print(f" {'with time()':18} : {(time.perf_counter() - start) / num * 1e6:.2f} usec")
+        sys.exit(0)
+    print("usage: libMetrics.py SHOW|BENCH [num]")
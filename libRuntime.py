@@ -0,0 +1,245 @@
+#!/usr/bin/python3
+"""
+定周期実行ライブラリ libRuntime.py
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Summary:
+schedule の run_pending() + sleep(1) のポーリングの代わりに asyncio のイベントループで定周期処理を実行する。
+・ジョブ毎に独立したタスクで実行（長い _send_cloud が他のジョブを遅らせない）
+・実行時刻は単調時計（loop.time()）の期限で管理（ポーリングの±1秒の揺らぎ・時刻変更の影響なし）
+  最初の実行時刻のみ時計（UNIX時間）に合わせる（毎分SS秒、毎日HH:MM など）
+・ブロッキングする関数はスレッドプール（executor）で実行、コルーチン関数はループで実行
+・前回の実行が終わっていない時刻は実行しない（overrun として記録）
+・timeout 秒を超えたら待つのをやめる（コルーチンはキャンセル、スレッドは終了まで次の実行をしない）
+・ジョブで sys.exit() された場合はループを止めて run() から SystemExit を送出
+
+使い方:
+    import libRuntime as RT
+    R = RT.runtime()
+    R.every(120, _send_cloud, name="send_cloud")          # 2分毎（毎偶数分 00秒）
+    R.every(60, _send_beacon, offset=10, name="beacon")  # 毎分10秒
+    R.daily("08:15", _checkBattery, name="battery")       # 毎日 8:15
+    R.run()        # メインスレッドで実行（戻らない）
+    R.start()      # バックグラウンドのスレッドで実行
+
+SEMI-IT Agriculture Support TOOLs V3
+"""
+
+import config as C
+import asyncio
+import concurrent.futures
+import datetime
+import threading
+import time
+
+DAY = 86400
+
+
+class Job :
+    """ 定周期ジョブ
+    Summary: 周期・最初の実行時刻・実行統計を持つ。
+    """
+    def __init__(self, name:str, func, interval:float, offset:float, daily:bool, timeout) -> None:
+        """
+        Args:
+            name (str): ジョブ名（ログ用）
+            func (callable): 実行する関数（引数なし）またはコルーチン関数
+            interval (float): 周期（秒）
+            offset (float): 周期内の実行時刻（秒）
+            daily (bool): 毎日指定時刻（ローカル時刻）で実行する
+            timeout (float): 待つ時間の上限（秒） Noneは周期
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.daily = daily
+        self.timeout = timeout if timeout != None else interval
+        self.running = None     # 実行中のfuture
+        self.stats = {'runs':0, 'overrun':0, 'timeout':0, 'error':0, 'max':0.0, 'late':0.0, 'last':""}
+
+    def first(self, now:float) -> float :
+        ''' 最初の実行時刻（UNIX時間） '''
+        if self.daily :
+            ## ローカル時刻の 00:00 からの offset秒
+            d = datetime.datetime.fromtimestamp(now)
+            base = d.replace(hour=0, minute=0, second=0, microsecond=0).timestamp() + self.offset
+            return base if base > now else base + DAY
+        n = (now - self.offset) // self.interval + 1
+        return n * self.interval + self.offset
+
+
+class Runtime :
+    """ asyncio 定周期実行
+    Summary: every()/daily() で登録したジョブを run() / start() で実行する。
+    """
+    def __init__(self, workers=C.RUNTIME_WORKERS) -> None:
+        """
+        Args:
+            workers (int, optional): ブロッキング関数を実行するスレッド数. 初期値 C.RUNTIME_WORKERS.
+        """
+        self.jobs = list()
+        self.loop = None
+        self.thread = None
+        self.exit = None
+        self.stopped = None
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Runtime")
+
+    def every(self, interval:float, func, offset=0.0, name=None, timeout=None) -> Job :
+        """周期実行するジョブを登録（UNIX時間が interval の倍数 + offset 秒の時刻に実行）
+        Args:
+            interval (float): 周期（秒）
+            func (callable): 実行する関数（引数なし）またはコルーチン関数
+            offset (float, optional): 周期内の実行時刻（秒）. 初期値 0.0.
+            name (str, optional): ジョブ名（Noneは関数名）. 初期値 None.
+            timeout (float, optional): 待つ時間の上限（秒 Noneは周期）. 初期値 None.
+        Returns:
+            Job: 登録したジョブ
+        """
+        job = Job(name or func.__name__, func, interval, offset % interval, False, timeout)
+        return self._add(job)
+
+    def daily(self, at:str, func, name=None, timeout=None) -> Job :
+        """毎日指定時刻に実行するジョブを登録
+        Args:
+            at (str): 時刻 HH:MM または HH:MM:SS（ローカル時刻）
+            func (callable): 実行する関数（引数なし）またはコルーチン関数
+            name (str, optional): ジョブ名（Noneは関数名）. 初期値 None.
+            timeout (float, optional): 待つ時間の上限（秒 Noneは1時間）. 初期値 None.
+        Returns:
+            Job: 登録したジョブ
+        """
+        t = [ int(v) for v in at.split(':') ] + [0]
+        job = Job(name or func.__name__, func, DAY, t[0] * 3600 + t[1] * 60 + t[2], True, timeout or 3600)
+        return self._add(job)
+
+    def _add(self, job:Job) -> Job :
+        ''' 内部関数：ジョブを登録（実行中ならタスクを起動） '''
+        with self.lock :
+            self.jobs.append(job)
+            loop = self.loop
+        C.logger.info(f"[runtime] {job.name} every {job.interval}sec offset {job.offset}sec")
+        if loop != None : loop.call_soon_threadsafe(self._spawn, job)
+        return job
+
+    def _spawn(self, job:Job) -> None :
+        ''' 内部関数：ジョブのタスクを起動（ループのスレッドで実行） '''
+        self.loop.create_task(self._job_loop(job), name=job.name)
+
+    async def _job_loop(self, job:Job) -> None :
+        ''' 内部関数：ジョブ毎のタスク 期限（単調時計）まで待って実行 '''
+        loop = asyncio.get_running_loop()
+        wall = job.first(time.time())
+        due = loop.time() + (wall - time.time())
+        while True :
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            late = loop.time() - due
+            if job.running != None and not job.running.done() :
+                ## 前回の実行が終わっていない
+                job.stats['overrun'] += 1
+                C.logger.warning(f"[runtime] {job.name} overrun ... skip")
+            else :
+                job.stats['late'] = max(job.stats['late'], late)
+                job.running = asyncio.ensure_future(self._execute(job))
+            if job.daily :
+                ## 日毎は時計に合わせ直す（時刻変更に追従）
+                wall = job.first(time.time() + 1)
+                due = loop.time() + (wall - time.time())
+            else :
+                due += job.interval
+                if due < loop.time() : due += (loop.time() - due) // job.interval * job.interval + job.interval
+
+    async def _execute(self, job:Job) -> None :
+        ''' 内部関数：ジョブを1回実行（timeoutを超えたら待つのをやめる） '''
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        job.stats['last'] = C.getTimeSTR()
+        if asyncio.iscoroutinefunction(job.func) :
+            fut = asyncio.ensure_future(job.func())
+        else :
+            fut = loop.run_in_executor(self.executor, job.func)
+        try :
+            await asyncio.wait_for(asyncio.shield(fut), job.timeout)
+        except asyncio.TimeoutError :
+            job.stats['timeout'] += 1
+            if asyncio.iscoroutinefunction(job.func) :
+                fut.cancel()
+                C.logger.error(f"[runtime] {job.name} timeout {job.timeout}sec ... cancel")
+            else :
+                C.logger.error(f"[runtime] {job.name} timeout {job.timeout}sec ... wait for the thread")
+                job.running = fut   # スレッドが終わるまで次の実行をしない
+            return
+        except SystemExit as e :
+            C.logger.warning(f"[runtime] {job.name} exit ({e.code})")
+            self.exit = e
+            self.stop()
+            return
+        except Exception as e :
+            job.stats['error'] += 1
+            C.logger.error(f"[runtime] {job.name} Exception:{e}")
+        finally :
+            job.stats['runs'] += 1
+        job.stats['max'] = max(job.stats['max'], loop.time() - start)
+
+    async def _main(self) -> None :
+        ''' 内部関数：全ジョブのタスクを起動して停止まで待つ '''
+        with self.lock :
+            self.loop = asyncio.get_running_loop()
+            self.stopped = asyncio.Event()
+            jobs = list(self.jobs)
+        for job in jobs : self._spawn(job)
+        await self.stopped.wait()
+
+    def run(self) -> None :
+        ''' 呼び出したスレッドでイベントループを実行（stop()まで戻らない） '''
+        try :
+            asyncio.run(self._main())
+        finally :
+            with self.lock : self.loop = None
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.exit != None : raise self.exit
+
+    def start(self) -> None :
+        ''' バックグラウンドのスレッドでイベントループを実行（起動済みなら何もしない） '''
+        with self.lock :
+            if self.thread != None : return
+            self.thread = threading.Thread(target=self.run, name="Runtime", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None :
+        ''' イベントループを停止（どのスレッドからでも可） '''
+        with self.lock :
+            loop = self.loop
+        if loop != None : loop.call_soon_threadsafe(self.stopped.set)
+
+    def stats(self) -> dict :
+        """ジョブ毎の実行統計
+        Returns:
+            dict: { name: {'runs','overrun','timeout','error','max','late','last'} }  max/lateは秒
+        """
+        return { job.name:dict(job.stats) for job in self.jobs }
+
+
+_runtime = None
+_lock = threading.Lock()
+
+def runtime() -> Runtime :
+    ''' 共有のRuntime（プロセスで1つ、最初の呼び出しで作成） '''
+    global _runtime
+    with _lock :
+        if _runtime == None : _runtime = Runtime()
+        return _runtime
+
+
+if __name__ == '__main__' :
+    import sys
+    ## 動作確認：周期ジョブの実行時刻の揺らぎと overrun を表示する
+    sec = int(sys.argv[1]) if len(sys.argv) >= 2 else 30
+    R = runtime()
+    R.every(2, lambda: print(f"fast  {time.time():.3f}"), name="fast")
+    R.every(5, lambda: time.sleep(7), name="slow")
+    R.every(sec, R.stop, offset=time.time(), name="stop")
+    R.run()
+    for name, st in R.stats().items() :
+        print(f"{name:6} runs:{st['runs']} overrun:{st['overrun']} timeout:{st['timeout']} error:{st['error']} max:{st['max']:.3f}sec late:{st['late']*1000:.1f}msec")
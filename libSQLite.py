@@ -26,9 +26,135 @@ import sqlite3
 import sys
 import json
 import datetime
+import time
 from enum import IntEnum
+import libMetrics as Metrics
+
+try :
+    import numpy as np
+except ImportError :
+    np = None
 DB_PATH = './sql_sastv3.sqlite'
 
+## sensor_state（センサー毎の最新状態）の列と、history登録と同じトランザクションで行う更新
+#  古い日時のデータ（再送・再生）では更新しない。batt・batt_date は電池の値が有るデータのみ更新
+#  samples は day（YYYY-MM-DD）の件数で、日付が変われば1から数え直す
+STATE_KEYS = ('mac', 'node', 'date', 'templ', 'humid', 'batt', 'rssi', 'ext', 'status')
+STATE_UPSERT = ("INSERT INTO sensor_state (mac, node, date, templ, humid, batt, rssi, ext, status, batt_date, day, samples) "
+                "VALUES (:mac, :node, :date, :templ, :humid, :batt, :rssi, :ext, :status, "
+                "CASE WHEN :batt IS NULL THEN NULL ELSE :date END, substr(:date, 1, 10), 1) "
+                "ON CONFLICT(mac) DO UPDATE SET node=excluded.node, date=excluded.date, templ=excluded.templ, "
+                "humid=excluded.humid, rssi=excluded.rssi, ext=coalesce(excluded.ext, sensor_state.ext), "
+                "status=coalesce(excluded.status, sensor_state.status), "
+                "batt=coalesce(excluded.batt, sensor_state.batt), batt_date=coalesce(excluded.batt_date, sensor_state.batt_date), "
+                "samples=CASE WHEN sensor_state.day = excluded.day THEN sensor_state.samples + 1 ELSE 1 END, day=excluded.day "
+                "WHERE excluded.date >= sensor_state.date")
+
+## batt_fit（電池残量の最小二乗回帰の累積和）の更新  x:t0からの経過日数 y:電池残量(%)
+#  n, Σx, Σy, Σx², Σxy を加算するだけで履歴は再検索しない。電池が JUMP 以上増えたら交換とみなして t0 からやり直す
+_JUMP = "excluded.batt >= batt_fit.batt + %f" % C.BATT_FIT['JUMP']
+_X = "(julianday(excluded.date) - julianday(batt_fit.t0))"
+BATT_FIT_UPSERT = ("INSERT INTO batt_fit (mac, t0, n, sx, sy, sxx, sxy, batt, date) VALUES (:mac, :date, 1, 0, :batt, 0, 0, :batt, :date) "
+                   f"ON CONFLICT(mac) DO UPDATE SET t0=CASE WHEN {_JUMP} THEN excluded.date ELSE batt_fit.t0 END, "
+                   f"n=CASE WHEN {_JUMP} THEN 1 ELSE batt_fit.n + 1 END, "
+                   f"sx=CASE WHEN {_JUMP} THEN 0 ELSE batt_fit.sx + {_X} END, "
+                   f"sy=CASE WHEN {_JUMP} THEN excluded.batt ELSE batt_fit.sy + excluded.batt END, "
+                   f"sxx=CASE WHEN {_JUMP} THEN 0 ELSE batt_fit.sxx + {_X} * {_X} END, "
+                   f"sxy=CASE WHEN {_JUMP} THEN 0 ELSE batt_fit.sxy + {_X} * excluded.batt END, "
+                   "batt=excluded.batt, date=excluded.date "
+                   "WHERE excluded.date > batt_fit.date")
+
+## sensor_trend（センサー毎の温度の傾向 O(1)の状態）の更新  dt:前回からの経過(分)
+#  ewma  : 温度の指数移動平均  (ewma・TAU + 温度・dt) / (TAU + dt)
+#  slope : 上昇率(℃/分)の指数移動平均  (slope・SLOPE_TAU + 温度の差) / (SLOPE_TAU + dt)
+#  stuck : 温度・湿度が前回と同じだった回数（stuck_date から同じ値）  GAP 以上空いたら ewma・slope はやり直す
+_DT = "((julianday(excluded.date) - julianday(sensor_trend.date)) * 1440)"
+_GAP = f"{_DT} > {C.TREND['GAP']:f}"
+_SAME = "(excluded.templ = sensor_trend.templ AND excluded.humid IS sensor_trend.humid)"
+TREND_UPSERT = ("INSERT INTO sensor_trend (mac, date, templ, humid, ewma, slope, n, stuck, stuck_date) "
+                "VALUES (:mac, :date, :templ, :humid, :templ, 0, 1, 0, :date) "
+                f"ON CONFLICT(mac) DO UPDATE SET "
+                f"ewma=CASE WHEN {_GAP} THEN excluded.templ ELSE (sensor_trend.ewma * {C.TREND['TAU']:f} + excluded.templ * {_DT}) / ({C.TREND['TAU']:f} + {_DT}) END, "
+                f"slope=CASE WHEN {_GAP} THEN 0 ELSE (sensor_trend.slope * {C.TREND['SLOPE_TAU']:f} + excluded.templ - sensor_trend.templ) / ({C.TREND['SLOPE_TAU']:f} + {_DT}) END, "
+                f"n=CASE WHEN {_GAP} THEN 1 ELSE sensor_trend.n + 1 END, "
+                f"stuck=CASE WHEN {_SAME} THEN sensor_trend.stuck + 1 ELSE 0 END, "
+                f"stuck_date=CASE WHEN {_SAME} THEN sensor_trend.stuck_date ELSE excluded.date END, "
+                "templ=excluded.templ, humid=excluded.humid, date=excluded.date "
+                "WHERE excluded.date > sensor_trend.date")
+
+def _trend_rows( datas:list ) -> list :
+    ''' 内部関数：sensor_trendを更新する行（温度の無い行・Nodeは除く） '''
+    return [ {'mac':d['mac'], 'date':d['date'], 'templ':d['templ'], 'humid':d.get('humid')}
+             for d in datas if d.get('templ') != None and not d['mac'].startswith('00:00:00') ]
+
+def battForecast( fit:dict, replace=C.BATT_FIT['REPLACE'], min_days=C.BATT_FIT['MIN_DAYS'] ) -> dict :
+    """batt_fitの累積和から電池の交換日を予測（y = a + b・x の最小二乗）
+    Args:
+        fit (dict): batt_fitの行 {'t0','n','sx','sy','sxx','sxy','batt','date'}
+        replace (float, optional): 交換と判断する電池残量(%). 初期値 C.BATT_FIT['REPLACE'].
+        min_days (float, optional): 予測に必要な計測期間（日）. 初期値 C.BATT_FIT['MIN_DAYS'].
+    Returns:
+        dict: {'slope':1日の減少量(%/日), 'date':交換予定日(YYYY-MM-DD), 'days':交換までの日数}
+              予測できない（期間が短い・減っていない）場合は date, days が None
+    """
+    res = {'slope':None, 'date':None, 'days':None}
+    n = fit['n']
+    if n < 2 : return res
+    var = n * fit['sxx'] - fit['sx'] ** 2
+    t0 = C.str2Datetime(fit['t0'])
+    span = (C.str2Datetime(fit['date']) - t0).total_seconds() / 86400
+    if var <= 0 or span < min_days : return res
+    slope = (n * fit['sxy'] - fit['sx'] * fit['sy']) / var
+    res['slope'] = -slope
+    if slope >= 0 : return res
+    intercept = (fit['sy'] - slope * fit['sx']) / n
+    x = (replace - intercept) / slope     # t0から交換残量になるまでの日数
+    at = t0 + datetime.timedelta(days=x)
+    res['date'] = at.strftime("%Y-%m-%d")
+    res['days'] = max(0, (at.date() - datetime.date.today()).days)
+    return res
+
+def _state_row( data:dict ) -> dict :
+    ''' 内部関数：sensor_state更新用のパラメータ（無いキーはNULL） '''
+    return { k:data.get(k) for k in STATE_KEYS }
+
+## 集計（aggregate）で使える列と、時間毎の集計表（rollup_hour）にある列
+AGG_COLUMNS = ('templ', 'humid', 'batt', 'rssi')
+ROLLUP_COLUMNS = ('templ', 'humid')
+AGG_FETCH = 4096    # 1回に読み込む行数（全件をメモリに読み込まない）
+
+def _percentiles( values:list, ps:tuple ) -> list :
+    ''' 内部関数：パーセンタイル（線形補間 NumPyがあれば numpy.percentile） '''
+    if np != None : return [ float(v) for v in np.percentile(values, ps) ]
+    s = sorted(values)
+    ret = list()
+    for p in ps :
+        k = (len(s) - 1) * p / 100
+        i = int(k)
+        ret.append(s[i] if i + 1 >= len(s) else s[i] + (s[i + 1] - s[i]) * (k - i))
+    return ret
+
+def _merge_agg( acc:dict, key, n, total, vmin, vmax ) -> None :
+    ''' 内部関数：集計の途中結果（件数・合計・最小・最大）を合算 '''
+    a = acc.get(key)
+    if a == None :
+        acc[key] = {'n':n, 'sum':total, 'min':vmin, 'max':vmax}
+        return
+    a['n'] += n
+    a['sum'] += total
+    a['min'] = min(a['min'], vmin)
+    a['max'] = max(a['max'], vmax)
+
+## クエリの処理時間（メソッド名を op ラベルにする）
+M_QUERY_SEC = Metrics.histogram("sast_sql_seconds", "query duration by SQL method", ("op",))
+
+def _conf_value( value ) :
+    ''' 内部関数：confの比較用の値（GASのJSONとSQLiteで型が違っても同じ値は同じにする） '''
+    if value == None : return None
+    if isinstance(value, bool) : return str(int(value))
+    if isinstance(value, float) and value.is_integer() : return str(int(value))
+    return str(value)
+
 class SQL:
     connection = None
 
@@ -58,15 +184,24 @@ class SQL:
             c.execute("DROP TABLE IF EXISTS status")
             c.execute("DROP TABLE IF EXISTS conf")
             c.execute("DROP TABLE IF EXISTS conf_date")
+            c.execute("DROP TABLE IF EXISTS node_link")
+            c.execute("DROP TABLE IF EXISTS outbox")
+            c.execute("DROP TABLE IF EXISTS sensor_state")
+            c.execute("DROP TABLE IF EXISTS batt_fit")
+            c.execute("DROP TABLE IF EXISTS rollup_hour")
+            c.execute("DROP TABLE IF EXISTS rollup_mark")
+            c.execute("DROP TABLE IF EXISTS sensor_trend")
             c.connection.commit()
 
         elif mode.upper() == "STARTUP_NODE" :
             C.logger.warning("[createTables] STARTUP_NODE .... ")
+            self.createExtendTables()
             self.initLatest()
             return
 
         elif mode.upper() == "STARTUP_GATE" :
             C.logger.warning("[createTables] STARTUP_GATE ....") 
+            self.createExtendTables()
             self.initLatest()
             self._rebuildNotify()
             return 
@@ -88,9 +223,72 @@ class SQL:
         # 確定
         c.connection.commit()
 
+        # 追加テーブル
+        self.createExtendTables()
+
         # ステータス初期化
         self.changeNodeStatus()
 
+    def createExtendTables(self) :
+        """V3.1以降で追加したテーブルを作成（既存のDATABASEにも追加できるよう IF NOT EXISTS）
+        """
+        c = self.connection.cursor()
+        try :
+            # node_link（Gatewayのリンク統計スナップショット）
+            c.execute("CREATE TABLE IF NOT EXISTS node_link ( node INTEGER NOT NULL, last_seq INTEGER, frames INTEGER, gaps INTEGER, loss REAL, rssi REAL, last_seen TEXT, acks INTEGER, rejected INTEGER, PRIMARY KEY(node))")
+            # outbox（Cloud送信待ち 送信先毎の配信状態）
+            c.execute("CREATE TABLE IF NOT EXISTS outbox ( id INTEGER UNIQUE, sink TEXT NOT NULL, key TEXT, payload TEXT, created TEXT, state INTEGER, attempts INTEGER, next_try REAL, sent TEXT, last_error TEXT, PRIMARY KEY(id AUTOINCREMENT))")
+            c.execute("CREATE INDEX IF NOT EXISTS outbox_state ON outbox ( sink, state, next_try )")
+            # conf_date に設定内容のハッシュを追加
+            c.execute("PRAGMA table_info(conf_date)")
+            cols = [ r[1] for r in c.fetchall() ]
+            if len(cols) != 0 and 'hash' not in cols :
+                c.execute("ALTER TABLE conf_date ADD COLUMN hash TEXT")
+            # history の センサー・日時 の索引（集計 aggregate()・sensor_stateの初期値で使用）
+            c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='history'")
+            if c.fetchone()[0] != 0 :
+                c.execute("CREATE INDEX IF NOT EXISTS history_mac_date ON history ( mac, date )")
+            # sensor_state（センサー毎の最新状態 history登録時に更新）
+            c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='sensor_state'")
+            new_state = c.fetchone()[0] == 0
+            c.execute("CREATE TABLE IF NOT EXISTS sensor_state ( mac TEXT NOT NULL, node INTEGER, date TEXT, templ REAL, humid REAL, batt REAL, rssi INTEGER, ext INTEGER, status INTEGER, batt_date TEXT, day TEXT, samples INTEGER, PRIMARY KEY(mac))")
+            if new_state : self._seedSensorState(c)
+            # batt_fit（電池残量の回帰の累積和 history登録時に更新）
+            c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='batt_fit'")
+            new_fit = c.fetchone()[0] == 0
+            c.execute("CREATE TABLE IF NOT EXISTS batt_fit ( mac TEXT NOT NULL, t0 TEXT, n INTEGER, sx REAL, sy REAL, sxx REAL, sxy REAL, batt REAL, date TEXT, PRIMARY KEY(mac))")
+            if new_fit : self._seedBattFit(c)
+            # sensor_trend（温度の傾向 history登録時に更新 数回の計測で決まるのでhistoryからは作らない）
+            c.execute("CREATE TABLE IF NOT EXISTS sensor_trend ( mac TEXT NOT NULL, date TEXT, templ REAL, humid REAL, ewma REAL, slope REAL, n INTEGER, stuck INTEGER, stuck_date TEXT, PRIMARY KEY(mac))")
+            # rollup_hour（historyの1時間毎の集計 rollupHistory() で更新）
+            c.execute("CREATE TABLE IF NOT EXISTS rollup_hour ( mac TEXT NOT NULL, hour TEXT NOT NULL, n INTEGER, templ_n INTEGER, templ_sum REAL, templ_min REAL, templ_max REAL, humid_n INTEGER, humid_sum REAL, humid_min REAL, humid_max REAL, PRIMARY KEY(mac, hour))")
+            # rollup_mark（rollupHistory() で集計済の historyのid と 集計済の時間（この時間より前））
+            c.execute("CREATE TABLE IF NOT EXISTS rollup_mark ( id INTEGER NOT NULL, last_id INTEGER, hour TEXT, PRIMARY KEY(id))")
+            c.connection.commit()
+        except sqlite3.Error as e :
+            C.logger.error(f"[createExtendTables] {e}")
+
+
+    def _seedSensorState( self, c ) :
+        ''' 内部関数：sensor_stateを作成した時に既存のhistoryから初期値を登録（1回のみ） '''
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='history'")
+        if c.fetchone()[0] == 0 : return
+        # max(date) の集計では同じ行の他の列が返る（SQLite）
+        c.execute("INSERT OR IGNORE INTO sensor_state (mac, node, date, templ, humid, batt, rssi, ext, status, batt_date, day, samples) "
+                  "SELECT mac, node, max(date), templ, humid, NULL, rssi, ext, status, NULL, substr(date, 1, 10), 0 FROM history GROUP BY mac")
+        # 電池残量は電池残量のある最新の行から（最新の行の電池残量がNULLでも日時を入れない）
+        c.execute("UPDATE sensor_state SET (batt, batt_date)=(SELECT batt, max(date) FROM history h WHERE h.mac=sensor_state.mac AND h.batt IS NOT NULL)")
+        c.execute("UPDATE sensor_state SET samples=(SELECT count(*) FROM history h WHERE h.mac=sensor_state.mac AND h.date>=sensor_state.day)")
+        C.logger.info(f"[createExtendTables] sensor_state from history {c.rowcount}")
+
+    def _seedBattFit( self, c ) :
+        ''' 内部関数：batt_fitを作成した時に既存のhistoryを順に加算（1回のみ 読みながら登録する） '''
+        c.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='history'")
+        if c.fetchone()[0] == 0 : return
+        rows = self.connection.cursor()
+        rows.execute("SELECT mac, date, batt FROM history WHERE batt IS NOT NULL ORDER BY mac, date")
+        c.executemany(BATT_FIT_UPSERT, ( {'mac':r[0], 'date':r[1], 'batt':r[2]} for r in rows ))
+        C.logger.info(f"[createExtendTables] batt_fit from history")
 
     def initNotify( self ) :
         """Notifyテーブルを初期化する """
@@ -172,6 +370,7 @@ class SQL:
 
     def isArriveNode( self, node ) :
         """ 指定したNOodeの応答があったか（10分以内）
+            node_linkのスナップショットがあればそれを参照し、無い場合はsensor_stateを参照する
 
         Args:
             node (int): Node番号
@@ -180,12 +379,20 @@ class SQL:
         ## 10分前の時刻を計算→文字列に変更
         span = datetime.datetime.now()-datetime.timedelta(minutes=10)
         span_str = span.strftime("%Y-%m-%d %H:%M:%S")
-        query = f"SELECT count( distinct mac) from history where date>'{span_str}' and mac='00:00:00:00:00:{node:02}'"
         c = self.connection.cursor()
+        try :
+            c.execute(f"SELECT last_seen from node_link where node={node}")
+            ret = c.fetchone()
+            if ret != None and ret[0] != None :
+                return ret[0] > span_str
+        except sqlite3.Error as e :
+            C.logger.debug(f"[isArriveNode] node_link {e}")
+
+        query = f"SELECT date from sensor_state where mac='00:00:00:00:00:{node:02}'"
         try :
             c.execute(query)
             ret = c.fetchone()
-            return True if ret != None else False
+            return True if ret != None and ret[0] != None and ret[0] > span_str else False
                
         except sqlite3.Error as e :
             C.logger.error(f"[isArriveNode] {e}")
@@ -194,6 +401,7 @@ class SQL:
 
     def numSensorsMe(self) :
         """ Node向け。過去1時間で検知したセンサーの個数を返す（全体数）
+            sensor_state の最終受信日時で数える（historyは検索しない）
         Returns:
             num(int): センサー個数
         """
@@ -201,7 +409,7 @@ class SQL:
         ## 1時間前の時刻を計算→文字列に変更
         span = datetime.datetime.now()-datetime.timedelta(hours=1)
         span_str = span.strftime("%Y-%m-%d %H:%M:%S")
-        query = f"SELECT count( distinct mac) from history where date>'{span_str}'"
+        query = f"SELECT count(mac) from sensor_state where date>'{span_str}'"
         c = self.connection.cursor()
         try :
             c.execute(query)
@@ -231,14 +439,14 @@ class SQL:
             return False
     
     def getBattery( self, mac ) :
-        """ Historyの最新のセンサー情報を返す
+        """ 最新のセンサー情報を返す（sensor_state 電池の日時は最後に電池の値を受信した日時）
         Args:
             mac (str): センサーMAC
         Returns:
             ( batt, date, rssi, ext )
         """
         C.logger.debug(f"getBattery({mac})")
-        query = f"SELECT batt, date, rssi, ext FROM history WHERE mac ='{mac}' ORDER BY date DESC LIMIT 1"
+        query = f"SELECT batt, batt_date, rssi, ext FROM sensor_state WHERE mac ='{mac}'"
         c = self.connection.cursor()
         try :
             c.execute(query)
@@ -248,6 +456,58 @@ class SQL:
             C.logger.error(f"[getBattery] {e}")
             return False
 
+    @Metrics.timed(M_QUERY_SEC)
+    def getSensorStateAll( self ) -> dict :
+        """ 全センサーの最新状態（sensor_state）
+        Returns:
+            dict: { mac: {'mac','node','date','templ','humid','batt','rssi','ext','status','batt_date','day','samples'} }
+        """
+        C.logger.debug(f"getSensorStateAll()")
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT mac, node, date, templ, humid, batt, rssi, ext, status, batt_date, day, samples FROM sensor_state")
+            cols = [ d[0] for d in c.description ]
+            return { r[0]:dict(zip(cols, r)) for r in c.fetchall() }
+        except sqlite3.Error as e :
+            C.logger.error(f"[getSensorStateAll] {e}")
+            return {}
+
+    @Metrics.timed(M_QUERY_SEC)
+    def getSensorTrendAll( self ) -> dict :
+        """ 全センサーの温度の傾向（sensor_trend）
+        Returns:
+            dict: { mac: {'mac','date','templ','humid','ewma','slope','n','stuck','stuck_date'} }  slopeは℃/分
+        """
+        C.logger.debug(f"getSensorTrendAll()")
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT mac, date, templ, humid, ewma, slope, n, stuck, stuck_date FROM sensor_trend")
+            cols = [ d[0] for d in c.description ]
+            return { r[0]:dict(zip(cols, r)) for r in c.fetchall() }
+        except sqlite3.Error as e :
+            C.logger.error(f"[getSensorTrendAll] {e}")
+            return {}
+
+    @Metrics.timed(M_QUERY_SEC)
+    def getBattForecastAll( self ) -> dict :
+        """ 全センサーの電池交換日の予測（batt_fitの累積和から計算 センサー数に比例）
+        Returns:
+            dict: { mac: battForecast()の結果 + 'batt' }
+        """
+        C.logger.debug(f"getBattForecastAll()")
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT mac, t0, n, sx, sy, sxx, sxy, batt, date FROM batt_fit")
+            cols = [ d[0] for d in c.description ]
+            ret = dict()
+            for r in c.fetchall() :
+                fit = dict(zip(cols, r))
+                ret[fit['mac']] = dict(battForecast(fit), batt=fit['batt'])
+            return ret
+        except sqlite3.Error as e :
+            C.logger.error(f"[getBattForecastAll] {e}")
+            return {}
+
     def getNodeInfo(self, node ) :
         """指定されたノード情報
         Args:
@@ -306,6 +566,41 @@ class SQL:
             C.logger.error(f"[getSensorInfo] {e} < {mac}")
             return None,None,None,None
 
+    @Metrics.timed(M_QUERY_SEC)
+    def getSensorConfAll( self ) -> tuple :
+        """判定用：全センサーの設定とノード名をまとめて取得（1回のSELECT）
+        Returns:
+            tuple: ( sensors, nodes )
+                sensors = { mac: {'name', 'node', 'warn':{'lC','lW','hW','hC'}} }
+                nodes = { node_no: name }
+        """
+        C.logger.debug(f"getSensorConfAll()")
+        sensors = dict()
+        nodes = dict()
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT mac, name, node, warn FROM conf")
+            for mac, name, node, warn in c.fetchall() :
+                node = str(node)
+                if node.upper().startswith('LORA') :
+                    nodes[int(node[4:])] = name
+                    continue
+                try :
+                    lC,lW,hW,hC = warn.split(sep=',')
+                    w = {}
+                    w['lC'] = None if lC.upper() == 'NONE' else float(lC)
+                    w['lW'] = None if lW.upper() == 'NONE' else float(lW)
+                    w['hW'] = None if hW.upper() == 'NONE' else float(hW)
+                    w['hC'] = None if hC.upper() == 'NONE' else float(hC)
+                    sensors[mac] = {'name':name, 'node':int(node), 'warn':w}
+                except (ValueError, AttributeError) as e :
+                    C.logger.error(f"[getSensorConfAll] {e} < {mac}")
+            return sensors, nodes
+
+        except sqlite3.Error as e :
+            C.logger.error(f"[getSensorConfAll] {e}")
+            return sensors, nodes
+
     def getDiscord( self, node ) :
         """指定したnodeのDiscod Token
         Args:
@@ -332,6 +627,16 @@ class SQL:
         """
         C.logger.debug(f"getNodeRSSI()") 
         data = [0] * self.numNode()
+
+        ## node_linkのスナップショットがあればそれを利用（historyを検索しない）
+        links = self.getNodeLink()
+        if len(links) != 0 :
+            for link in links :
+                if not ( 1 <= link['node'] <= len(data) ) : continue
+                if link['last_seen'] == None or link['rssi'] == None : continue
+                if C.spanTimeforSTR(link['last_seen']) < datetime.timedelta(hours=1) : data[link['node']-1] = round(link['rssi'])
+            return data
+
         for node in range(1 , self.numNode()+1) :
             query =f"select mac, rssi, date from history where mac LIKE '00:00:00:00:00:{node:02}' order by date desc limit 1"
             c = self.connection.cursor()
@@ -351,6 +656,171 @@ class SQL:
             
         return data
 
+    @Metrics.timed(M_QUERY_SEC)
+    def updateNodeLink( self, links:list ) -> bool :
+        """ Gatewayのリンク統計スナップショットを保存
+        Args:
+            links (list): LinkRegistry.snapshot() のdict型list
+        Returns:
+            bool: 保存結果
+        """
+        C.logger.debug(f"updateNodeLink({len(links)})")
+        if len(links) == 0 : return True
+        query = "REPLACE INTO node_link (node, last_seq, frames, gaps, loss, rssi, last_seen, acks, rejected) VALUES (:node, :last_seq, :frames, :gaps, :loss, :rssi, :last_seen, :acks, :rejected)"
+        c = self.connection.cursor()
+        try :
+            c.executemany(query, links)
+            c.connection.commit()
+            return True
+        except sqlite3.Error as e :
+            C.logger.error(f"[updateNodeLink] {e}")
+            c.connection.rollback()
+            return False
+
+    def getNodeLink( self, node=0 ) -> list :
+        """ リンク統計スナップショットを取得
+        Args:
+            node (int): ノード番号（0は全ノード）
+        Returns:
+            list: node_linkのdict型list
+        """
+        C.logger.debug(f"getNodeLink({node})")
+        data = list()
+        query = "SELECT node, last_seq, frames, gaps, loss, rssi, last_seen, acks, rejected FROM node_link"
+        if node != 0 : query += f" WHERE node={node}"
+        c = self.connection.cursor()
+        try :
+            c.execute(query + " ORDER BY node")
+            for res in c.fetchall() :
+                data.append(self._encode_node_link(res))
+            return data
+        except sqlite3.Error as e :
+            C.logger.error(f"[getNodeLink] {e}")
+            return data
+
+    def dataVersion( self ) -> int :
+        """ DATABASEの更新番号（PRAGMA data_version 他の接続がコミットすると変わる）
+        Returns:
+            int: 更新番号（エラーは-1）
+        """
+        try :
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error as e :
+            C.logger.error(f"[dataVersion] {e}")
+            return -1
+
+    @Metrics.timed(M_QUERY_SEC)
+    def enqueueOutbox( self, items:list, latest:list=[] ) -> int :
+        """ Cloud送信データをoutboxに登録し、送信元のlatestを同じトランザクションで削除
+        （送信に失敗してもデータはoutboxに残るので失われない）
+        Args:
+            items (list): ( sink, key, payload ) のlist  payloadはJSONに変換できること
+            latest (list): 削除するlatestの ( mac, date ) のlist（以降に更新された行は残る）
+        Returns:
+            int: 登録件数（エラー時は0）
+        """
+        C.logger.debug(f"enqueueOutbox({len(items)}/{len(latest)})")
+        now = C.getTimeSTR()
+        rows = [ (sink, str(key), json.dumps(payload, ensure_ascii=False), now, time.time()) for sink, key, payload in items ]
+        c = self.connection.cursor()
+        try :
+            c.executemany("INSERT INTO outbox (sink, key, payload, created, state, attempts, next_try) VALUES (?, ?, ?, ?, 0, 0, ?)", rows)
+            c.executemany("DELETE FROM latest WHERE mac=? AND date=?", latest)
+            c.connection.commit()
+            return len(rows)
+        except sqlite3.Error as e :
+            C.logger.error(f"[enqueueOutbox] {e}")
+            c.connection.rollback()
+            return 0
+
+    @Metrics.timed(M_QUERY_SEC)
+    def getOutbox( self, sink:str, limit=C.OUTBOX_BATCH ) -> list :
+        """ 送信時刻になった未送信データを古い順に取得（key毎に limit 件まで）
+        Ambientはチャンネル毎に1サイクル1件登録するので、sink全体で件数を制限すると
+        チャンネル数が limit を超えた時に送信が追いつかなくなる
+        Args:
+            sink (str): 送信先 ambient / gas
+            limit (int, optional): key（Ambientはチャンネル）毎の最大件数. 初期値 C.OUTBOX_BATCH.
+        Returns:
+            list: outboxのdict型list（payloadはJSONから戻したもの）
+        """
+        data = list()
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT id, sink, key, payload, created, attempts FROM ( "
+                      "SELECT *, row_number() OVER (PARTITION BY key ORDER BY id) AS num FROM outbox WHERE sink=? AND state=? AND next_try<=? ) "
+                      "WHERE num<=? ORDER BY id",
+                      (sink, C.OUTBOX_ST.PENDING, time.time(), limit))
+            for res in c.fetchall() :
+                data.append(self._encode_outbox(res))
+            return data
+        except sqlite3.Error as e :
+            C.logger.error(f"[getOutbox] {e}")
+            return data
+
+    @Metrics.timed(M_QUERY_SEC)
+    def markOutbox( self, ids:list, ok:bool, error="" ) -> bool :
+        """ outboxの送信結果を記録
+        成功は SENT、失敗は試行回数を増やして指数バックオフで次回送信時刻を設定
+        （C.OUTBOX_MAX_ATTEMPTS 回失敗したら DEAD）
+        Args:
+            ids (list): outboxのid
+            ok (bool): 送信結果
+            error (str, optional): 失敗理由. 初期値 "".
+        Returns:
+            bool: 更新結果
+        """
+        if len(ids) == 0 : return True
+        c = self.connection.cursor()
+        try :
+            if ok :
+                c.executemany("UPDATE outbox SET state=?, sent=?, last_error='' WHERE id=?",
+                              [ (C.OUTBOX_ST.SENT, C.getTimeSTR(), i) for i in ids ])
+            else :
+                now = time.time()
+                q = ','.join(['?'] * len(ids))
+                c.execute(f"SELECT id, attempts FROM outbox WHERE id IN ({q})", ids)
+                rows = list()
+                for i, attempts in c.fetchall() :
+                    attempts += 1
+                    wait = min(C.OUTBOX_BACKOFF_MAX, C.OUTBOX_BACKOFF * (2 ** (attempts - 1)))
+                    state = C.OUTBOX_ST.DEAD if attempts >= C.OUTBOX_MAX_ATTEMPTS else C.OUTBOX_ST.PENDING
+                    rows.append( (state, attempts, now + wait, error, i) )
+                c.executemany("UPDATE outbox SET state=?, attempts=?, next_try=?, last_error=? WHERE id=?", rows)
+            ## 送信済みは一定期間で削除
+            purge = (datetime.datetime.now() - datetime.timedelta(days=C.OUTBOX_KEEP)).strftime("%Y-%m-%d %H:%M:%S")
+            c.execute("DELETE FROM outbox WHERE state=? AND sent<?", (C.OUTBOX_ST.SENT, purge))
+            c.connection.commit()
+            return True
+        except sqlite3.Error as e :
+            C.logger.error(f"[markOutbox] {e}")
+            c.connection.rollback()
+            return False
+
+    def getOutboxStats( self ) -> dict :
+        """ outboxの滞留状況（送信先毎）
+        Returns:
+            dict: { sink: {'pending', 'dead', 'oldest', 'age', 'attempts'} }  ageは最古の未送信データの経過秒
+        """
+        stats = dict()
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT sink, state, count(id), min(created), max(attempts) FROM outbox WHERE state<>? GROUP BY sink, state", (C.OUTBOX_ST.SENT,))
+            for sink, state, num, oldest, attempts in c.fetchall() :
+                st = stats.setdefault(sink, {'pending':0, 'dead':0, 'oldest':"", 'age':0, 'attempts':0})
+                if state == C.OUTBOX_ST.DEAD :
+                    st['dead'] = num
+                    continue
+                st['pending'] = num
+                st['oldest'] = oldest
+                st['age'] = int(C.spanTimeforSTR(oldest).total_seconds())
+                st['attempts'] = attempts
+            return stats
+        except sqlite3.Error as e :
+            C.logger.error(f"[getOutboxStats] {e}")
+            return stats
+
+    @Metrics.timed(M_QUERY_SEC)
     def appendData(self, data):
         """センサーの結果情報を追加(INSERT)  同時にlatestのデータも更新する
         Args:
@@ -358,7 +828,7 @@ class SQL:
         Returns:
             bool: 追加結果
         """
-        C.logger.debug(f"appendData()> {data['mac']}")
+        C.logger.debug("appendData()> %s", data['mac'])
 
         ## 日付が指定されていない場合に追加
         if 'date' not in data :
@@ -377,13 +847,49 @@ class SQL:
             #C.logger.debug(f"QUERY : {latest_query}")
             c.execute(history_query,data)
             c.execute(latest_query,data)
+            c.execute(STATE_UPSERT, _state_row(data))
+            if data.get('batt') != None : c.execute(BATT_FIT_UPSERT, data)
+            c.executemany(TREND_UPSERT, _trend_rows([data]))
             self.connection.commit()
             return True, data['date']
 
         except sqlite3.Error as e :
             C.logger.error(f"[appendData] {e}")
+            self.connection.rollback()
             return False, None
-        
+
+    @Metrics.timed(M_QUERY_SEC)
+    def appendDataMany(self, datas:list) -> int :
+        """センサーの結果情報をまとめて追加(INSERT)  latest・sensor_state・batt_fit・sensor_trendも同じトランザクションで更新する
+        Args:
+            datas (list): センサー情報(dict)のlist 全て同じキーであること
+        Returns:
+            int: 追加件数（エラー時は0）
+        """
+        C.logger.debug("appendDataMany()> %d", len(datas))
+        if len(datas) == 0 : return 0
+
+        ## クエリ作成（historyとlatest）
+        columns = ', '.join(datas[0].keys())
+        placeholders = ':'+', :'.join(datas[0].keys())
+        history_query = 'INSERT INTO history (%s) VALUES (%s)' % (columns, placeholders)
+        latest_query = 'INSERT OR REPLACE INTO latest (%s) VALUES (%s)' % (columns, placeholders)
+
+        c = self.connection.cursor()
+        try :
+            c.executemany(history_query, datas)
+            c.executemany(latest_query, datas)
+            c.executemany(STATE_UPSERT, [ _state_row(d) for d in datas ])
+            c.executemany(BATT_FIT_UPSERT, [ d for d in datas if d.get('batt') != None ])
+            c.executemany(TREND_UPSERT, _trend_rows(datas))
+            self.connection.commit()
+            return len(datas)
+
+        except sqlite3.Error as e :
+            C.logger.error(f"[appendDataMany] {e}")
+            self.connection.rollback()
+            return 0
+
     def isExistSensor(self, mac) : 
         """ 2024/04/25 追加 登録されているセンサーか？
         Args:
@@ -526,6 +1032,39 @@ class SQL:
             C.logger.error(f"[updateNotify] {e}")
             return False
 
+    @Metrics.timed(M_QUERY_SEC)
+    def updateNotifyMany( self, transitions:list ) -> int :
+        """判定結果（状態遷移）をまとめてNotifyに反映（1トランザクション）
+        状態・カウントが変わらないNORMAL・STUCKの行は日時のみ更新する（LOST判定は最後の更新日時から計るため）
+        Args:
+            transitions (list): {'mac', 'status', 'count', 'prev', 'prev_count'} のlist（libJudge）
+        Returns:
+            int: 状態を更新した件数（エラー時は-1）
+        """
+        date = C.getTimeSTR()
+        changed = list()
+        touched = list()
+        for t in transitions :
+            if t['status'] in (C.SENS_ST.NORMAL, C.SENS_ST.STUCK) and t['prev'] == t['status'] and t['prev_count'] == t['count'] :
+                touched.append( (date, t['mac']) )
+                continue
+            notify = 0 if t['status'] == C.SENS_ST.NORMAL else 1
+            changed.append( (date, int(t['status']), notify, t['count'], t['mac']) )
+        C.logger.info(f"updateNotifyMany changed:{len(changed)} unchanged:{len(touched)}")
+
+        c = self.connection.cursor()
+        try :
+            c.executemany("UPDATE notify SET date=?, status=?, notify=?, count=? WHERE mac=?", changed)
+            c.executemany("UPDATE notify SET date=? WHERE mac=?", touched)
+            c.connection.commit()
+            return len(changed)
+
+        except sqlite3.Error as e:
+            C.logger.error(f"[updateNotifyMany] {e}")
+            c.connection.rollback()
+            return -1
+
+    @Metrics.timed(M_QUERY_SEC)
     def getNotifyList( self, node_no = 0 , ClearfNotify=False) -> list :
         """ Notifyにてノードを指定したリストを返す
         Args:
@@ -544,7 +1083,7 @@ class SQL:
                 dquery= f"UPDATE notify SET notify=0"
             else :
                 query = f"SELECT node, mac, date, lost_date, status, count, notify FROM notify WHERE node={node_no} and notify=1"
-                dquery= f"UPDATE notify SET notify=0 AND node={node_no}"
+                dquery= f"UPDATE notify SET notify=0 WHERE node={node_no}"
         else :
             if node_no == 0 :
                 query = f"SELECT node, mac, date, lost_date, status, count, notify FROM notify "
@@ -624,6 +1163,7 @@ class SQL:
             return ""
 
 
+    @Metrics.timed(M_QUERY_SEC)
     def getLatestDATA(self, node, delete=False ) :
         """指定したnodeの最新データを返す。データは消さない
         Args:
@@ -660,6 +1200,7 @@ class SQL:
                 c.connection.rollback()
             return result
         
+    @Metrics.timed(M_QUERY_SEC)
     def getLatestAll(self, delete=True) :
         """ Latestの全データを取得する。
             なお、Nodeで実行するとNode内のセンサー
@@ -718,15 +1259,95 @@ class SQL:
             C.logger.error(f"[getStatus] ERROR: {e}")
             return None
 
-    def updateSystemConf(self, data , cloud_date ) :
+    def getConfVersion(self) -> tuple :
+        """ 設定情報の版（更新日付とハッシュ）
+        Returns:
+            tuple: ( date, hash )  未設定は ( None, "" )
+        """
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT date, hash FROM conf_date WHERE id=1")
+            res = c.fetchone()
+            if res == None : return None, ""
+            return res[0], res[1] or ""
+        except sqlite3.Error as e:
+            C.logger.error(f"[getConfVersion] ERROR : {e}")
+            return None, ""
+
+    def setConfVersion(self, cloud_date, conf_hash:str ) -> bool :
+        """ 設定情報の版（更新日付とハッシュ）を記録
+        Args:
+            cloud_date (datetime): GASの更新日付
+            conf_hash (str): 設定内容のハッシュ
+        Returns:
+            bool: 更新結果
+        """
+        c = self.connection.cursor()
+        try :
+            c.execute("REPLACE INTO conf_date(id, date, hash) VALUES(1, ?, ?)", (str(cloud_date), conf_hash))
+            c.connection.commit()
+            return True
+        except sqlite3.Error as e:
+            C.logger.error(f"[setConfVersion] ERROR : {e}")
+            return False
+
+    def diffSystemConf(self, data:list ) -> dict :
+        """ GASの設定データと現在のconfをMACで比較する
+        Args:
+            data (list): 更新用のJSON配列（macは小文字に変換する）
+        Returns:
+            dict: { 'insert':[row], 'update':[(row, 変更したカラムのlist)], 'delete':[mac], 'same':件数 }
+                  エラー時は None
+        """
+        columns = list(data[0].keys()) if len(data) != 0 else []
+        current = dict()
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT * FROM conf")
+            names = [ d[0] for d in c.description ]
+            for res in c.fetchall() :
+                row = dict(zip(names, res))
+                current[row['mac']] = row
+        except sqlite3.Error as e:
+            C.logger.error(f"[diffSystemConf] ERROR : {e}")
+            return None
+
+        diff = {'insert':[], 'update':[], 'delete':[], 'same':0}
+        macs = set()
+        for d in data :
+            d['mac'] = d['mac'].lower() #macを小文字に変換
+            macs.add(d['mac'])
+            now = current.get(d['mac'])
+            if now == None :
+                diff['insert'].append(d)
+                continue
+            changed = [ k for k in columns if k != 'mac' and _conf_value(d.get(k)) != _conf_value(now.get(k)) ]
+            if len(changed) == 0 :
+                diff['same'] += 1
+            else :
+                diff['update'].append( (d, changed) )
+        diff['delete'] = [ mac for mac in current if mac not in macs ]
+        return diff
+
+    @Metrics.timed(M_QUERY_SEC)
+    def updateSystemConf(self, data , cloud_date, conf_hash="" ) :
         """ システム情報を更新する。
+        現在のconfとMACで比較して、追加・変更・削除のあった行のみ更新する。
+        notifyは変更のあったセンサーのみ調整し、他のセンサーの状態（status/count/date）は保持する
+        ・追加（有効）        : notifyに追加（status NONE）
+        ・削除・無効に変更    : notifyから削除
+        ・有効に変更          : notifyに追加（status NONE）
+        ・閾値(warn)の変更    : status NONE、count 0 に戻す（新しい閾値で判定し直す）
+        ・ノードの変更        : notifyのnodeを変更
         Args:
             data 更新用のJSON配列
+            cloud_date (datetime): GASの更新日付
+            conf_hash (str, optional): 設定内容のハッシュ（conf_dateに記録）
         Returns:
             True  : 更新成功
             False : 更新不要（更新日が過去）
             None  : 更新できない（システムエラー）
-            + mess : エラーメッセージ
+            + mess : 変更内容 または エラーメッセージ
         """ 
         C.logger.debug(f"updateSystemConf({cloud_date})")
         c = self.connection.cursor()
@@ -747,28 +1368,53 @@ class SQL:
             C.logger.error(mess)
             return None, mess
 
+        if len(data) == 0 :
+            mess = "[updateSystemConf] ERROR : No configure data"
+            C.logger.error(mess)
+            return None, mess
+
+        diff = self.diffSystemConf(data)
+        if diff == None :
+            return None, "[updateSystemConf] ERROR : read conf"
+
         try : 
             # 情報更新
             C.logger.info(f"Update configure.... {conf_date} -> {cloud_date}")
-            column = ', '.join(data[0].keys())
-            placeholder = ':'+', :'.join(data[0].keys())
+            columns = list(data[0].keys())
+            column = ', '.join(columns)
+            placeholder = ':'+', :'.join(columns)
+            setter = ', '.join( f"{k}=:{k}" for k in columns if k != 'mac' )
+            now = C.getTimeSTR()
 
             # トランザクション開始
             c.execute("BEGIN TRANSACTION;")
 
-            # 既存データの削除
-            sql = "DELETE from conf"
-            c.execute(sql)
- 
-            # 最新データのインサート
-            sql = f"INSERT INTO conf({column}) VALUES({placeholder})"
-            for d in data :
-                d['mac'] = d['mac'].lower() #macを小文字に変換
-                c.execute(sql, d )
- 
+            # conf 差分のみ更新
+            c.executemany(f"INSERT INTO conf({column}) VALUES({placeholder})", diff['insert'])
+            c.executemany(f"UPDATE conf SET {setter} WHERE mac=:mac", [ d for d, _ in diff['update'] ])
+            c.executemany("DELETE FROM conf WHERE mac=?", [ (mac,) for mac in diff['delete'] ])
+
+            # notify 変更のあったセンサーのみ調整
+            add, remove, rearm, move = list(), list(), list(), list()
+            for d in diff['insert'] :
+                if _conf_value(d.get('use')) == '1' : add.append(d)
+            for d, changed in diff['update'] :
+                if 'use' in changed :
+                    if _conf_value(d.get('use')) == '1' : add.append(d)
+                    else : remove.append(d['mac'])
+                    continue
+                if 'warn' in changed : rearm.append(d['mac'])
+                if 'node' in changed : move.append(d)
+            remove += diff['delete']
+            c.executemany("INSERT OR IGNORE INTO notify(mac, date, status, notify, count, node) VALUES(?, ?, ?, 0, 0, ?)",
+                          [ (d['mac'], now, C.SENS_ST.NONE, str(d.get('node'))) for d in add ])
+            c.executemany("DELETE FROM notify WHERE mac=?", [ (mac,) for mac in remove ])
+            c.executemany("UPDATE notify SET status=?, count=0, notify=0, date=? WHERE mac=?",
+                          [ (C.SENS_ST.NONE, now, mac) for mac in rearm ])
+            c.executemany("UPDATE notify SET node=? WHERE mac=?", [ (str(d.get('node')), d['mac']) for d in move ])
+
             # 更新日付の更新
-            sql = f"REPLACE INTO conf_date(id, date) VALUES(1, '{cloud_date}')"
-            c.execute(sql)
+            c.execute("REPLACE INTO conf_date(id, date, hash) VALUES(1, ?, ?)", (str(cloud_date), conf_hash))
             c.connection.commit()
 
         except sqlite3.Error as e:
@@ -777,9 +1423,12 @@ class SQL:
             C.logger.error(mess)
             return None, mess
 
-        # Notify Table 構築
-        self.initNotify()
-        return True, "Update done."
+        for d in diff['insert'] : C.logger.info(f"[updateSystemConf] + {d['mac']} {d.get('name')}")
+        for d, changed in diff['update'] : C.logger.info(f"[updateSystemConf] ~ {d['mac']} {d.get('name')} {changed}")
+        for mac in diff['delete'] : C.logger.info(f"[updateSystemConf] - {mac}")
+        mess = f"Update done. insert:{len(diff['insert'])} update:{len(diff['update'])} delete:{len(diff['delete'])} same:{diff['same']}"
+        C.logger.info(mess)
+        return True, mess
 
     def _getSensors(self, valid=True) :
         """有効なセンサーのリスト
@@ -965,6 +1614,37 @@ class SQL:
         ret['notify'] = int(d[6])
         return ret
 
+    def _encode_node_link(self,d):
+        """内部関数 node_linkのtupleをdictに変換
+        Args:
+            d (tuple): node_linkテーブルのクエリー結果
+        Returns:
+            dict: dict形式
+        """
+        if( d == None ): return None
+        ret = {}
+        ret['node'] = d[0]
+        ret['last_seq'] = d[1]
+        ret['frames'] = d[2]
+        ret['gaps'] = d[3]
+        ret['loss'] = d[4]
+        ret['rssi'] = d[5]
+        ret['last_seen'] = d[6]
+        ret['acks'] = d[7]
+        ret['rejected'] = d[8]
+        return ret
+
+    def _encode_outbox(self,d):
+        ''' 内部関数：outboxのSELECT結果をdictに変換 '''
+        ret = {}
+        ret['id'] = d[0]
+        ret['sink'] = d[1]
+        ret['key'] = d[2]
+        ret['payload'] = json.loads(d[3])
+        ret['created'] = d[4]
+        ret['attempts'] = d[5]
+        return ret
+
     def _encode_data_latest_node(self,d):
         """内部関数 センサーデーターhistoryのtupleをdictに変換 node用（
         Args:
@@ -1010,6 +1690,128 @@ class SQL:
         ret['ambient_conf'] = d[10]
         return ret
 
+    def rollupHistory( self ) -> int :
+        """ 時間毎の集計表（rollup_hour）を更新（現在の時間は含めない）
+        前回集計した historyのid より後に登録された行の (mac, 時間) を集計し直す。
+        ノードが再送した過去の日時のデータも、その時間を history から集計し直す
+        Returns:
+            int: 更新した行数
+        """
+        C.logger.debug(f"rollupHistory()")
+        now_hour = time.strftime("%Y-%m-%d %H:00:00")
+        c = self.connection.cursor()
+        try :
+            c.execute("SELECT last_id FROM rollup_mark WHERE id=1")
+            res = c.fetchone()
+            last_id = res[0] if res != None else 0
+            ## 現在の時間の行は次回に集計するので、その手前のidまでを集計済にする
+            c.execute("SELECT min(id) FROM history WHERE id > ? AND date >= ?", (last_id, now_hour))
+            pending = c.fetchone()[0]
+            if pending != None :
+                mark = pending - 1
+            else :
+                c.execute("SELECT max(id) FROM history")
+                mark = c.fetchone()[0] or 0
+            c.execute("INSERT OR REPLACE INTO rollup_hour (mac, hour, n, templ_n, templ_sum, templ_min, templ_max, humid_n, humid_sum, humid_min, humid_max) "
+                      "SELECT h.mac, d.hour, count(*), count(templ), sum(templ), min(templ), max(templ), count(humid), sum(humid), min(humid), max(humid) "
+                      "FROM ( SELECT DISTINCT mac, substr(date, 1, 13) || ':00:00' AS hour FROM history WHERE id > ? AND id <= ? ) d "
+                      "JOIN history h ON h.mac = d.mac AND h.date >= d.hour AND h.date < strftime('%Y-%m-%d %H:00:00', d.hour, '+1 hour') "
+                      "GROUP BY h.mac, d.hour", (last_id, mark))
+            num = c.rowcount
+            c.execute("REPLACE INTO rollup_mark (id, last_id, hour) VALUES (1, ?, ?)", (mark, now_hour))
+            self.connection.commit()
+            C.logger.info(f"[rollupHistory] id {last_id} - {mark} ( < {now_hour} ) : {num}")
+            return num
+        except sqlite3.Error as e :
+            C.logger.error(f"[rollupHistory] {e}")
+            self.connection.rollback()
+            return 0
+
+    @Metrics.timed(M_QUERY_SEC)
+    def aggregate( self, start:str, end:str, bucket=3600, column="templ", macs=None, percentiles=() ) -> list :
+        """センサー毎・時間幅（bucket）毎の 件数・最小・最大・平均・パーセンタイル
+        ・パーセンタイル無し : SQLのGROUP BYで集計（bucketが1時間の倍数なら rollup_hour を使い、未集計の時間のみhistoryから）
+        ・パーセンタイル有り : センサー毎に history(mac, date) の索引で日時順に読み、
+                               時間幅毎に値を集めて計算する（メモリに持つのは1つの時間幅の値のみ）
+        Args:
+            start (str): 開始日時 YYYY-MM-DD HH:MM:SS（含む）
+            end (str): 終了日時 YYYY-MM-DD HH:MM:SS（含まない）
+            bucket (int, optional): 時間幅（秒）. 初期値 3600.
+            column (str, optional): 集計する列 AGG_COLUMNS. 初期値 "templ".
+            macs (list, optional): センサーMACのlist（Noneは全センサー）. 初期値 None.
+            percentiles (tuple, optional): パーセンタイル (50, 90) など. 初期値 ().
+        Returns:
+            list: {'mac','start','n','min','max','mean', 'p50'...} のlist（mac, start順）
+                  時間幅の区切りは日時文字列をUTCとみなしたUNIX時間の倍数（日・時間の区切りは現地時刻のまま）
+        """
+        C.logger.debug(f"aggregate({column}, {start} - {end}, {bucket}sec, {percentiles})")
+        if column not in AGG_COLUMNS : raise ValueError(f"column {column} not in {AGG_COLUMNS}")
+        bucket = int(bucket)
+        c = self.connection.cursor()
+        acc = dict()
+        try :
+            if macs == None :
+                c.execute("SELECT mac FROM sensor_state ORDER BY mac")
+                macs = [ r[0] for r in c.fetchall() ]
+            if len(percentiles) != 0 :
+                return self._aggregateStream(c, start, end, bucket, column, macs, tuple(percentiles))
+
+            sql_macs = ",".join("?" * len(macs))
+            raw_from = start
+            if bucket % 3600 == 0 and column in ROLLUP_COLUMNS and start[13:] == ":00:00" :
+                ## 集計済の時間は rollup_hour から（1時間毎の 件数・合計・最小・最大 を合算）
+                c.execute("SELECT hour FROM rollup_mark WHERE id=1")
+                res = c.fetchone()
+                covered = res[0] if res != None else None    # この時間より前は集計済
+                if covered != None and covered > start :
+                    rollup_end = min(covered, end[:13] + ":00:00")   # 途中の時間はhistoryから
+                    c.execute(f"SELECT mac, CAST(strftime('%s', hour) AS INTEGER) / ?, sum({column}_n), sum({column}_sum), min({column}_min), max({column}_max) "
+                              f"FROM rollup_hour WHERE hour >= ? AND hour < ? AND mac IN ({sql_macs}) AND {column}_n > 0 GROUP BY 1, 2",
+                              [bucket, start, rollup_end] + list(macs))
+                    for mac, b, n, total, vmin, vmax in c.fetchall() : _merge_agg(acc, (mac, b), n, total, vmin, vmax)
+                    raw_from = max(start, rollup_end)
+            if raw_from < end :
+                c.execute(f"SELECT mac, CAST(strftime('%s', date) AS INTEGER) / ?, count({column}), sum({column}), min({column}), max({column}) "
+                          f"FROM history WHERE date >= ? AND date < ? AND mac IN ({sql_macs}) AND {column} IS NOT NULL GROUP BY 1, 2",
+                          [bucket, raw_from, end] + list(macs))
+                for mac, b, n, total, vmin, vmax in c.fetchall() : _merge_agg(acc, (mac, b), n, total, vmin, vmax)
+        except sqlite3.Error as e :
+            C.logger.error(f"[aggregate] {e}")
+            return []
+
+        ret = list()
+        for (mac, b) in sorted(acc) :
+            a = acc[(mac, b)]
+            ret.append({'mac':mac, 'start':time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(b * bucket)),
+                        'n':a['n'], 'min':a['min'], 'max':a['max'], 'mean':a['sum'] / a['n']})
+        return ret
+
+    def _aggregateStream( self, c, start:str, end:str, bucket:int, column:str, macs:list, percentiles:tuple ) -> list :
+        ''' 内部関数：パーセンタイル付きの集計（センサー毎に日時順で読みながら時間幅毎に計算） '''
+        ret = list()
+
+        def flush( mac, b, values ) :
+            if len(values) == 0 : return
+            d = {'mac':mac, 'start':time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(b * bucket)),
+                 'n':len(values), 'min':min(values), 'max':max(values), 'mean':sum(values) / len(values)}
+            for p, v in zip(percentiles, _percentiles(values, percentiles)) : d[f"p{p:g}"] = v
+            ret.append(d)
+
+        for mac in macs :
+            c.execute(f"SELECT CAST(strftime('%s', date) AS INTEGER) / ?, {column} FROM history "
+                      f"WHERE mac = ? AND date >= ? AND date < ? AND {column} IS NOT NULL ORDER BY date", (bucket, mac, start, end))
+            cur, values = None, list()
+            while True :
+                rows = c.fetchmany(AGG_FETCH)
+                if len(rows) == 0 : break
+                for b, v in rows :
+                    if b != cur :
+                        flush(mac, cur, values)
+                        cur, values = b, list()
+                    values.append(v)
+            flush(mac, cur, values)
+        return ret
+
     def __del__(self):
         #C.logger.debug("[SQL] call del()")
         self.connection.close()
@@ -1141,6 +1943,40 @@ if __name__ == '__main__':
         num= S.numSensorsMe()
         print(f"sensors->{num}")
 
+    elif len(args) != 1 and args[1].upper() == "NODE_LINK" :
+        S = SQL()
+        print("node Link")
+        for link in S.getNodeLink() :
+            pprint.pprint(link)
+
+    elif len(args) != 1 and args[1].upper() == "OUTBOX" :
+        S = SQL()
+        print("Cloud Outbox")
+        for sink, st in S.getOutboxStats().items() :
+            print(f"{sink:8} pending:{st['pending']} dead:{st['dead']} oldest:{st['oldest']} ({st['age']}sec) attempts:{st['attempts']}")
+
+    elif len(args) != 1 and args[1].upper() == "STATE" :
+        S = SQL()
+        print("Sensor State")
+        for mac, st in S.getSensorStateAll().items() :
+            print(f"{mac} [{st['date']}] {st['templ']} {st['humid']} batt:{st['batt']}({st['batt_date']}) rssi:{st['rssi']} today:{st['samples']}")
+
+    elif len(args) != 1 and args[1].upper() == "AGG" :
+        ## AGG [hours] [bucket(min)] [column]  直近の集計（パーセンタイル 50, 90）
+        S = SQL()
+        hours = int(args[2]) if len(args) >= 3 else 24
+        bucket = int(args[3]) * 60 if len(args) >= 4 else 3600
+        column = args[4] if len(args) >= 5 else "templ"
+        end = datetime.datetime.now()
+        start = (end - datetime.timedelta(hours=hours)).strftime("%Y-%m-%d %H:00:00")
+        print(f"aggregate {column} {start} - {bucket}sec  (numpy:{np != None})")
+        for d in S.aggregate(start, end.strftime("%Y-%m-%d %H:%M:%S"), bucket, column, percentiles=(50, 90)) :
+            print(f"{d['mac']} {d['start']} n:{d['n']:5} min:{d['min']:6.1f} mean:{d['mean']:6.2f} max:{d['max']:6.1f} p50:{d['p50']:6.1f} p90:{d['p90']:6.1f}")
+
+    elif len(args) != 1 and args[1].upper() == "ROLLUP" :
+        S = SQL()
+        print(f"rollup_hour : {S.rollupHistory()}")
+
     elif len(args) != 1 and args[1].upper() == "ARRIVE" :
         S = SQL()
         print("Arrive Node")
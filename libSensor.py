@@ -18,12 +18,17 @@ import config as C
 import time
 import struct
 import libMachineInfo as M
+import libMetrics as Metrics
 try :
     from bluepy import btle
 except ImportError :
     C.logger.warning("Module 'bluepy' not fond")
     pass
 
+## BLEスキャンの処理時間・検出数
+M_SCAN_SEC = Metrics.histogram("sast_ble_scan_seconds", "BLE scan and decode time")
+M_DEVICES = Metrics.gauge("sast_ble_devices", "BLE devices found by the last scan", ("kind",))
+
 def getSenserData_th1(mac:list ) -> list :
     """INKBIRD TH1のセンサーデータを取得（個別）
 
@@ -103,23 +108,26 @@ def getSensorsDATA_th1( maker:list ) -> list:
 
     for dev in devs:
         val = dev.getValueText(255)
-        C.logger.debug(f"> {dev.addr} : {val}")
+        C.logger.debug("> %s : %s", dev.addr, val)
         if( val is None or len(val) != 18) : continue
         (temp,humid,ext,uk1,uk2,batt,uk3) = struct.unpack('<hh?BBBB', bytes.fromhex(val))
         temp /=100
         humid /=100
         rssi = dev.rssi
         sensList.append({'mac':dev.addr.lower(),'batt':batt,'templ':temp,'humid':humid,'ext':ext,'rssi':rssi,'date':stime})
-        C.logger.info(sensList[-1])
+        C.logger.info("%s", sensList[-1])
 
     # --　指定されたメーカーコードに一致するデータの抽出            
     for s in sensList :
         if s['mac'][:8] in maker :
-            C.logger.info(f"add> {s['mac']} {s['templ']} {s['batt']} {s['rssi']}")
+            C.logger.info("add> %s %s %s %s", s['mac'], s['templ'], s['batt'], s['rssi'])
             ret.append(s)
 
     C.logger.debug(f"device : {len(ret)}")
     C.logger.info(f"Search time {time.time() - start:.2f}sec")
+    M_SCAN_SEC.observe(time.time() - start)
+    M_DEVICES.labels(kind="all").set(len(devs))
+    M_DEVICES.labels(kind="sensor").set(len(ret))
     return ret
 
 if __name__ == '__main__':
@@ -6,8 +6,8 @@ sudo apt autoremove -y
 
 echo "2.Install Libraries ... "
 sudo apt install -y sqlite3 git python3-dev python3-pip vim
-sudo pip3 install wiringpi psutil schedule ipget bluepy
-sudo pip3 install Adafruit_SSD1306 Pillow ipget pyserial schedule
+sudo pip3 install wiringpi psutil ipget bluepy
+sudo pip3 install Adafruit_SSD1306 Pillow ipget pyserial
 sudo pip3 install git+https://github.com/AmbientDataInc/ambient-python-lib.git
 
 echo "2.Add permissions"
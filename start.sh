@@ -62,7 +62,10 @@ if [ $node == "00" ]; then
 	sleep 1
 	echo "Start libLORA" >> stderr.log
 	$PYTHON $EXE_DIR/libLORA.py GATE 2>> stderr.log &
-	sleep 5
+	sleep 1
+	echo "Start SAST_dashboard" >> stderr.log
+	$PYTHON $EXE_DIR/SAST_dashboard.py 2>> stderr.log &
+	sleep 4
 	echo "Start SAST_observer" >> stderr.log
 	$PYTHON $EXE_DIR/SAST_observer.py 2>> stderr.log &
 	echo "check SAST_observer process EXIT.... until 10sec" 
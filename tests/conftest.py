@@ -0,0 +1,29 @@
+"""
+pytest 共通設定
+・リポジトリ直下を import パスに追加（config.py は GAS_setting.py も import する）
+・カレントを一時ディレクトリにする（SAST-debug.log・相対パスのDATABASEを作らない）
+・db : テスト毎の一時DATABASE（SQL("SETUP") で全テーブルを作成）
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SAST_LOG_LEVEL", "WARNING")
+os.chdir(tempfile.mkdtemp(prefix="sast_test_"))
+
+import libSQLite
+
+## import時に SQL() を作るモジュール（libLORA）が既定のDATABASEを開かないように
+libSQLite.DB_PATH = os.path.join(os.getcwd(), "import.sqlite")
+
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch) :
+    ''' テスト毎の一時DATABASE '''
+    monkeypatch.setattr(libSQLite, "DB_PATH", str(tmp_path / "test.sqlite"))
+    return libSQLite.SQL("SETUP")
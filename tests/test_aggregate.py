@@ -0,0 +1,117 @@
+"""libSQLite の集計（aggregate・rollup_hour）"""
+import datetime
+import random
+import time
+
+import pytest
+
+import libSQLite
+
+MACS = [ f"49:24:11:00:00:0{i}" for i in range(3) ]
+
+def _fill( S ) :
+    ## 2日分 2分毎（一部の湿度は無し）
+    random.seed(3)
+    datas = list()
+    for h in range(48) :
+        for m in range(0, 60, 2) :
+            for mac in MACS :
+                datas.append({'mac':mac, 'date':f"2026-10-{17 + h // 24} {h % 24:02}:{m:02}:{random.randint(0, 59):02}", 'node':1,
+                              'templ':round(random.uniform(10, 40), 1), 'humid':None if m % 10 == 0 else round(random.uniform(30, 90), 1)})
+    S.appendDataMany(datas)
+    return datas
+
+def _same( a:list, b:list ) :
+    assert [ (r['mac'], r['start'], r['n'], r['min'], r['max']) for r in a ] == [ (r['mac'], r['start'], r['n'], r['min'], r['max']) for r in b ]
+    assert [ r['mean'] for r in a ] == pytest.approx([ r['mean'] for r in b ])
+
+
+@pytest.mark.parametrize("column, bucket, start, end", [
+    ("templ", 3600,  "2026-10-17 00:00:00", "2026-10-19 00:00:00"),
+    ("humid", 3600,  "2026-10-17 05:00:00", "2026-10-18 20:30:00"),    # 途中の時間で終わる
+    ("templ", 86400, "2026-10-17 00:00:00", "2026-10-19 00:00:00"),
+    ("templ", 10800, "2026-10-17 05:00:00", "2026-10-18 23:00:00"),
+])
+def test_rollup_same_as_history( db, column, bucket, start, end ) :
+    _fill(db)
+    raw = db.aggregate(start, end, bucket, column)
+    assert db.rollupHistory() > 0
+    _same(db.aggregate(start, end, bucket, column), raw)
+    assert len(raw) != 0
+
+def test_rollup_partial( db ) :
+    ## 一部の時間のみ集計済（未集計の時間はhistoryから）
+    _fill(db)
+    raw = db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00")
+    db.rollupHistory()
+    c = db.connection.cursor()
+    c.execute("DELETE FROM rollup_hour WHERE hour >= '2026-10-18 06:00:00'")
+    c.execute("UPDATE rollup_mark SET hour='2026-10-18 06:00:00'")
+    db.connection.commit()
+    _same(db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00"), raw)
+
+def test_rollup_late_rows( db ) :
+    ## 集計済の時間に遅れて届いた行（ノードの再送）は次の rollupHistory() で集計し直す
+    _fill(db)
+    db.rollupHistory()
+    assert db.rollupHistory() == 0
+    db.appendDataMany([ {'mac':MACS[0], 'date':"2026-10-17 10:30:30", 'node':1, 'templ':99.0, 'humid':1.0},
+                        {'mac':MACS[1], 'date':"2026-10-18 23:59:59", 'node':1, 'templ':-5.0, 'humid':None} ])
+    assert db.rollupHistory() == 2
+    for column in ("templ", "humid") :
+        rolled = db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00", 3600, column)
+        c = db.connection.cursor()
+        c.execute("DELETE FROM rollup_mark")
+        db.connection.commit()
+        _same(rolled, db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00", 3600, column))
+        c.execute("INSERT INTO rollup_mark (id, last_id, hour) SELECT 1, max(id), '2026-10-19 00:00:00' FROM history")
+        db.connection.commit()
+    res = db.aggregate("2026-10-17 10:00:00", "2026-10-17 11:00:00", macs=MACS[:1])
+    assert res[0]['max'] == 99.0
+
+def test_rollup_skips_current_hour( db, monkeypatch ) :
+    ## 現在の時間の行は集計せず、次の時間になってから集計する
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    db.appendDataMany([ {'mac':MACS[0], 'date':"2026-10-17 10:00:00", 'node':1, 'templ':20.0, 'humid':50.0},
+                        {'mac':MACS[0], 'date':now, 'node':1, 'templ':21.0, 'humid':50.0},
+                        {'mac':MACS[1], 'date':"2026-10-17 11:00:00", 'node':1, 'templ':22.0, 'humid':50.0} ])
+    assert db.rollupHistory() == 1
+    c = db.connection.cursor()
+    c.execute("SELECT last_id FROM rollup_mark")
+    assert c.fetchone()[0] == 1      # 現在の時間の行（id 2）の手前まで
+    assert db.rollupHistory() == 0   # id 3 は現在の時間の行の後なので次の時間に集計
+    ## 次の時間になった
+    strftime = time.strftime
+    hour = (datetime.datetime.now() + datetime.timedelta(hours=1)).strftime("%Y-%m-%d %H:00:00")
+    monkeypatch.setattr(time, "strftime", lambda fmt, *args : hour if fmt == "%Y-%m-%d %H:00:00" and len(args) == 0 else strftime(fmt, *args))
+    assert db.rollupHistory() == 2
+    c.execute("SELECT last_id FROM rollup_mark")
+    assert c.fetchone()[0] == 3
+    c.execute("SELECT mac, hour FROM rollup_hour ORDER BY mac, hour")
+    assert c.fetchall() == [ (MACS[0], "2026-10-17 10:00:00"), (MACS[0], now[:13] + ":00:00"), (MACS[1], "2026-10-17 11:00:00") ]
+
+def test_aggregate_values( db ) :
+    datas = _fill(db)
+    res = db.aggregate("2026-10-17 10:00:00", "2026-10-17 11:00:00", macs=MACS[:1])
+    values = [ d['templ'] for d in datas if d['mac'] == MACS[0] and d['date'].startswith("2026-10-17 10:") ]
+    assert len(res) == 1
+    assert (res[0]['start'], res[0]['n'], res[0]['min'], res[0]['max']) == ("2026-10-17 10:00:00", len(values), min(values), max(values))
+    assert res[0]['mean'] == pytest.approx(sum(values) / len(values))
+    with pytest.raises(ValueError) :
+        db.aggregate("2026-10-17 10:00:00", "2026-10-17 11:00:00", column="light")
+
+def test_percentiles( db ) :
+    _fill(db)
+    db.rollupHistory()
+    plain = db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00", 21600, "humid")
+    res = db.aggregate("2026-10-17 00:00:00", "2026-10-19 00:00:00", 21600, "humid", percentiles=(50, 90))
+    _same(res, plain)
+    for r in res :
+        assert r['min'] <= r['p50'] <= r['p90'] <= r['max']
+
+def test_percentiles_pure_python( monkeypatch ) :
+    values = [ 5.0, 1.0, 4.0, 2.0, 3.0, 10.0 ]
+    expect = libSQLite._percentiles(values, (0, 25, 50, 90, 100))
+    monkeypatch.setattr(libSQLite, "np", None)
+    assert libSQLite._percentiles(values, (0, 25, 50, 90, 100)) == pytest.approx(expect)
+    assert libSQLite._percentiles([7.0], (50,)) == [7.0]
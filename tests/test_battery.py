@@ -0,0 +1,45 @@
+"""libSQLite の電池交換日の予測（batt_fit・battForecast）"""
+import pytest
+
+from libSQLite import SQL, battForecast
+
+MAC = "49:24:11:00:00:01"
+
+def _data( date, batt ) -> dict :
+    return {'mac':MAC, 'date':date, 'node':1, 'templ':25.0, 'humid':50.0, 'batt':batt}
+
+def test_batt_fit_forecast( db ) :
+    ## 1日に2%ずつ減る  95% → 交換(15%)まで 40日
+    db.appendDataMany([ _data(f"2026-10-{d:02} 12:00:00", 95.0 - 2 * (d - 1)) for d in range(1, 6) ])
+    fc = db.getBattForecastAll()[MAC]
+    assert fc['slope'] == pytest.approx(2.0)
+    assert fc['date'] == "2026-11-10"
+    assert fc['batt'] == 87.0
+
+def test_batt_fit_reset_on_replace( db ) :
+    db.appendDataMany([ _data(f"2026-10-{d:02} 12:00:00", 50.0 - d) for d in range(1, 6) ])
+    db.appendData(_data("2026-10-06 12:00:00", 100.0))    # 電池交換
+    c = db.connection.cursor()
+    c.execute("SELECT t0, n, sx, sy, batt FROM batt_fit WHERE mac=?", (MAC,))
+    assert c.fetchone() == ("2026-10-06 12:00:00", 1, 0, 100.0, 100.0)
+    assert db.getBattForecastAll()[MAC]['date'] == None
+
+def test_batt_forecast_not_enough() :
+    fit = {'t0':"2026-10-01 00:00:00", 'n':2, 'sx':1.0, 'sy':180.0, 'sxx':1.0, 'sxy':88.0, 'batt':88.0, 'date':"2026-10-02 00:00:00"}
+    assert battForecast(fit, min_days=2)['date'] == None          # 期間が短い
+    res = battForecast(fit, min_days=1)
+    assert (res['slope'], res['date']) == (pytest.approx(4.0), "2026-10-20")   # 92%から1日4%  19.25日後
+    fit.update(sxy=92.0)                                          # 増えている
+    assert battForecast(fit, min_days=1)['date'] == None
+    assert battForecast(dict(fit, n=1))['slope'] == None
+
+def test_batt_fit_seed_from_history( db ) :
+    ## batt_fit の無いDATABASE（旧バージョン）は history から作成（電池の無い行は除く）
+    db.appendDataMany([ _data(f"2026-10-{d:02} 12:00:00", None if d % 2 == 0 else 95.0 - 2 * (d - 1)) for d in range(1, 8) ])
+    before = db.getBattForecastAll()[MAC]
+    c = db.connection.cursor()
+    c.execute("DROP TABLE batt_fit")
+    db.connection.commit()
+    after = SQL("SETUP").getBattForecastAll()[MAC]
+    assert after == before
+    assert (after['batt'], after['slope']) == (83.0, pytest.approx(2.0))
@@ -0,0 +1,74 @@
+"""libSQLite の設定（conf）の差分更新"""
+import datetime
+
+import config as C
+
+NODE = {'mac':"00:00:00:00:00:01", 'name':"NODE1", 'node':"LORA01", 'use':"", 'warn':"", 'ambient_conf':"", 'discord_token':"", 'memo':""}
+
+def _sens( i, use=1, warn="NONE,NONE,35,40", node=1, **kw ) -> dict :
+    d = {'mac':f"49:24:11:00:00:0{i}", 'name':f"S{i}", 'node':node, 'use':use, 'warn':warn, 'ambient_conf':"", 'discord_token':"", 'memo':""}
+    d.update(kw)
+    return d
+
+def _notify( S ) -> dict :
+    return { n['mac']:n for n in S.getNotifyList(0) }
+
+def _setup( S ) :
+    ok, mess = S.updateSystemConf([ dict(NODE), _sens(1), _sens(2), _sens(3), _sens(4, use=0) ], datetime.datetime(2026, 10, 1))
+    assert ok
+    ## 判定済の状態にする
+    c = S.connection.cursor()
+    c.execute("UPDATE notify SET status=?, count=3, date='2026-10-19 10:00:00'", (C.SENS_ST.HIGH_WARN,))
+    S.connection.commit()
+
+
+def test_diff( db ) :
+    _setup(db)
+    data = [ dict(NODE), _sens(1), _sens(2, warn="NONE,NONE,30,40"), _sens(4, use=True), _sens(5, mac="49:24:11:00:00:05".upper()) ]
+    diff = db.diffSystemConf(data)
+    assert [ d['mac'] for d in diff['insert'] ] == ["49:24:11:00:00:05"]
+    assert [ (d['mac'], changed) for d, changed in diff['update'] ] == [ ("49:24:11:00:00:02", ['warn']), ("49:24:11:00:00:04", ['use']) ]
+    assert diff['delete'] == ["49:24:11:00:00:03"]
+    assert diff['same'] == 2
+
+def test_diff_same_value_other_type( db ) :
+    ## GASのJSONの数値・真偽値とSQLiteの文字列は同じ値なら変更なし
+    _setup(db)
+    diff = db.diffSystemConf([ dict(NODE), _sens(1, use=True, node=1.0), _sens(2, node="1"), _sens(3), _sens(4, use=False) ])
+    assert (diff['insert'], diff['update'], diff['delete'], diff['same']) == ([], [], [], 5)
+
+def test_update_keeps_notify( db ) :
+    _setup(db)
+    before = _notify(db)
+    assert set(before) == { f"49:24:11:00:00:0{i}" for i in (1, 2, 3) }
+    data = [ dict(NODE), _sens(1), _sens(2, warn="NONE,NONE,30,40"), _sens(4), _sens(5), _sens(6, use=0), _sens(7, node=2) ]
+    ok, mess = db.updateSystemConf(data, datetime.datetime(2026, 10, 2), "hash")
+    assert ok
+    after = _notify(db)
+    ## 変更の無いセンサーは状態を保持
+    assert after["49:24:11:00:00:01"] == before["49:24:11:00:00:01"]
+    ## 閾値の変更は判定し直す
+    assert (after["49:24:11:00:00:02"]['status'], after["49:24:11:00:00:02"]['count']) == (C.SENS_ST.NONE, 0)
+    ## 削除・無効は通知しない  有効・追加は status NONE
+    assert "49:24:11:00:00:03" not in after
+    assert "49:24:11:00:00:06" not in after
+    for mac in ("49:24:11:00:00:04", "49:24:11:00:00:05") :
+        assert (after[mac]['status'], after[mac]['count']) == (C.SENS_ST.NONE, 0)
+    assert str(after["49:24:11:00:00:07"]['node']) == "2"
+    sensors, nodes = db.getSensorConfAll()
+    assert sensors["49:24:11:00:00:02"]['warn']['hW'] == 30.0
+    assert "49:24:11:00:00:03" not in sensors
+    assert nodes == {1:"NODE1"}
+
+def test_update_node_move( db ) :
+    _setup(db)
+    db.updateSystemConf([ dict(NODE), _sens(1, node=2), _sens(2), _sens(3), _sens(4, use=0) ], datetime.datetime(2026, 10, 2))
+    n = _notify(db)["49:24:11:00:00:01"]
+    assert (str(n['node']), n['status'], n['count']) == ("2", C.SENS_ST.HIGH_WARN, 3)
+
+def test_update_same_date( db ) :
+    _setup(db)
+    assert db.updateSystemConf([ dict(NODE) ], datetime.datetime(2026, 10, 1)) == (False, "")
+    assert len(_notify(db)) == 3
+    ok, mess = db.updateSystemConf([], datetime.datetime(2026, 10, 2))
+    assert ok == None
@@ -0,0 +1,73 @@
+"""libLORA の一括デコード（decode_frame / decode_records_np）"""
+import datetime
+import struct
+import time
+
+import pytest
+
+L = pytest.importorskip("libLORA", reason="pyserial / RPi.GPIO not installed")
+
+
+def _frame( recs:list ) -> bytes :
+    return b''.join( L.data_pack(*r) for r in recs )
+
+def _np_decode( payload:bytes, rssi=-80 ) :
+    np = pytest.importorskip("numpy")
+    size = L.DATA_STRUCT.size
+    num = len(payload) // size
+    day_start, day_end = L._day_range(datetime.date.today())
+    return L.decode_records_np(payload[:num * size], np.full(num, rssi), np.full(num, day_start), np.full(num, day_end))
+
+
+NOW = int(time.mktime(datetime.date.today().timetuple())) + 12 * 3600   # 本日12時
+GOOD = [ (1, 7, "49:24:11:00:00:01", NOW, 25.3, 60.0, 90, -70, 1),
+         (1, 7, "00:00:00:00:00:01", NOW, 45.0, 5.1, 80, 0, 0) ]
+BAD = [ (0, 7, "49:24:11:00:00:02", NOW, 20.0, 50.0, 90, -70, 1),                 # NODE 0
+        (100, 7, "49:24:11:00:00:03", NOW, 20.0, 50.0, 90, -70, 1),               # NODE 100
+        (1, 7, "49:24:11:00:00:04", NOW - 3 * 86400, 20.0, 50.0, 90, -70, 1),     # 別の日
+        (1, 7, "49:24:11:00:00:05", NOW, 20.0, 50.0, 90, -70, 11) ]               # STATUS 11
+
+
+def test_decode_frame_values() :
+    node, ch, seq, recs = L.decode_frame(_frame(GOOD), -90)
+    assert (node, seq) == (1, 7)
+    assert [ r['mac'] for r in recs ] == ["49:24:11:00:00:01", "00:00:00:00:00:01"]
+    assert recs[0]['templ'] == pytest.approx(25.3)
+    assert recs[0]['rssi'] == -70      # センサーはレコードのRSSI
+    assert recs[1]['rssi'] == -90      # Node本体はフレームのRSSI
+    assert recs[0]['date'] == time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(NOW))
+
+def test_decode_frame_drops_malformed_records() :
+    link = L.LinkRegistry()
+    payload = _frame(BAD[:2] + GOOD + BAD[2:])
+    node, _, _, recs = L.decode_frame(payload, -90, link=link)
+    assert node == 1
+    assert [ r['mac'] for r in recs ] == [ g[2] for g in GOOD ]
+
+def test_decode_frame_trailing_bytes() :
+    payload = _frame(GOOD) + b'\x01\x02\x03'
+    _, _, _, recs = L.decode_frame(payload, -90)
+    assert len(recs) == len(GOOD)
+
+def test_decode_frame_empty_and_short() :
+    assert L.decode_frame(b'', -90) == (None, 0, 0, [])
+    assert L.decode_frame(_frame(GOOD)[:L.DATA_STRUCT.size - 1], -90)[3] == []
+
+@pytest.mark.parametrize("recs", [GOOD, BAD, BAD[:2] + GOOD + BAD[2:], GOOD * 20])
+def test_decode_frame_matches_numpy( recs ) :
+    payload = _frame(recs)
+    _, _, _, expect = L.decode_frame(payload, -90)
+    records, rejected = _np_decode(payload, -90)
+    assert records == expect
+    assert rejected == len(recs) - len(expect)
+
+def test_decode_frame_matches_data_unpack() :
+    for r in GOOD :
+        data = L.data_pack(*r)
+        node, ch, seq, mac, time_s, templ, humid, batt, rssi, stat = L.data_unpack(data)
+        rec = L.decode_frame(data, rssi)[3][0]
+        assert (rec['mac'], rec['templ'], rec['humid'], rec['batt'], rec['status']) == (mac, templ, humid, batt, stat)
+
+def test_mac_roundtrip() :
+    for mac in ("49:24:11:00:ab:ff", "00:00:00:00:00:01") :
+        assert L.MAC_decode(L.MAC_encode(mac)) == mac
@@ -0,0 +1,132 @@
+"""libJudge の判定エンジン（JudgeEngine）"""
+import datetime
+
+import pytest
+
+import config as C
+import libJudge as J
+
+NOW = datetime.datetime.now()
+
+def _ago( minute ) -> str :
+    return (NOW - datetime.timedelta(minutes=minute)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _mac( i ) -> str :
+    return f"49:24:11:00:00:{i:02x}"
+
+
+## ( notify status, count, notify date(分前), latest templ or None, latest date(分前) )
+CASES = [
+    (C.SENS_ST.NORMAL,       0, 1,  20.0, 1),    # 正常
+    (C.SENS_ST.NORMAL,       0, 1,  36.0, 1),    # 高温注意 初回
+    (C.SENS_ST.HIGH_WARN,    1, 1,  36.0, 1),    # 高温注意 5分経過していない
+    (C.SENS_ST.HIGH_WARN,    1, 6,  36.0, 6),    # 高温注意 5分経過
+    (C.SENS_ST.NORMAL,       0, 1,  41.0, 1),    # 高温警告
+    (C.SENS_ST.HIGH_CAUTION, 3, 1,  45.0, 1),    # 高温警告 継続
+    (C.SENS_ST.HIGH_WARN,    2, 1,  40.0, 1),    # 高温注意 → 高温警告
+    (C.SENS_ST.NORMAL,       0, 20, None, 0),    # LOST
+    (C.SENS_ST.LOST,         2, 20, None, 0),    # LOST 継続
+    (C.SENS_ST.NORMAL,       0, 5,  None, 0),    # 15分経過していない
+    (C.SENS_ST.NONE,         0, 20, None, 0),    # 未接続
+    (C.SENS_ST.HIGH_WARN,    1, 20, None, 0),    # 高温注意のまま未受信
+]
+
+
+@pytest.fixture
+def fixture( db ) :
+    c = db.connection.cursor()
+    c.execute("INSERT INTO conf (mac, name, node, use, warn) VALUES ('00:00:00:00:00:01', 'NODE1', 'LORA01', '', '')")
+    for i, (status, count, n_ago, templ, l_ago) in enumerate(CASES) :
+        c.execute("INSERT INTO conf (mac, name, node, use, warn) VALUES (?, ?, '1', 1, 'NONE,NONE,35,40')", (_mac(i), f"S{i}"))
+        c.execute("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?, ?, ?, 0, ?, '1')", (_mac(i), _ago(n_ago), status, count))
+        if templ != None :
+            c.execute("INSERT INTO latest (mac, date, node, templ, humid, batt, rssi, status) VALUES (?, ?, 1, ?, 50.0, 3.0, -80, 0)",
+                      (_mac(i), _ago(l_ago), templ))
+    ## Node本体は判定しない
+    c.execute("INSERT INTO notify (mac, date, status, notify, count, node) VALUES ('00:00:00:00:00:01', ?, 1, 0, 0, '1')", (_ago(1),))
+    c.execute("INSERT INTO latest (mac, date, node, templ, humid, batt, rssi, status) VALUES ('00:00:00:00:00:01', ?, 1, 30.0, 40.0, 3.0, -60, 0)", (_ago(1),))
+    db.connection.commit()
+    return db
+
+
+def test_engine_matches_legacy( fixture ) :
+    S = fixture
+    latest, notify = S.getLatestAll(delete=False), S.getNotifyList(0)
+    engine = J.JudgeEngine.load(S).judge(latest, notify, now=NOW)
+    legacy = J._legacy_judge(S, latest, notify)
+    assert legacy == [ (t['mac'], t['status'], t['count']) for t in engine ]
+
+def test_engine_transitions( fixture ) :
+    S = fixture
+    res = { t['mac']:(t['status'], t['count']) for t in J.JudgeEngine.load(S).judge(S.getLatestAll(delete=False), S.getNotifyList(0), now=NOW) }
+    expect = {
+        0:(C.SENS_ST.NORMAL, 0), 1:(C.SENS_ST.HIGH_WARN, 1), 3:(C.SENS_ST.HIGH_WARN, 2),
+        4:(C.SENS_ST.HIGH_CAUTION, 1), 5:(C.SENS_ST.HIGH_CAUTION, 4), 6:(C.SENS_ST.HIGH_CAUTION, 1),
+        7:(C.SENS_ST.LOST, 1), 8:(C.SENS_ST.LOST, 3),
+    }
+    assert res == { _mac(i):v for i, v in expect.items() }
+
+def test_engine_sensor_info( fixture ) :
+    E = J.JudgeEngine.load(fixture)
+    E.judge(fixture.getLatestAll(delete=False), fixture.getNotifyList(0), now=NOW)
+    name, node_name, node, warn = E.sensorInfo(_mac(4))
+    assert (name, node_name, node, warn['hW'], warn['hC']) == ("S4", "NODE1", 1, 35.0, 40.0)
+    assert E.templ(_mac(4)) == 41.0
+    assert E.sensorInfo("ff:ff:ff:ff:ff:ff") == (None, None, None, None)
+
+
+def _trend( slope, n=5, stuck=0, stuck_ago=0 ) -> dict :
+    return {'slope':slope, 'n':n, 'stuck':stuck, 'stuck_date':_ago(stuck_ago)}
+
+def _judge_one( trend, status=C.SENS_ST.NORMAL, count=0, n_ago=1, templ=25.0 ) :
+    mac = _mac(1)
+    E = J.JudgeEngine({mac:{'name':"S1", 'node':1, 'warn':{'lC':None, 'lW':None, 'hW':35.0, 'hC':40.0}}}, {1:"NODE1"},
+                      {mac:trend} if trend != None else {})
+    latest = [ {'mac':mac, 'date':_ago(0), 'templ':templ} ]
+    notify = [ {'mac':mac, 'node':"1", 'date':_ago(n_ago), 'status':status, 'count':count} ]
+    res = E.judge(latest, notify, now=NOW)
+    return (res[0]['status'], res[0]['count']) if len(res) != 0 else None
+
+def test_trend_rise() :
+    rise = C.TREND['RISE']
+    assert _judge_one(None) == (C.SENS_ST.NORMAL, 0)
+    assert _judge_one(_trend(rise, n=C.TREND['MIN_SAMPLES'] - 1)) == (C.SENS_ST.NORMAL, 0)   # 計測回数不足
+    assert _judge_one(_trend(rise)) == (C.SENS_ST.RISE_WARN, 1)
+    ## 5分以内は再通知しない / 5分経過でカウントアップ / 半分未満で解除
+    assert _judge_one(_trend(rise), C.SENS_ST.RISE_WARN, 1, n_ago=1) == None
+    assert _judge_one(_trend(rise / 2), C.SENS_ST.RISE_WARN, 1, n_ago=6) == (C.SENS_ST.RISE_WARN, 2)
+    assert _judge_one(_trend(rise / 2 - 0.01), C.SENS_ST.RISE_WARN, 2) == (C.SENS_ST.NORMAL, 0)
+    ## 閾値の判定が優先
+    assert _judge_one(_trend(rise), templ=41.0) == (C.SENS_ST.HIGH_CAUTION, 1)
+
+def test_trend_stuck() :
+    stuck = C.TREND['STUCK']
+    samples = C.TREND['MIN_SAMPLES']
+    assert _judge_one(_trend(0, stuck=samples, stuck_ago=stuck + 1)) == (C.SENS_ST.STUCK, 1)
+    assert _judge_one(_trend(0, stuck=samples, stuck_ago=stuck - 1)) == (C.SENS_ST.NORMAL, 0)
+    assert _judge_one(_trend(0, stuck=samples - 1, stuck_ago=stuck + 1)) == (C.SENS_ST.NORMAL, 0)
+    ## 通知は1回（状態・カウントはそのまま 日時のみ更新）
+    assert _judge_one(_trend(0, stuck=samples, stuck_ago=stuck + 1), C.SENS_ST.STUCK, 1) == (C.SENS_ST.STUCK, 1)
+
+@pytest.mark.parametrize("status", [C.SENS_ST.STUCK, C.SENS_ST.RISE_WARN])
+def test_trend_then_lost( status ) :
+    ## STUCK・RISE_WARN のまま受信が途絶えたら LOST
+    mac = _mac(1)
+    E = J.JudgeEngine({}, {}, {mac:_trend(0, stuck=C.TREND['MIN_SAMPLES'], stuck_ago=C.TREND['STUCK'] + 1)})
+    notify = [ {'mac':mac, 'node':"1", 'date':_ago(J.LOST_MINUTE + 1), 'status':status, 'count':1} ]
+    assert [ (t['status'], t['count']) for t in E.judge([], notify, now=NOW) ] == [ (C.SENS_ST.LOST, 1) ]
+    notify[0]['date'] = _ago(J.LOST_MINUTE - 1)
+    assert E.judge([], notify, now=NOW) == []
+
+def test_stuck_refreshes_notify_date( db ) :
+    ## STUCK が続いている間は notify の日時のみ更新（再通知しない）→ 途絶えてから15分で LOST
+    mac = _mac(1)
+    c = db.connection.cursor()
+    c.execute("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?, ?, ?, 0, 1, '1')", (mac, _ago(120), C.SENS_ST.STUCK))
+    db.connection.commit()
+    E = J.JudgeEngine({}, {}, {mac:_trend(0, stuck=C.TREND['MIN_SAMPLES'], stuck_ago=C.TREND['STUCK'] + 1)})
+    assert db.updateNotifyMany(E.judge([ {'mac':mac, 'date':_ago(0), 'templ':25.0} ], db.getNotifyList(0))) == 0
+    n = db.getNotifyList(0)[0]
+    assert (n['status'], n['count'], n['notify']) == (C.SENS_ST.STUCK, 1, 0)
+    assert n['date'] > _ago(1)
+    assert E.judge([], db.getNotifyList(0)) == []
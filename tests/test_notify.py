@@ -0,0 +1,17 @@
+"""libSQLite の通知リスト（notify）"""
+import config as C
+
+
+def test_clear_notify_per_node( db ) :
+    ## ノードを指定して通知済にした場合、他のノードの通知フラグは残す
+    c = db.connection.cursor()
+    c.executemany("INSERT INTO notify (mac, date, status, notify, count, node) VALUES (?, '2026-10-19 10:00:00', ?, 1, 1, ?)",
+                  [ ("49:24:11:00:00:01", C.SENS_ST.HIGH_WARN, "1"), ("49:24:11:00:00:02", C.SENS_ST.LOST, "2"),
+                    ("49:24:11:00:00:03", C.SENS_ST.HIGH_CAUTION, "2") ])
+    db.connection.commit()
+    assert [ n['mac'] for n in db.getNotifyList(1, ClearfNotify=True) ] == ["49:24:11:00:00:01"]
+    assert db.getNotifyList(1, ClearfNotify=True) == []
+    assert [ n['mac'] for n in db.getNotifyList(2, ClearfNotify=True) ] == ["49:24:11:00:00:02", "49:24:11:00:00:03"]
+    ## 状態は変えない
+    assert [ (n['status'], n['count']) for n in db.getNotifyList(0) ] == \
+           [ (C.SENS_ST.HIGH_WARN, 1), (C.SENS_ST.LOST, 1), (C.SENS_ST.HIGH_CAUTION, 1) ]
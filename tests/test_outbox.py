@@ -0,0 +1,68 @@
+"""libSQLite の Cloud送信データ（outbox）"""
+import time
+
+import config as C
+
+
+def _states( S ) -> dict :
+    c = S.connection.cursor()
+    c.execute("SELECT id, state, attempts, next_try, last_error FROM outbox")
+    return { r[0]:r[1:] for r in c.fetchall() }
+
+
+def test_enqueue_and_get( db ) :
+    assert db.enqueueOutbox([ ("gas", "all", {'a':1}), ("ambient", 10, {'d1':25.0}) ]) == 2
+    rows = db.getOutbox("ambient", limit=10)
+    assert [ (r['key'], r['payload'], r['attempts']) for r in rows ] == [ ("10", {'d1':25.0}, 0) ]
+
+def test_enqueue_deletes_latest( db ) :
+    db.appendData({'mac':"49:24:11:00:00:01", 'date':"2026-10-19 10:00:00", 'node':1, 'templ':20.0})
+    db.enqueueOutbox([ ("gas", "all", {}) ], latest=[ ("49:24:11:00:00:01", "2026-10-19 10:00:00") ])
+    assert db.getLatestAll(delete=False) == []
+
+def test_limit_per_key( db ) :
+    ## 50チャンネル × 5サイクル  limit 3 なら各チャンネル3件ずつ
+    db.enqueueOutbox([ ("ambient", ch, {'cycle':i}) for i in range(5) for ch in range(50) ])
+    rows = db.getOutbox("ambient", limit=3)
+    assert len(rows) == 150
+    per_key = {}
+    for r in rows : per_key.setdefault(r['key'], []).append(r['payload']['cycle'])
+    assert all( v == [0, 1, 2] for v in per_key.values() )
+    assert [ r['id'] for r in rows ] == sorted( r['id'] for r in rows )
+
+def test_mark_backoff( db, monkeypatch ) :
+    monkeypatch.setattr(C, "OUTBOX_BACKOFF", 30)
+    monkeypatch.setattr(C, "OUTBOX_BACKOFF_MAX", 100)
+    db.enqueueOutbox([ ("gas", "all", {}) ])
+    oid = db.getOutbox("gas", limit=10)[0]['id']
+    waits = list()
+    for _ in range(4) :
+        now = time.time()
+        assert db.markOutbox([oid], False, "timeout")
+        state, attempts, next_try, error = _states(db)[oid]
+        waits.append(round(next_try - now))
+        assert (state, error) == (C.OUTBOX_ST.PENDING, "timeout")
+    assert attempts == 4
+    assert waits == [30, 60, 100, 100]     # 失敗毎に2倍 上限 OUTBOX_BACKOFF_MAX
+    ## 次回送信時刻まで取得しない
+    assert db.getOutbox("gas", limit=10) == []
+
+def test_mark_dead( db, monkeypatch ) :
+    monkeypatch.setattr(C, "OUTBOX_MAX_ATTEMPTS", 3)
+    db.enqueueOutbox([ ("gas", "all", {}) ])
+    oid = db.getOutbox("gas", limit=10)[0]['id']
+    for _ in range(2) : db.markOutbox([oid], False)
+    assert _states(db)[oid][0] == C.OUTBOX_ST.PENDING
+    db.markOutbox([oid], False)
+    assert _states(db)[oid][:2] == (C.OUTBOX_ST.DEAD, 3)
+    assert db.getOutboxStats()['gas']['dead'] == 1
+
+def test_mark_sent( db ) :
+    db.enqueueOutbox([ ("gas", "all", {}), ("gas", "all", {}) ])
+    ids = [ r['id'] for r in db.getOutbox("gas", limit=10) ]
+    db.markOutbox(ids[:1], False, "error")
+    assert db.markOutbox(ids, True)
+    assert [ s[0] for s in _states(db).values() ] == [C.OUTBOX_ST.SENT] * 2
+    assert all( s[3] == "" for s in _states(db).values() )
+    assert db.getOutboxStats() == {}
+    assert db.markOutbox([], False)
@@ -0,0 +1,47 @@
+"""libSQLite の sensor_state（センサー毎の最新状態 history登録時に更新）"""
+from libSQLite import SQL
+
+MAC = "49:24:11:00:00:01"
+
+def _data( date, templ=25.0, humid=50.0, batt=None, mac=MAC, **kw ) -> dict :
+    d = {'mac':mac, 'date':date, 'node':1, 'templ':templ, 'humid':humid, 'batt':batt, 'rssi':-80, 'ext':None, 'status':0}
+    d.update(kw)
+    return d
+
+
+def test_state_latest_and_samples( db ) :
+    db.appendDataMany([ _data("2026-10-18 23:50:00", batt=90.0), _data("2026-10-19 00:10:00", 26.0),
+                        _data("2026-10-19 00:20:00", 27.0) ])
+    st = db.getSensorStateAll()[MAC]
+    assert (st['date'], st['templ'], st['day'], st['samples']) == ("2026-10-19 00:20:00", 27.0, "2026-10-19", 2)
+    ## 電池の無いデータでは電池残量・日時を更新しない
+    assert (st['batt'], st['batt_date']) == (90.0, "2026-10-18 23:50:00")
+
+def test_state_ignores_old_rows( db ) :
+    db.appendData(_data("2026-10-19 10:00:00", 30.0, ext=1))
+    db.appendData(_data("2026-10-19 09:00:00", 10.0, batt=50.0))     # 再送・再生
+    st = db.getSensorStateAll()[MAC]
+    assert (st['date'], st['templ'], st['batt'], st['samples']) == ("2026-10-19 10:00:00", 30.0, None, 1)
+    ## ext・status は値の有るデータのみ更新
+    db.appendData(_data("2026-10-19 10:10:00", 31.0, status=None))
+    st = db.getSensorStateAll()[MAC]
+    assert (st['ext'], st['status']) == (1, 0)
+
+def test_state_matches_history( db ) :
+    db.appendDataMany([ _data(f"2026-10-19 10:{m:02}:00", 20.0 + m, mac=f"49:24:11:00:00:{m % 3:02}") for m in range(9) ])
+    c = db.connection.cursor()
+    c.execute("SELECT mac, max(date), templ FROM history GROUP BY mac")
+    assert { r[0]:(r[1], r[2]) for r in c.fetchall() } == { m:(s['date'], s['templ']) for m, s in db.getSensorStateAll().items() }
+
+def test_state_seed_from_history( db, tmp_path, monkeypatch ) :
+    ## sensor_state の無いDATABASE（旧バージョン）に history が有る場合
+    db.appendDataMany([ _data("2026-10-01 10:00:00", batt=80.0), _data("2026-10-02 10:00:00", 21.0),
+                        _data("2026-10-02 10:00:00", 22.0, mac="49:24:11:00:00:02") ])
+    c = db.connection.cursor()
+    c.execute("DROP TABLE sensor_state")
+    db.connection.commit()
+    S = SQL("SETUP")
+    st = S.getSensorStateAll()
+    assert (st[MAC]['date'], st[MAC]['templ'], st[MAC]['batt'], st[MAC]['batt_date'], st[MAC]['samples']) == \
+           ("2026-10-02 10:00:00", 21.0, 80.0, "2026-10-01 10:00:00", 1)
+    assert (st["49:24:11:00:00:02"]['batt'], st["49:24:11:00:00:02"]['batt_date']) == (None, None)
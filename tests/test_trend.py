@@ -0,0 +1,51 @@
+"""libSQLite の温度の傾向（sensor_trend history登録時に更新）"""
+import datetime
+
+import pytest
+
+import config as C
+
+MAC = "49:24:11:00:00:01"
+NODE = "00:00:00:00:00:01"
+
+def _data( date, templ=25.0, humid=50.0, batt=None, mac=MAC, **kw ) -> dict :
+    d = {'mac':mac, 'date':date, 'node':1, 'templ':templ, 'humid':humid, 'batt':batt, 'rssi':-80, 'ext':None, 'status':0}
+    d.update(kw)
+    return d
+
+
+def _trend_of( S, mac=MAC ) -> dict :
+    return S.getSensorTrendAll().get(mac)
+
+def test_trend_ewma_slope( db ) :
+    base = datetime.datetime(2026, 10, 19, 10, 0, 0)
+    templ = [ 20.0 + m for m in range(8) ]      # 1℃/分
+    db.appendDataMany([ _data((base + datetime.timedelta(minutes=m)).strftime("%Y-%m-%d %H:%M:%S"), t) for m, t in enumerate(templ) ])
+    ## SQLと同じ式をPythonで計算
+    ewma, slope = templ[0], 0.0
+    for prev, t in zip(templ, templ[1:]) :
+        ewma = (ewma * C.TREND['TAU'] + t) / (C.TREND['TAU'] + 1)
+        slope = (slope * C.TREND['SLOPE_TAU'] + t - prev) / (C.TREND['SLOPE_TAU'] + 1)
+    tr = _trend_of(db)
+    assert (tr['n'], tr['templ'], tr['stuck']) == (8, 27.0, 0)
+    assert tr['ewma'] == pytest.approx(ewma)
+    assert tr['slope'] == pytest.approx(slope)
+    assert tr['slope'] >= C.TREND['RISE']
+    ## Node本体・温度の無い行は対象外
+    db.appendData(_data("2026-10-19 10:09:00", mac=NODE))
+    db.appendData({'mac':"49:24:11:00:00:09", 'date':"2026-10-19 10:09:00", 'node':1})
+    assert set(db.getSensorTrendAll()) == {MAC}
+
+def test_trend_gap_and_stuck( db ) :
+    db.appendDataMany([ _data("2026-10-19 10:00:00", 20.0), _data("2026-10-19 10:01:00", 22.0) ])
+    db.appendData(_data("2026-10-19 11:00:00", 30.0))      # GAP以上空いたらやり直す
+    tr = _trend_of(db)
+    assert (tr['n'], tr['ewma'], tr['slope']) == (1, 30.0, 0)
+    for m in range(1, 4) : db.appendData(_data(f"2026-10-19 11:{m:02}:00", 30.0))
+    tr = _trend_of(db)
+    assert (tr['stuck'], tr['stuck_date']) == (3, "2026-10-19 11:00:00")
+    db.appendData(_data("2026-10-19 11:04:00", 30.0, humid=51.0))
+    tr = _trend_of(db)
+    assert (tr['stuck'], tr['stuck_date']) == (0, "2026-10-19 11:04:00")
+    db.appendData(_data("2026-10-19 11:02:30", 99.0))      # 古いデータでは更新しない
+    assert _trend_of(db)['templ'] == 30.0